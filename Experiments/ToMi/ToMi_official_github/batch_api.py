@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+# Copyright (c) 2019-present, Facebook, Inc.
+# All rights reserved.
+#
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+
+# Evaluate through a provider's batch endpoint instead of interactive calls
+# (see tomi.batch_api):
+#
+#   python batch_api.py build tomi_dataset.csv -o batches/
+#   (upload batches/tomi_dataset.batch-*.jsonl, download the result files)
+#   python batch_api.py ingest tomi_dataset.csv results/*.jsonl \
+#       --trace data/train.trace data/val.trace data/test.trace
+
+import argparse
+import json
+import os
+from tomi.batch_api import DEFAULT_MODELS, PROVIDERS, SHARD_SIZE
+from tomi.batch_api import build_shards, ingest, read_results
+from tomi.evaluate import PARAMS, PROMPTS, Prompt, iter_questions, take_groups
+
+
+def dataset_name(opt):
+    if opt.name:
+        return opt.name
+    return os.path.splitext(os.path.basename(opt.dataset))[0]
+
+
+def questions(opt):
+    questions = iter_questions(opt.dataset, opt.trace)
+    if opt.num_stories is not None:
+        questions = take_groups(questions, opt.num_stories)
+    return questions
+
+
+def build(opt):
+    paths = build_shards(
+        questions(opt),
+        opt.out_dir,
+        dataset_name(opt),
+        opt.model or DEFAULT_MODELS[opt.provider],
+        Prompt(PROMPTS[opt.prompt]),
+        opt.provider,
+        PARAMS,
+        opt.shard_size,
+    )
+    for path in paths:
+        print(path)
+
+
+def ingest_results(opt):
+    results = read_results(opt.results)
+    predictions = open(opt.predictions, "w") if opt.predictions else None
+
+    def record(question, prediction, correct):
+        if predictions is not None:
+            entry = {
+                "group": question.group,
+                "kind": question.kind,
+                "tom": question.tom,
+                "question": question.question,
+                "answer": question.answer,
+                "prediction": prediction,
+                "correct": correct,
+            }
+            predictions.write(json.dumps(entry) + "\n")
+
+    try:
+        name = dataset_name(opt)
+        accuracy, counts = ingest(questions(opt), results, name, callback=record)
+    finally:
+        if predictions is not None:
+            predictions.close()
+    print(accuracy.summary())
+    print(", ".join(f"{k}: {v}" for k, v in counts.items()))
+    if opt.output:
+        with open(opt.output, "w") as fout:
+            json.dump(accuracy.as_dict(), fout, indent=2)
+
+
+def add_dataset_args(parser):
+    parser.add_argument("dataset", help="A split's .txt file or a per-group .csv")
+    parser.add_argument(
+        "--trace",
+        nargs="+",
+        default=None,
+        help="The dataset's .trace file(s), in order (see evaluate.py)",
+    )
+    parser.add_argument(
+        "--name",
+        default=None,
+        help="Custom id prefix (defaults to the dataset file name)",
+    )
+    parser.add_argument(
+        "--num-stories",
+        "-n",
+        type=int,
+        default=None,
+        help="Only use the first n story groups",
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    build_parser = commands.add_parser("build", help="Write batch-request JSONL")
+    add_dataset_args(build_parser)
+    build_parser.add_argument("--out-dir", "-o", default="batches")
+    build_parser.add_argument(
+        "--model",
+        "-m",
+        default=None,
+        help="Model to request (defaults to the provider's entry in DEFAULT_MODELS)",
+    )
+    build_parser.add_argument(
+        "--provider", choices=PROVIDERS, default="openai", help="Request format"
+    )
+    build_parser.add_argument(
+        "--prompt", choices=list(PROMPTS), default="original", help="System prompt"
+    )
+    build_parser.add_argument(
+        "--shard-size", type=int, default=SHARD_SIZE, help="Requests per file"
+    )
+    build_parser.set_defaults(run=build)
+
+    ingest_parser = commands.add_parser("ingest", help="Score batch result files")
+    add_dataset_args(ingest_parser)
+    ingest_parser.add_argument("results", nargs="+", help="Result JSONL files")
+    ingest_parser.add_argument(
+        "--output", "-o", default=None, help="Write per-category accuracy as JSON"
+    )
+    ingest_parser.add_argument(
+        "--predictions", default=None, help="Write every answer as a JSON line"
+    )
+    ingest_parser.set_defaults(run=ingest_results)
+
+    opt = parser.parse_args()
+    opt.run(opt)
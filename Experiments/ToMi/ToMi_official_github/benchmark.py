@@ -0,0 +1,262 @@
+#!/usr/bin/env python3
+# Copyright (c) 2019-present, Facebook, Inc.
+# All rights reserved.
+#
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+
+# Benchmarks for the generation and conversion pipeline.  Every measurement
+# runs in a fresh process, so peak RSS is per (stage, size, world) and not
+# polluted by earlier runs.  Results are written as JSON and can be compared
+# against a previous run with --compare:
+#
+#   python benchmark.py -o bench/before.json
+#   python benchmark.py -o bench/after.json --compare bench/before.json
+
+import argparse
+import contextlib
+import gc
+import io
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+
+STAGES = ["oracle", "generate_story", "generate_stories", "main", "create_tomi_csv"]
+DEFAULT_WORLD = os.path.join(os.path.dirname(__file__), "tomi", "world.json")
+
+
+def scaled_world(scale, out_dir):
+    # world.json with every entity list repeated `scale` times under new names
+    if scale == 1:
+        return DEFAULT_WORLD
+    with open(DEFAULT_WORLD, "r") as fin:
+        entities = json.load(fin)
+    scaled = {
+        typ: names + [f"{name}_{i}" for i in range(1, scale) for name in names]
+        for typ, names in entities.items()
+    }
+    path = os.path.join(out_dir, f"world_x{scale}.json")
+    with open(path, "w") as fout:
+        json.dump(scaled, fout)
+    return path
+
+
+def main_opt(num_stories, out_dir, world_file, seed=0):
+    return argparse.Namespace(
+        seed=seed,
+        num_stories=num_stories,
+        out_dir=out_dir,
+        world_file=world_file,
+        synthetic_world=None,
+        workers=1,
+        compression=None,
+        format="text",
+        index=False,
+        profile=False,
+        cprofile_dir=None,
+        long_steps=0,
+    )
+
+
+def setup_stage(stage, n, world_file, tmp_dir, seed=0):
+    # Build everything a stage needs outside the timed region; returns
+    # (run, units) where run() is timed and `units` is what it produces
+    import main
+    import create_tomi_csv
+    from tomi.oracle import Oracle
+    from tomi.story import generate_stories, generate_story
+    from tomi.world import World
+
+    world = World(world_file, rng=np.random.default_rng(seed))
+    if stage == "oracle":
+
+        def run():
+            for _ in range(n):
+                world.reset()
+                Oracle(world)
+
+        return run, n
+    if stage == "generate_story":
+
+        def run():
+            for _ in range(n):
+                world.reset()
+                generate_story(world)
+
+        return run, n
+    if stage == "generate_stories":
+        return (lambda: generate_stories(world, n)), n
+    out_dir = os.path.join(tmp_dir, "data")
+    os.makedirs(out_dir, exist_ok=True)
+    opt = main_opt(n, out_dir, world_file, seed)
+    # main() generates n story groups for each of the three splits
+    if stage == "main":
+        return (lambda: main.main(opt)), len(main.DATA_TYPES) * n
+    if stage == "create_tomi_csv":
+        main.main(opt)
+
+        def run():
+            for data_type in main.DATA_TYPES:
+                path = os.path.join(out_dir, f"{data_type}.txt")
+                groups = create_tomi_csv.parse_tomi_data(path)
+                create_tomi_csv.create_csv_data(groups)
+
+        return run, len(main.DATA_TYPES) * n
+    raise ValueError(f"Unknown stage: {stage}")
+
+
+def measure(job):
+    # Runs in a fresh process: time the stage, or trace its allocations
+    stage, n, world_file, trace, seed = job
+    with tempfile.TemporaryDirectory() as tmp_dir, contextlib.redirect_stderr(
+        io.StringIO()
+    ), contextlib.redirect_stdout(io.StringIO()):
+        run, units = setup_stage(stage, n, world_file, tmp_dir, seed)
+        gc.collect()
+        if trace:
+            tracemalloc.start()
+        start = time.perf_counter()
+        run()
+        seconds = time.perf_counter() - start
+        result = {"units": units, "seconds": seconds}
+        if trace:
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            result["traced_peak_bytes"] = peak
+        # ru_maxrss is in kilobytes on Linux
+        peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        result["peak_rss_bytes"] = peak_rss * 1024
+    return result
+
+
+def run_job(pool, stage, n, world_file, repeat, seed):
+    timings = [
+        pool.apply(measure, ((stage, n, world_file, False, seed),))
+        for _ in range(repeat)
+    ]
+    traced = pool.apply(measure, ((stage, n, world_file, True, seed),))
+    seconds = [t["seconds"] for t in timings]
+    units = timings[0]["units"]
+    return {
+        "units": units,
+        "seconds_min": min(seconds),
+        "seconds_median": statistics.median(seconds),
+        "stories_per_sec": units / min(seconds),
+        "peak_rss_bytes": max(t["peak_rss_bytes"] for t in timings),
+        "traced_peak_bytes": traced["traced_peak_bytes"],
+        "traced_bytes_per_story": traced["traced_peak_bytes"] / units,
+    }
+
+
+def environment():
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True,
+            text=True,
+        ).stdout.strip()
+    except OSError:
+        commit = ""
+    return {
+        "commit": commit or None,
+        "python": sys.version.split()[0],
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+
+
+def result_key(result):
+    return result["stage"], result["stories"], result["world_scale"]
+
+
+def compare(results, baseline_path):
+    # Print the speed and memory ratio of every benchmark found in both runs
+    with open(baseline_path, "r") as fin:
+        baseline = {result_key(r): r for r in json.load(fin)["results"]}
+    print(f"\nCompared with {baseline_path} (>1 is faster / smaller now)")
+    for result in results:
+        old = baseline.get(result_key(result))
+        if old is None:
+            continue
+        speed = result["stories_per_sec"] / old["stories_per_sec"]
+        memory = old["traced_peak_bytes"] / max(result["traced_peak_bytes"], 1)
+        stage, stories, scale = result_key(result)
+        print(
+            f"{stage:>18} n={stories:<7} world x{scale:<4} "
+            f"speed {speed:6.2f}x  traced memory {memory:6.2f}x"
+        )
+
+
+def main(opt):
+    results = []
+    # Fresh interpreter per measurement, independent of the parent's heap
+    pool = multiprocessing.get_context("spawn").Pool(1, maxtasksperchild=1)
+    try:
+        with tempfile.TemporaryDirectory() as world_dir:
+            for scale in opt.world_scales:
+                world_file = scaled_world(scale, world_dir)
+                for stage in opt.stages:
+                    for n in opt.sizes:
+                        result = {"stage": stage, "stories": n, "world_scale": scale}
+                        result.update(
+                            run_job(pool, stage, n, world_file, opt.repeat, opt.seed)
+                        )
+                        results.append(result)
+                        print(
+                            f"{stage:>18} n={n:<7} world x{scale:<4} "
+                            f"{result['stories_per_sec']:10.1f} stories/s  "
+                            f"rss {result['peak_rss_bytes'] / 2**20:7.1f} MiB  "
+                            f"traced {result['traced_bytes_per_story']:8.0f} B/story"
+                        )
+    finally:
+        pool.close()
+        pool.join()
+    if opt.output:
+        os.makedirs(os.path.dirname(os.path.abspath(opt.output)), exist_ok=True)
+        with open(opt.output, "w") as fout:
+            report = {"environment": environment(), "results": results}
+            json.dump(report, fout, indent=2)
+    if opt.compare:
+        compare(results, opt.compare)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--stages", nargs="+", choices=STAGES, default=STAGES, help="Stages to run"
+    )
+    parser.add_argument(
+        "--sizes",
+        nargs="+",
+        type=int,
+        default=[100, 1000],
+        help="Corpus sizes, in story groups (per split for main/create_tomi_csv)",
+    )
+    parser.add_argument(
+        "--world-scales",
+        nargs="+",
+        type=int,
+        default=[1, 10],
+        help="Repeat every world.json entity list this many times",
+    )
+    parser.add_argument(
+        "--repeat", "-r", type=int, default=3, help="Timed runs per benchmark"
+    )
+    parser.add_argument("--seed", "-s", type=int, default=0, help="Seed for rng")
+    parser.add_argument("--output", "-o", default=None, help="Write results as JSON")
+    parser.add_argument(
+        "--compare", default=None, help="Earlier results JSON to compare against"
+    )
+    main(parser.parse_args())
@@ -1,53 +1,90 @@
 #!/usr/bin/env python3
+import argparse
+import multiprocessing
 import pandas as pd
 import os
-import re
+from tomi.writer import CSV_COLUMNS as COLUMNS
 
-def parse_tomi_data(file_path):
-    """Parse ToMi dataset where each story has 6 question variants"""
-    stories = []
+# Number of rows written per chunk when streaming to CSV/Parquet
+CHUNK_SIZE = 10000
+
+# Number of story groups per chunk in parallel conversion
+GROUPS_PER_CHUNK = 2000
+
+DATASETS = ['train', 'val', 'test']
+
+def iter_lines(file_path, start=0, end=None):
+    """Yield decoded lines from the byte range [start, end) of a file"""
+    with open(file_path, 'rb') as f:
+        f.seek(start)
+        pos = start
+        for raw in f:
+            if end is not None and pos >= end:
+                break
+            pos += len(raw)
+            yield raw.decode('utf-8')
+
+def iter_tomi_data(file_path, start=0, end=None):
+    """Stream story groups (6 question variants each) from a ToMi file one at a time"""
     current_story_group = []
     current_story = []
     
-    with open(file_path, 'r') as f:
-        for line in f:
-            line = line.strip()
-            if not line:
-                continue
-                
-            # Extract step number and content
-            match = re.match(r'\s*(\d+)\s+(.*)', line)
-            if match:
-                step_num = int(match.group(1))
-                content = match.group(2)
-                
-                # If this is step 1, we're starting a new story
-                if step_num == 1:
-                    # If we have a complete story group (6 stories), process it
-                    if len(current_story_group) == 6:
-                        stories.append(current_story_group)
-                        current_story_group = []
-                    
-                    # If we have a previous story, add it to the group
-                    if current_story:
-                        current_story_group.append(current_story)
-                    
-                    current_story = []
-                
-                current_story.append({
-                    'step_num': step_num,
-                    'content': content
-                })
+    for line in iter_lines(file_path, start, end):
+        # Extract step number and content
+        parts = line.split(None, 1)
+        if len(parts) != 2 or not parts[0].isdigit():
+            continue
+        step_num = int(parts[0])
+        content = parts[1].rstrip()
         
-        # Add the last story to the group
-        if current_story:
-            current_story_group.append(current_story)
+        # If this is step 1, we're starting a new story
+        if step_num == 1:
+            # If we have a complete story group (6 stories), emit it
+            if len(current_story_group) == 6:
+                yield current_story_group
+                current_story_group = []
+            
+            # If we have a previous story, add it to the group
+            if current_story:
+                current_story_group.append(current_story)
+            
+            current_story = []
         
-        # Add the last story group
-        if len(current_story_group) == 6:
-            stories.append(current_story_group)
+        current_story.append({
+            'step_num': step_num,
+            'content': content
+        })
+    
+    # Add the last story to the group
+    if current_story:
+        current_story_group.append(current_story)
     
-    return stories
+    # Emit the last story group
+    if len(current_story_group) == 6:
+        yield current_story_group
+
+def find_chunks(file_path, groups_per_chunk=GROUPS_PER_CHUNK):
+    """Split a ToMi file into byte ranges that each hold whole story groups"""
+    # Every story starts at a step-1 line and every group is 6 stories,
+    # so a chunk boundary goes before every (6 * groups_per_chunk)-th story
+    stories_per_chunk = 6 * groups_per_chunk
+    boundaries = [0]
+    num_stories = 0
+    pos = 0
+    with open(file_path, 'rb') as f:
+        for raw in f:
+            parts = raw.split(None, 1)
+            if len(parts) == 2 and parts[0] == b'1':
+                if num_stories and num_stories % stories_per_chunk == 0:
+                    boundaries.append(pos)
+                num_stories += 1
+            pos += len(raw)
+    boundaries.append(pos)
+    return list(zip(boundaries[:-1], boundaries[1:]))
+
+def parse_tomi_data(file_path):
+    """Parse ToMi dataset where each story has 6 question variants"""
+    return list(iter_tomi_data(file_path))
 
 def extract_story_with_numbers(story):
     """Extract story with numbered sentences"""
@@ -87,10 +124,8 @@ def categorize_question(question):
     else:
         return 'unknown'
 
-def create_csv_data(story_groups):
-    """Create structured CSV data from story groups"""
-    csv_data = []
-    
+def iter_csv_rows(story_groups):
+    """Yield one structured CSV row per story group"""
     for story_group in story_groups:
         if len(story_group) != 6:
             continue  # Skip incomplete story groups
@@ -152,38 +187,120 @@ def create_csv_data(story_groups):
                     row['Second-Order Belief B Question'] = question
                     row['Second-Order Belief B Answer'] = answer
         
-        csv_data.append(row)
-    
-    return csv_data
+        yield row
 
-def main():
-    # Parse train, val, and test datasets
-    data_dir = '/Users/taeyoonkwack/Documents/Multi-Agent/ENV/ToMi/data'
-    all_data = []
+def create_csv_data(story_groups):
+    """Create structured CSV data from story groups"""
+    return list(iter_csv_rows(story_groups))
+
+def write_rows(rows, output_path, chunk_size=CHUNK_SIZE):
+    """Stream rows to CSV (or Parquet for a .parquet path) in chunks; returns the row count"""
+    parquet_writer = None
+    total = 0
+    chunk = []
     
-    for dataset in ['train', 'val', 'test']:
+    if output_path.endswith('.parquet'):
+        # pyarrow is optional; fail before any rows are converted
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise ImportError(
+                f'Writing {output_path} requires pyarrow: pip install pyarrow, or use a .csv output path'
+            ) from None
+    
+    def flush(chunk, first):
+        nonlocal parquet_writer
+        df = pd.DataFrame(chunk, columns=COLUMNS)
+        if output_path.endswith('.parquet'):
+            table = pa.Table.from_pandas(df, preserve_index=False)
+            if parquet_writer is None:
+                parquet_writer = pq.ParquetWriter(output_path, table.schema)
+            parquet_writer.write_table(table)
+        else:
+            df.to_csv(output_path, index=False, mode='w' if first else 'a', header=first)
+    
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == chunk_size:
+            flush(chunk, total == 0)
+            total += len(chunk)
+            chunk = []
+    if chunk or total == 0:
+        flush(chunk, total == 0)
+        total += len(chunk)
+    if parquet_writer is not None:
+        parquet_writer.close()
+    return total
+
+def convert_chunk(job):
+    """Convert one chunk of a dataset file into CSV rows"""
+    dataset, file_path, start, end = job
+    return list(iter_csv_rows(iter_tomi_data(file_path, start, end)))
+
+def iter_chunk_jobs(data_dir, groups_per_chunk=GROUPS_PER_CHUNK):
+    """Yield (dataset, file_path, start, end) jobs in dataset order"""
+    for dataset in DATASETS:
         file_path = os.path.join(data_dir, f'{dataset}.txt')
         if os.path.exists(file_path):
             print(f"Processing {dataset} dataset...")
-            story_groups = parse_tomi_data(file_path)
-            print(f"Found {len(story_groups)} complete story groups in {dataset}")
-            csv_data = create_csv_data(story_groups)
-            all_data.extend(csv_data)
-    
-    # Create DataFrame
-    df = pd.DataFrame(all_data)
+            for start, end in find_chunks(file_path, groups_per_chunk):
+                yield dataset, file_path, start, end
+
+def iter_dataset_rows(data_dir, workers=1, groups_per_chunk=GROUPS_PER_CHUNK, convert=convert_chunk, jobs=None):
+    """Stream CSV rows for the train, val, and test datasets in order"""
+    # jobs defaults to iter_chunk_jobs; callers may pass those jobs extended
+    # with per-chunk state drawn in the parent
+    if jobs is None:
+        jobs = iter_chunk_jobs(data_dir, groups_per_chunk)
+    if workers <= 1:
+        for job in jobs:
+            yield from convert(job)
+        return
+    # Chunks are converted in a process pool and yielded back in file order,
+    # so the output is identical to the serial path
+    with multiprocessing.Pool(workers) as pool:
+        for rows in pool.imap(convert, jobs):
+            yield from rows
+
+def make_parser(data_dir, output_path):
+    """Build the command line parser shared by the CSV conversion scripts"""
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--data-dir', default=data_dir, help='Directory with train/val/test .txt files')
+    parser.add_argument('--output', '-o', default=output_path, help='Output .csv or .parquet path')
+    parser.add_argument('--workers', '-w', type=int, default=1, help='Number of conversion processes')
+    parser.add_argument('--chunk-groups', type=int, default=GROUPS_PER_CHUNK, help='Story groups per chunk')
+    return parser
+
+def parse_args(data_dir, output_path):
+    """Parse command line options shared by the CSV conversion scripts"""
+    return make_parser(data_dir, output_path).parse_args()
+
+def main():
+    # Parse train, val, and test datasets
+    opt = parse_args(
+        '/Users/taeyoonkwack/Documents/Multi-Agent/ENV/ToMi/data',
+        '/Users/taeyoonkwack/Documents/Multi-Agent/ENV/ToMi/tomi_dataset_final.csv'
+    )
+    output_path = opt.output
+    rows = iter_dataset_rows(opt.data_dir, opt.workers, opt.chunk_groups)
     
-    # Save to CSV
-    output_path = '/Users/taeyoonkwack/Documents/Multi-Agent/ENV/ToMi/tomi_dataset_final.csv'
-    df.to_csv(output_path, index=False)
+    # Stream rows to CSV so memory stays flat regardless of dataset size
+    first_rows = []
+    def remember_first(rows):
+        for row in rows:
+            if not first_rows:
+                first_rows.append(row)
+            yield row
+    total = write_rows(remember_first(rows), output_path)
     print(f"CSV file created: {output_path}")
-    print(f"Total story groups: {len(df)}")
-    print(f"Columns: {list(df.columns)}")
+    print(f"Total story groups: {total}")
+    print(f"Columns: {COLUMNS}")
     
     # Display first few rows
-    if len(df) > 0:
+    if first_rows:
         print("\nFirst row sample:")
-        first_row = df.iloc[0]
+        first_row = first_rows[0]
         print(f"Story: {first_row['Story']}")
         print(f"Memory Q: {first_row['Memory Question']}")
         print(f"Memory A: {first_row['Memory Answer']}")
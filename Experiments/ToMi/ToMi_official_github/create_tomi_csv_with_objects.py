@@ -1,11 +1,19 @@
 #!/usr/bin/env python3
-import pandas as pd
-import os
+import json
 import re
 import random
-import copy
+from functools import lru_cache, partial
+from create_tomi_csv import iter_chunk_jobs, iter_dataset_rows, iter_tomi_data, make_parser, write_rows
+from tomi.writer import CSV_COLUMNS as COLUMNS
 
-def get_random_inanimate_object():
+# Seed of the object choices, for reproducibility; the choices are the same
+# sequence as seeding the global random once and converting serially
+SEED = 42
+
+# A character introduced in a story step, e.g. "Mary entered the kitchen."
+ENTERED = re.compile(r'(\w+)\s+entered\s+')
+
+def get_random_inanimate_object(rng=random):
     """Generate a random inanimate object name suitable for pretend play"""
     objects = [
         "Teddy bear with blue hat", "Doll with pink dress", "Stuffed bunny with bow",
@@ -19,7 +27,7 @@ def get_random_inanimate_object():
         "Toy monkey with banana", "Plush sheep with wool", "Stuffed duck with hat",
         "Toy cow with bell", "Rag cat with stripes", "Doll with pigtails"
     ]
-    return random.choice(objects)
+    return rng.choice(objects)
 
 def extract_characters_from_story(story):
     """Extract the three main characters from the story"""
@@ -31,7 +39,7 @@ def extract_characters_from_story(story):
             continue
         
         # Look for "X entered" pattern to identify characters
-        match = re.search(r'(\w+)\s+entered\s+', content)
+        match = ENTERED.search(content)
         if match:
             char_name = match.group(1)
             if char_name not in characters:
@@ -41,78 +49,72 @@ def extract_characters_from_story(story):
 
 def replace_character_in_content(content, old_char, new_char):
     """Replace character name in content, handling various grammatical forms"""
-    # Replace at word boundaries
-    content = re.sub(r'\b' + re.escape(old_char) + r'\b', new_char, content)
-    return content
+    return apply_replacements(content, {old_char: new_char})
+
+@lru_cache(maxsize=4096)
+def compile_replacements(names):
+    """Compile one word-boundary alternation regex matching any of the given names"""
+    # Longest names first so a name never shadows a longer one it prefixes
+    names = sorted(names, key=len, reverse=True)
+    return re.compile(r'\b(?:' + '|'.join(re.escape(name) for name in names) + r')\b')
+
+def apply_replacements(content, replacements):
+    """Apply several simultaneous word-boundary replacements in a single pass"""
+    if not replacements:
+        return content
+    pattern = compile_replacements(frozenset(replacements))
+    return pattern.sub(lambda m: replacements[m.group(0)], content)
+
+def build_replacements(characters, roles=(1,), extra=None, rng=random, objects=None):
+    """Map the characters at the given role indices to random objects (or the next of objects), plus any extra renames"""
+    replacements = {}
+    for role in roles:
+        if role < len(characters):
+            if objects is not None:
+                replacements[characters[role]] = next(objects)
+            else:
+                replacements[characters[role]] = get_random_inanimate_object(rng)
+    if extra:
+        replacements.update(extra)
+    return replacements
 
 def parse_tomi_data(file_path):
     """Parse ToMi dataset where each story has 6 question variants"""
-    stories = []
-    current_story_group = []
-    current_story = []
-    
-    with open(file_path, 'r') as f:
-        for line in f:
-            line = line.strip()
-            if not line:
-                continue
-                
-            # Extract step number and content
-            match = re.match(r'\s*(\d+)\s+(.*)', line)
-            if match:
-                step_num = int(match.group(1))
-                content = match.group(2)
-                
-                # If this is step 1, we're starting a new story
-                if step_num == 1:
-                    # If we have a complete story group (6 stories), process it
-                    if len(current_story_group) == 6:
-                        stories.append(current_story_group)
-                        current_story_group = []
-                    
-                    # If we have a previous story, add it to the group
-                    if current_story:
-                        current_story_group.append(current_story)
-                    
-                    current_story = []
-                
-                current_story.append({
-                    'step_num': step_num,
-                    'content': content
-                })
-        
-        # Add the last story to the group
-        if current_story:
-            current_story_group.append(current_story)
-        
-        # Add the last story group
-        if len(current_story_group) == 6:
-            stories.append(current_story_group)
-    
-    return stories
+    return list(iter_tomi_data(file_path))
+
+def replace_in_steps(steps, replacements):
+    """Return new step dicts with the replacements applied to their content"""
+    return [
+        {
+            'step_num': step['step_num'],
+            'content': apply_replacements(step['content'], replacements)
+        }
+        for step in steps
+    ]
 
-def extract_story_with_numbers_and_replacement(story_group):
+def extract_story_with_numbers_and_replacement(story_group, roles=(1,), extra=None, rng=random, objects=None):
     """Extract story with numbered sentences and replace second character with object"""
     # Use the first story to extract characters and create the base story
     base_story = story_group[0]
     characters = extract_characters_from_story(base_story)
     
-    # If we have at least 2 characters, replace the second one
+    # If we have at least 2 characters, replace the second one (and any other roles/renames)
     if len(characters) >= 2:
         second_char = characters[1]  # This is the "B" character
-        replacement_object = get_random_inanimate_object()
+        replacements = build_replacements(characters, roles, extra, rng, objects)
+        replacement_object = replacements.get(second_char)
         
-        # Process all stories in the group
+        # The six variants share the story body, so substitute it once and
+        # only substitute each variant's own question line
+        base_body = [step['content'] for step in base_story[:-1]]
+        processed_body = replace_in_steps(base_story[:-1], replacements)
         processed_stories = []
         for story in story_group:
-            processed_story = []
-            for step in story:
-                new_step = copy.deepcopy(step)
-                new_step['content'] = replace_character_in_content(
-                    step['content'], second_char, replacement_object
-                )
-                processed_story.append(new_step)
-            processed_stories.append(processed_story)
+            if [step['content'] for step in story[:-1]] == base_body:
+                body = processed_body
+            else:
+                body = replace_in_steps(story[:-1], replacements)
+            processed_stories.append(body + replace_in_steps(story[-1:], replacements))
         
         return processed_stories, second_char, replacement_object
     
@@ -171,8 +173,11 @@ def should_exclude_question(question, original_char_b):
     
     return False
 
-def create_csv_data(story_groups):
+def create_csv_data(story_groups, objects=None, roles=(1,), extra=None):
     """Create structured CSV data from story groups"""
+    # Objects come from the global random unless pre-drawn ones are given;
+    # roles and extra are the substitution map (see build_replacements)
+    objects = iter(objects) if objects is not None else None
     csv_data = []
     
     for story_group in story_groups:
@@ -180,7 +185,7 @@ def create_csv_data(story_groups):
             continue  # Skip incomplete story groups
         
         # Replace second character with object
-        processed_stories, original_char_b, replacement_object = extract_story_with_numbers_and_replacement(story_group)
+        processed_stories, original_char_b, replacement_object = extract_story_with_numbers_and_replacement(story_group, roles, extra, objects=objects)
         
         # Initialize row with empty values (including B-related columns)
         row = {
@@ -245,37 +250,110 @@ def create_csv_data(story_groups):
     
     return csv_data
 
+def iter_story_starts(data):
+    """Yield the offset of every step-1 line ("1 ...") in a bytes buffer"""
+    pos = 0 if data.startswith(b'1 ') else data.find(b'\n1 ')
+    while pos != -1:
+        if data[pos:pos + 1] == b'\n':
+            pos += 1
+        yield pos
+        pos = data.find(b'\n1 ', pos)
+
+def count_replacements(file_path, start=0, end=None, roles=(1,)):
+    """Count the replacement objects the story groups in a byte range draw, scanning bytes instead of parsing"""
+    # Only the "entered" lines of each group's first story are decoded, as
+    # nothing else can name a character (see extract_characters_from_story)
+    with open(file_path, 'rb') as f:
+        f.seek(start)
+        data = f.read() if end is None else f.read(end - start)
+    starts = list(iter_story_starts(data))
+    num_groups = len(starts) // 6
+    if len(starts) % 6 == 1:
+        # iter_tomi_data folds a single trailing story into the last group,
+        # which then has 7 stories and is dropped
+        num_groups -= 1
+    starts.append(len(data))
+    count = 0
+    for group in range(max(num_groups, 0)):
+        story = data[starts[6 * group]:starts[6 * group + 1]]
+        steps = []
+        for line in story.splitlines():
+            if b'entered' not in line:
+                continue
+            parts = line.split(None, 1)
+            if len(parts) == 2 and parts[0].isdigit():
+                steps.append({'step_num': int(parts[0]), 'content': parts[1].rstrip().decode('utf-8')})
+        num_characters = len(extract_characters_from_story(steps))
+        # One object per role the story has a character for, as drawn by
+        # extract_story_with_numbers_and_replacement
+        if num_characters >= 2:
+            count += sum(role < num_characters for role in roles)
+    return count
+
+def iter_object_jobs(jobs, roles=(1,), seed=SEED):
+    """Extend chunk jobs with their replacement objects, drawn in file order"""
+    # Drawn here, in the parent, from one generator: each chunk gets exactly
+    # the draws a serial run would make for it (one per replaced role of
+    # each story group, in role order), so the output is the same for any
+    # --workers and --chunk-groups
+    rng = random.Random(seed)
+    for dataset, file_path, start, end in jobs:
+        count = count_replacements(file_path, start, end, roles)
+        objects = [get_random_inanimate_object(rng) for _ in range(count)]
+        yield dataset, file_path, start, end, objects
+
+def convert_chunk(job, roles=(1,), extra=None):
+    """Convert one chunk of a dataset file into CSV rows with object replacement"""
+    dataset, file_path, start, end, objects = job
+    return create_csv_data(iter_tomi_data(file_path, start, end), objects, roles, extra)
+
+def load_replacements(path):
+    """Read a substitution map: {"roles": [1], "extra": {"Name": "New name"}}"""
+    # roles are indices into a story's characters in order of entrance, each
+    # replaced by its own random object; extra renames are applied as given
+    with open(path, 'r') as f:
+        spec = json.load(f)
+    unknown = set(spec) - {'roles', 'extra'}
+    if unknown:
+        raise ValueError(f"{path}: unknown keys {sorted(unknown)}, expected 'roles' and 'extra'")
+    roles = spec.get('roles', [1])
+    if not all(isinstance(role, int) and role >= 0 for role in roles):
+        raise ValueError(f"{path}: roles must be character indices (non-negative integers), got {roles}")
+    extra = spec.get('extra') or {}
+    if not all(isinstance(k, str) and isinstance(v, str) for k, v in extra.items()):
+        raise ValueError(f"{path}: extra must map names to replacement strings")
+    return tuple(roles), extra
+
 def main():
-    # Set random seed for reproducibility
-    random.seed(42)
-    
     # Parse train, val, and test datasets
-    data_dir = '/Users/taeyoonkwack/Documents/Multi-Agent/ENV/ToMi/data'
-    all_data = []
-    
-    for dataset in ['train', 'val', 'test']:
-        file_path = os.path.join(data_dir, f'{dataset}.txt')
-        if os.path.exists(file_path):
-            print(f"Processing {dataset} dataset...")
-            story_groups = parse_tomi_data(file_path)
-            print(f"Found {len(story_groups)} complete story groups in {dataset}")
-            csv_data = create_csv_data(story_groups)
-            all_data.extend(csv_data)
-    
-    # Create DataFrame
-    df = pd.DataFrame(all_data)
+    parser = make_parser(
+        '/Users/taeyoonkwack/Documents/Multi-Agent/ENV/ToMi/data',
+        '/Users/taeyoonkwack/Documents/Multi-Agent/ENV/ToMi/tomi_dataset_with_objects.csv'
+    )
+    parser.add_argument('--replacements', default=None, help='JSON substitution map {"roles": [...], "extra": {...}} (default: replace the second character)')
+    opt = parser.parse_args()
+    output_path = opt.output
+    roles, extra = load_replacements(opt.replacements) if opt.replacements else ((1,), None)
+    jobs = iter_object_jobs(iter_chunk_jobs(opt.data_dir, opt.chunk_groups), roles)
+    convert = partial(convert_chunk, roles=roles, extra=extra)
+    rows = iter_dataset_rows(opt.data_dir, opt.workers, opt.chunk_groups, convert=convert, jobs=jobs)
     
-    # Save to CSV
-    output_path = '/Users/taeyoonkwack/Documents/Multi-Agent/ENV/ToMi/tomi_dataset_with_objects.csv'
-    df.to_csv(output_path, index=False)
+    # Stream rows to CSV so memory stays flat regardless of dataset size
+    first_rows = []
+    def remember_first(rows):
+        for row in rows:
+            if not first_rows:
+                first_rows.append(row)
+            yield row
+    total = write_rows(remember_first(rows), output_path)
     print(f"CSV file created: {output_path}")
-    print(f"Total story groups: {len(df)}")
-    print(f"Columns: {list(df.columns)}")
+    print(f"Total story groups: {total}")
+    print(f"Columns: {COLUMNS}")
     
     # Display first few rows
-    if len(df) > 0:
+    if first_rows:
         print("\nFirst row sample:")
-        first_row = df.iloc[0]
+        first_row = first_rows[0]
         print(f"Story: {first_row['Story']}")
         print(f"Memory Q: {first_row['Memory Question']}")
         print(f"Memory A: {first_row['Memory Answer']}")
@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+# Copyright (c) 2019-present, Facebook, Inc.
+# All rights reserved.
+#
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+
+# Score a chat model on a ToMi split (see tomi.evaluate):
+#
+#   python evaluate.py data/test.txt --model gpt-4o-mini --workers 16
+#   python evaluate.py tomi_dataset.csv --async -w 64 --rpm 5000 --tpm 2000000
+#   python evaluate.py tomi_dataset_with_objects.csv --prompt playing_house -n 100
+#   python evaluate.py data/test.txt --cache answers.sqlite --replay
+#   python evaluate.py data/test.txt --batch 4 --compare --cache answers.sqlite
+
+import argparse
+import json
+import os
+from tomi.cache import ResponseCache, cached_client
+from tomi.dispatch import Dispatcher, RateLimiter, Retry
+from tomi.evaluate import PARAMS, PROMPTS, Evaluator, Prompt, iter_questions
+from tomi.evaluate import langchain_async_client, langchain_client, side_by_side
+from tqdm import tqdm
+
+
+def openai_llm(opt):
+    # The LangChain client the experiment notebooks use
+    from langchain_openai import ChatOpenAI
+
+    return ChatOpenAI(
+        model=opt.model,
+        request_timeout=60,
+        max_retries=0 if opt.use_async else 2,
+        api_key=os.environ["OPENAI_API_KEY"],
+        **PARAMS,
+    )
+
+
+def make_client(opt, cache=None):
+    # With --async, the async API behind a Dispatcher with --workers requests
+    # in flight.  A --replay run never builds the OpenAI client at all.
+    llm = None if opt.replay else openai_llm(opt)
+    if not opt.use_async:
+        client = langchain_client(llm)
+        return client if cache is None else cached_client(client, cache)
+    return Dispatcher(
+        langchain_async_client(llm),
+        concurrency=opt.workers,
+        limiter=RateLimiter(opt.rpm, opt.tpm),
+        retry=Retry(max_retries=opt.max_retries),
+        cache=cache,
+    )
+
+
+def open_cache(opt):
+    if not opt.cache:
+        return None
+    max_bytes = int(opt.cache_max_mb * 2 ** 20) if opt.cache_max_mb else None
+    return ResponseCache(opt.cache, opt.model, PARAMS, max_bytes, opt.replay)
+
+
+def main(opt):
+    cache = open_cache(opt)
+    client = make_client(opt, cache)
+    prompt = Prompt(PROMPTS[opt.prompt])
+    evaluator = Evaluator(client, prompt, workers=opt.workers, batch=opt.batch)
+    questions = iter_questions(opt.dataset, opt.trace)
+    pbar = tqdm(unit="q")
+    predictions = open(opt.predictions, "w") if opt.predictions else None
+
+    def record(question, prediction, correct):
+        pbar.update(1)
+        if predictions is not None:
+            entry = {
+                "group": question.group,
+                "kind": question.kind,
+                "tom": question.tom,
+                "question": question.question,
+                "answer": question.answer,
+                "prediction": prediction,
+                "correct": correct,
+            }
+            predictions.write(json.dumps(entry) + "\n")
+
+    try:
+        accuracy = evaluator.evaluate(questions, opt.num_stories, record)
+    finally:
+        pbar.close()
+        if predictions is not None:
+            predictions.close()
+    print(accuracy.summary())
+    print(", ".join(f"{k}: {v}" for k, v in sorted(evaluator.stats.items())))
+    if opt.compare and opt.batch:
+        # The same questions, one request each, for the accuracy trade-off
+        single = Evaluator(client, prompt, workers=opt.workers)
+        baseline = single.evaluate(
+            iter_questions(opt.dataset, opt.trace), opt.num_stories
+        )
+        name = f"batch {opt.batch}"
+        print(side_by_side({"per-question": baseline, name: accuracy}))
+        requests = single.stats["requests"], evaluator.stats["requests"]
+        print(f"requests: per-question {requests[0]}, {name} {requests[1]}")
+    if isinstance(client, Dispatcher):
+        print(", ".join(f"{k}: {v}" for k, v in sorted(client.stats.items())))
+    if cache is not None:
+        print(", ".join(f"cache {k}: {v}" for k, v in sorted(cache.stats.items())))
+        cache.close()
+    if opt.output:
+        with open(opt.output, "w") as fout:
+            json.dump(accuracy.as_dict(), fout, indent=2)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("dataset", help="A split's .txt file or a per-group .csv")
+    parser.add_argument(
+        "--trace",
+        nargs="+",
+        default=None,
+        help="The .trace file(s), for tom/no_tom labels (defaults to the .txt's "
+        "own; a .csv has none unless given the traces of every split it was "
+        "converted from, in order)",
+    )
+    parser.add_argument("--model", "-m", default="gpt-4o-mini", help="OpenAI model")
+    parser.add_argument(
+        "--prompt", choices=list(PROMPTS), default="original", help="System prompt"
+    )
+    parser.add_argument(
+        "--num-stories",
+        "-n",
+        type=int,
+        default=None,
+        help="Only evaluate the first n story groups",
+    )
+    parser.add_argument(
+        "--workers", "-w", type=int, default=1, help="Requests in flight at once"
+    )
+    parser.add_argument(
+        "--async",
+        dest="use_async",
+        action="store_true",
+        help="Dispatch on asyncio with rate limiting and jittered retries",
+    )
+    parser.add_argument(
+        "--rpm", type=float, default=None, help="With --async, max requests/minute"
+    )
+    parser.add_argument(
+        "--tpm",
+        type=float,
+        default=None,
+        help="With --async, max (estimated) tokens/minute",
+    )
+    parser.add_argument(
+        "--max-retries",
+        type=int,
+        default=6,
+        help="With --async, retries per request before giving up",
+    )
+    parser.add_argument(
+        "--batch",
+        type=int,
+        default=0,
+        help="Ask all questions of this many story groups in one request",
+    )
+    parser.add_argument(
+        "--compare",
+        action="store_true",
+        help="With --batch, also run one request per question and print both",
+    )
+    parser.add_argument(
+        "--cache", default=None, help="SQLite file caching answers across runs"
+    )
+    parser.add_argument(
+        "--cache-max-mb",
+        type=float,
+        default=None,
+        help="Evict least recently used answers beyond this size",
+    )
+    parser.add_argument(
+        "--replay",
+        action="store_true",
+        help="Only answer from --cache, failing on a miss (makes no API calls)",
+    )
+    parser.add_argument(
+        "--output", "-o", default=None, help="Write per-category accuracy as JSON"
+    )
+    parser.add_argument(
+        "--predictions", default=None, help="Write every answer as a JSON line"
+    )
+    opt = parser.parse_args()
+    if opt.replay and not opt.cache:
+        parser.error("--replay requires --cache")
+    main(opt)
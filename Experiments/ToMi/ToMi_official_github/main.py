@@ -6,43 +6,250 @@
 # LICENSE file in the root directory of this source tree.
 
 import argparse
+import cProfile
+import multiprocessing
 import os
+import shutil
 from tomi.story import StoryType, generate_story
+from tomi.columnar import ColumnarWriter, merge_columns
+from tomi.index import build_index
+from tomi.long_story import LongStoryConfig, generate_long_story
+from tomi.profiling import NULL_TIMER, PhaseTimer
 from tomi.world import World
+from tomi.writer import COMPRESSION_SUFFIXES, CsvWriter, StoryWriter
 from tqdm import tqdm
 import numpy as np
-import random
+
+
+DATA_TYPES = ["train", "val", "test"]
+
+
+def generate_split(world, quota, writer, pbar=None, timer=None):
+    if timer is None:
+        timer = NULL_TIMER
+    with writer:
+        while any([v > 0 for v in quota.values()]):
+            # Pick the next story type in proportion to its remaining quota and
+            # build it directly, so no generated story is thrown away
+            timer.start()
+            story_types = list(quota.keys())
+            remaining = np.array([quota[t] for t in story_types], dtype=float)
+            idx = world.rng.choice(len(story_types), p=remaining / remaining.sum())
+            world.reset()
+            timer.lap("choose_type")
+            stories, traces, story_type = generate_story(
+                world, story_types[idx], timer=timer
+            )
+            quota[story_type] -= 1
+            timer.start()
+            writer.write(stories, traces, story_type)
+            timer.lap("write")
+            if pbar is not None:
+                pbar.update(1)
+        timer.start()
+    timer.lap("write")
+
+
+def generate_long_split(world, num_groups, writer, config, pbar=None, timer=None):
+    # Long-horizon stories take whatever story type their events produce, so
+    # only the number of story groups is fixed
+    with writer:
+        for _ in range(num_groups):
+            world.reset()
+            stories, traces, story_type = generate_long_story(
+                world, config, timer=timer
+            )
+            if timer is not None:
+                timer.start()
+            writer.write(stories, traces, story_type)
+            if timer is not None:
+                timer.lap("write")
+            if pbar is not None:
+                pbar.update(1)
+
+
+def long_config(opt):
+    if not opt.long_steps:
+        return None
+    return LongStoryConfig(
+        num_agents=opt.long_agents,
+        num_rooms=opt.long_rooms,
+        num_objects=opt.long_objects,
+        num_steps=opt.long_steps,
+    )
+
+
+def profile_path(opt, data_type, shard=None):
+    name = data_type if shard is None else f"{data_type}.shard{shard}"
+    return os.path.join(opt.cprofile_dir, f"{name}.pstats")
+
+
+def run_split(opt, world, data_type, quota, shard=None, pbar=None, timer=None):
+    # generate_split (generate_long_split with --long-steps), under cProfile
+    # when --cprofile-dir is set
+    writer = open_writer(opt, world, data_type, shard)
+    config = long_config(opt)
+    if config is None:
+        run, args = generate_split, (world, quota, writer, pbar, timer)
+    else:
+        num_groups = sum(quota.values())
+        run = generate_long_split
+        args = (world, num_groups, writer, config, pbar, timer)
+    if not opt.cprofile_dir:
+        return run(*args)
+    profiler = cProfile.Profile()
+    profiler.runcall(run, *args)
+    profiler.dump_stats(profile_path(opt, data_type, shard))
+
+
+def shard_quota(quota, shard, num_shards):
+    # Split each story type's quota as evenly as possible, lower shards first
+    return {
+        story_type: n // num_shards + (1 if shard < n % num_shards else 0)
+        for story_type, n in quota.items()
+    }
+
+
+def shard_seed(seed, data_type, shard):
+    # Derive an independent, reproducible seed for every (split, shard) pair
+    ss = np.random.SeedSequence([seed, DATA_TYPES.index(data_type), shard])
+    return int(ss.generate_state(1)[0])
+
+
+def output_paths(out_dir, data_type, compression=None):
+    suffix = COMPRESSION_SUFFIXES[compression]
+    return (
+        os.path.join(out_dir, f"{data_type}.txt{suffix}"),
+        os.path.join(out_dir, f"{data_type}.trace{suffix}"),
+    )
+
+
+def columns_path(out_dir, data_type):
+    return os.path.join(out_dir, f"{data_type}.cols")
+
+
+def csv_path(out_dir, data_type):
+    return os.path.join(out_dir, f"{data_type}.csv")
+
+
+def shard_paths(out_dir, data_type, shard, compression=None):
+    return tuple(
+        f"{path}.shard{shard}"
+        for path in output_paths(out_dir, data_type, compression)
+    )
+
+
+def open_writer(opt, world, data_type, shard=None):
+    if opt.format == "columnar":
+        path = columns_path(opt.out_dir, data_type)
+        if shard is not None:
+            path = f"{path}.shard{shard}"
+        return ColumnarWriter(path, world)
+    if opt.format == "csv":
+        path = csv_path(opt.out_dir, data_type)
+        if shard is not None:
+            path = f"{path}.shard{shard}"
+        return CsvWriter(path)
+    if shard is None:
+        paths = output_paths(opt.out_dir, data_type, opt.compression)
+    else:
+        paths = shard_paths(opt.out_dir, data_type, shard, opt.compression)
+    return StoryWriter(*paths, opt.compression)
+
+
+def make_world(opt, seed):
+    rng = np.random.default_rng(seed)
+    if opt.synthetic_world:
+        types = ["agents", "locations", "objects", "containers"]
+        return World.synthetic({typ: opt.synthetic_world for typ in types}, rng)
+    return World(opt.world_file, rng=rng)
+
+
+def generate_shard(args):
+    opt, data_type, shard, quota = args
+    seed = shard_seed(opt.seed, data_type, shard)
+    world = make_world(opt, seed)
+    timer = PhaseTimer() if opt.profile else None
+    run_split(opt, world, data_type, quota, shard, timer=timer)
+    return data_type, shard, timer.as_dict() if timer else None
+
+
+def merge_shards(opt, data_type):
+    if opt.format == "columnar":
+        path = columns_path(opt.out_dir, data_type)
+        merge_columns([f"{path}.shard{s}" for s in range(opt.workers)], path)
+        return
+    if opt.format == "csv":
+        path = csv_path(opt.out_dir, data_type)
+        with open(path, "wb") as fout:
+            for shard in range(opt.workers):
+                with open(f"{path}.shard{shard}", "rb") as fin:
+                    if shard > 0:
+                        fin.readline()  # every shard starts with the header
+                    shutil.copyfileobj(fin, fout)
+                os.remove(f"{path}.shard{shard}")
+        return
+    # gzip members and zstd frames are valid when concatenated byte-wise
+    outputs = output_paths(opt.out_dir, data_type, opt.compression)
+    for idx, out_path in enumerate(outputs):
+        with open(out_path, "wb") as fout:
+            for shard in range(opt.workers):
+                path = shard_paths(opt.out_dir, data_type, shard, opt.compression)
+                with open(path[idx], "rb") as fin:
+                    shutil.copyfileobj(fin, fout)
+                os.remove(path[idx])
+
+
+def build_indexes(opt):
+    # Random-access sidecars only make sense for plain, uncompressed text
+    for data_type in DATA_TYPES:
+        build_index(*output_paths(opt.out_dir, data_type))
 
 
 def main(opt):
+    # With --profile, per-phase wall time is accumulated and printed at the end
+    timer = PhaseTimer() if opt.profile else None
+    if opt.cprofile_dir:
+        os.makedirs(opt.cprofile_dir, exist_ok=True)
+    if opt.workers > 1:
+        main_parallel(opt, timer)
+    else:
+        N = opt.num_stories
+        world = make_world(opt, opt.seed)
+        for data_type in DATA_TYPES:
+            quota = {story_type: N // len(StoryType) for story_type in StoryType}
+            with tqdm(total=N) as pbar:
+                run_split(opt, world, data_type, quota, pbar=pbar, timer=timer)
+    if opt.index:
+        clock = NULL_TIMER if timer is None else timer
+        clock.start()
+        build_indexes(opt)
+        clock.lap("index")
+    if timer is not None:
+        print(timer.summary())
+
+
+def main_parallel(opt, timer=None):
+    # Each split is cut into `workers` shards with a fixed quota and a seed
+    # derived from --seed, so output only depends on (seed, workers).
     N = opt.num_stories
-    w = None  # world
-    world = World()
-    for data_type in ["train", "val", "test"]:
-        quota = {story_type: N // len(StoryType) for story_type in StoryType}
-        stories_path = os.path.join(opt.out_dir, f"{data_type}.txt")
-        trace_path = os.path.join(opt.out_dir, f"{data_type}.trace")
-        with open(stories_path, "w") as f, open(trace_path, "w") as trace_f, tqdm(
-            total=N
-        ) as pbar:
-            while any([v > 0 for v in quota.values()]):
-                world.reset()
-                stories, traces, story_type = generate_story(world)
-                if quota[story_type] > 0:
-                    quota[story_type] -= 1
-                else:
-                    # We've already generated enough of this type of story
-                    continue
-                for story, trace in zip(stories, traces):
-                    print(
-                        "\n".join(
-                            [f"{i+1} {line.render()}" for i, line in enumerate(story)]
-                        ),
-                        file=f,
-                    )
-                    print(",".join(trace + [story_type.value]), file=trace_f)
-                    f.flush()
-                pbar.update(1)
+    quota = {story_type: N // len(StoryType) for story_type in StoryType}
+    jobs = [
+        (opt, data_type, shard, shard_quota(quota, shard, opt.workers))
+        for data_type in DATA_TYPES
+        for shard in range(opt.workers)
+    ]
+    with multiprocessing.Pool(opt.workers) as pool:
+        results = pool.imap_unordered(generate_shard, jobs)
+        for _, _, phases in tqdm(results, total=len(jobs)):
+            if timer is not None:
+                # Shard phases add up CPU time across workers, not wall time
+                timer.merge(phases)
+    clock = NULL_TIMER if timer is None else timer
+    clock.start()
+    for data_type in DATA_TYPES:
+        merge_shards(opt, data_type)
+    clock.lap("merge")
 
 
 if __name__ == "__main__":
@@ -56,9 +263,74 @@ if __name__ == "__main__":
         help="Number of stories to generate for each type",
     )
     parser.add_argument("--out-dir", "-o", default="data", help="Output directory")
+    parser.add_argument(
+        "--world-file",
+        default=None,
+        help="Entity vocabulary to draw from (defaults to tomi/world.json)",
+    )
+    parser.add_argument(
+        "--synthetic-world",
+        type=int,
+        default=None,
+        help="Instead of --world-file, use this many generated names per entity "
+        "type, sampled by index so story cost does not grow with the vocabulary",
+    )
+    parser.add_argument(
+        "--workers",
+        "-w",
+        type=int,
+        default=1,
+        help="Number of processes to shard generation across",
+    )
+    parser.add_argument(
+        "--compression",
+        "-c",
+        choices=["gzip", "zstd"],
+        default=None,
+        help="Write compressed .txt/.trace streams",
+    )
+    parser.add_argument(
+        "--format",
+        "-f",
+        choices=["text", "columnar", "csv"],
+        default="text",
+        help="Write .txt/.trace files, a memory-mappable <split>.cols directory, "
+        "or the create_tomi_csv.py row format directly as <split>.csv",
+    )
+    parser.add_argument(
+        "--index",
+        action="store_true",
+        help="Also write a <split>.txt.idx.npz random-access index (see tomi.index)",
+    )
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="Print wall time and call counts per generation phase at the end",
+    )
+    parser.add_argument(
+        "--cprofile-dir",
+        default=None,
+        help="Write a cProfile .pstats file per split (or per shard) to this directory",
+    )
+    parser.add_argument(
+        "--long-steps",
+        type=int,
+        default=0,
+        help="Generate long-horizon stories of this many events instead "
+        "(see tomi.long_story); story types then follow from the events",
+    )
+    parser.add_argument(
+        "--long-agents", type=int, default=6, help="Agents per long story"
+    )
+    parser.add_argument(
+        "--long-rooms", type=int, default=3, help="Rooms per long story"
+    )
+    parser.add_argument(
+        "--long-objects", type=int, default=4, help="Objects per long story"
+    )
     opt = parser.parse_args()
-    np.random.seed(opt.seed)
-    random.seed(opt.seed)
+    if opt.index and (opt.format != "text" or opt.compression is not None):
+        parser.error("--index requires --format text without --compression")
 
     os.makedirs(opt.out_dir, exist_ok=True)
     main(opt)
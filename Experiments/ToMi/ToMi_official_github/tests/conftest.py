@@ -0,0 +1,30 @@
+#!/usr/bin/env python3
+# Copyright (c) 2019-present, Facebook, Inc.
+# All rights reserved.
+#
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+
+
+import os
+import subprocess
+import sys
+import pytest
+
+# The tests import the top-level scripts (main, create_tomi_csv, ...) as well
+# as the tomi package
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def run_main(out_dir, *args):
+    # Generate train/val/test with main.py in a fresh process, as users do
+    command = [sys.executable, os.path.join(ROOT, "main.py"), "-o", str(out_dir)]
+    subprocess.run(command + [str(arg) for arg in args], cwd=ROOT, check=True)
+    return str(out_dir)
+
+
+@pytest.fixture(scope="session")
+def generate(tmp_path_factory):
+    # generate(name, *main.py args) -> a new output directory
+    return lambda name, *args: run_main(tmp_path_factory.mktemp(name), *args)
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+# Copyright (c) 2019-present, Facebook, Inc.
+# All rights reserved.
+#
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+
+
+import json
+import os
+import shutil
+import pytest
+from tomi.batch_api import DEFAULT_MODELS, build_shards, ingest, read_results
+from tomi.evaluate import PARAMS, PROMPTS, Prompt, iter_questions
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FIXTURES = os.path.join(ROOT, "tests", "fixtures", "batch")
+
+# Two story groups of data/test.txt; every result file answers one question
+# wrong, and openai_results.jsonl has no line for stories-1-5
+EXPECTED = {
+    "openai": {"answered": 10, "failed": 1, "missing": 1},
+    "anthropic": {"answered": 10, "failed": 2, "missing": 0},
+}
+
+
+def fixture(name):
+    return os.path.join(FIXTURES, name)
+
+
+@pytest.fixture
+def questions(tmp_path):
+    # Copied so the index sidecar is not written next to the fixtures
+    for name in ("stories.txt", "stories.trace"):
+        shutil.copy(fixture(name), tmp_path)
+    return list(iter_questions(str(tmp_path / "stories.txt")))
+
+
+def build(questions, out_dir, provider, name="stories"):
+    prompt = Prompt(PROMPTS["original"])
+    model = DEFAULT_MODELS[provider]
+    return build_shards(
+        questions, str(out_dir), name, model, prompt, provider, PARAMS, shard_size=5
+    )
+
+
+def read_lines(paths):
+    lines = []
+    for path in paths:
+        with open(path, "r") as f:
+            lines.extend(json.loads(line) for line in f)
+    return lines
+
+
+@pytest.mark.parametrize("provider", ["openai", "anthropic"])
+def test_build_matches_fixture(questions, tmp_path, provider):
+    paths = build(questions, tmp_path / "batches", provider)
+    assert len(paths) == 3
+    assert read_lines(paths) == read_lines([fixture(f"{provider}_requests.jsonl")])
+
+
+@pytest.mark.parametrize("provider", ["openai", "anthropic"])
+def test_ingest_fixture_results(questions, provider):
+    results = read_results([fixture(f"{provider}_results.jsonl")])
+    scored = []
+    accuracy, counts = ingest(
+        questions, results, "stories", callback=lambda *args: scored.append(args)
+    )
+    assert counts == EXPECTED[provider]
+    assert sum(accuracy.total.values()) == counts["answered"]
+    assert sum(accuracy.correct.values()) == counts["answered"] - 1
+    assert len(scored) == counts["answered"]
+    assert [correct for _, _, correct in scored].count(False) == 1
+
+
+@pytest.mark.parametrize("name", ["stories", "ToMi test.v2", "x" * 80])
+def test_custom_ids_round_trip(questions, tmp_path, name):
+    # Answer every request of a build with its question's answer; ingest
+    # must find each of them again under the same name
+    paths = build(questions, tmp_path / "batches", "anthropic", name)
+    requests = read_lines(paths)
+    ids = [request["custom_id"] for request in requests]
+    assert len(set(ids)) == len(questions)
+    results_path = tmp_path / "results.jsonl"
+    with open(results_path, "w") as f:
+        for request_id, question in zip(ids, questions):
+            message = {"content": [{"type": "text", "text": question.answer}]}
+            result = {"type": "succeeded", "message": message}
+            f.write(json.dumps({"custom_id": request_id, "result": result}) + "\n")
+    accuracy, counts = ingest(questions, read_results([results_path]), name)
+    assert counts == {"answered": len(questions), "failed": 0, "missing": 0}
+    assert accuracy.correct == accuracy.total
+
+
+def test_duplicate_results_rejected():
+    path = fixture("openai_results.jsonl")
+    with pytest.raises(ValueError, match="Duplicate custom id"):
+        read_results([path, path])
@@ -0,0 +1,43 @@
+#!/usr/bin/env python3
+# Copyright (c) 2019-present, Facebook, Inc.
+# All rights reserved.
+#
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+
+
+import os
+import pytest
+from tomi.columnar import NUM_QUESTIONS, Columns
+
+SPLITS = ["train", "val", "test"]
+
+
+def render_text(columns):
+    # The .txt and .trace lines a columnar split stands for
+    stories, traces = [], []
+    for i in range(len(columns)):
+        chapter = [f"{k} {line}" for k, line in enumerate(columns.story(i), 1)]
+        for j in range(NUM_QUESTIONS):
+            question = f"{len(chapter) + 1} {columns.question(i, j)}"
+            stories.extend(chapter + [question])
+            traces.append(",".join(columns.trace(i, j)))
+    return stories, traces
+
+
+def read_lines(path):
+    with open(path, "r") as f:
+        return f.read().splitlines()
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_columnar_renders_like_text(generate, workers):
+    args = ["-n", 60, "-s", 7, "-w", workers]
+    text = generate("text", *args)
+    cols = generate("cols", *args, "-f", "columnar")
+    for split in SPLITS:
+        columns = Columns(os.path.join(cols, f"{split}.cols"))
+        assert len(columns) == 60
+        stories, traces = render_text(columns)
+        assert stories == read_lines(os.path.join(text, f"{split}.txt"))
+        assert traces == read_lines(os.path.join(text, f"{split}.trace"))
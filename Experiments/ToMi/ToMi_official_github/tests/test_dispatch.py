@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+# Copyright (c) 2019-present, Facebook, Inc.
+# All rights reserved.
+#
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+
+
+import asyncio
+import collections
+import threading
+import time
+import pytest
+from tomi.cache import ResponseCache
+from tomi.dispatch import Dispatcher, RateLimiter, Retry, TokenBucket
+from tomi.evaluate import Evaluator, Question
+
+
+class FakeServer(object):
+    # An async chat client that answers with the question text after a
+    # delay, tracking how many requests are in flight.  failures[text] is a
+    # list of exceptions the first calls for that question raise.
+    def __init__(self, delay=lambda text: 0.001, failures=None):
+        self.delay = delay
+        self.failures = failures or {}
+        self.calls = collections.Counter()
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.started = []
+
+    async def __call__(self, messages):
+        text = messages[-1][1]
+        self.calls[text] += 1
+        self.started.append(time.monotonic())
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(self.delay(text))
+            if self.failures.get(text):
+                raise self.failures[text].pop(0)
+            return text
+        finally:
+            self.in_flight -= 1
+
+
+class RateLimitError(Exception):
+    # Stands in for openai.RateLimitError / anthropic.RateLimitError
+    status_code = 429
+
+
+def no_wait():
+    return Retry(base_delay=0.0, max_delay=0.0)
+
+
+def messages(i):
+    return [("system", "Answer."), ("human", str(i))]
+
+
+def run_map(dispatcher, items):
+    async def collect():
+        return [pair async for pair in dispatcher.map(items, messages)]
+
+    return asyncio.run(collect())
+
+
+def test_map_keeps_input_order():
+    # Later requests finish first
+    server = FakeServer(delay=lambda text: 0.02 / (1 + int(text)))
+    answers = run_map(Dispatcher(server, concurrency=8), range(50))
+    assert answers == [(i, str(i)) for i in range(50)]
+
+
+def test_concurrency_limit():
+    server = FakeServer(delay=lambda text: 0.005)
+    run_map(Dispatcher(server, concurrency=4), range(40))
+    assert server.max_in_flight == 4
+    assert sum(server.calls.values()) == 40
+
+
+def test_blocking_client_runs_on_threads():
+    lock, seen = threading.Lock(), set()
+
+    def client(messages):
+        with lock:
+            seen.add(threading.get_ident())
+        time.sleep(0.005)
+        return messages[-1][1]
+
+    answers = run_map(Dispatcher(client, concurrency=4), range(20))
+    assert answers == [(i, str(i)) for i in range(20)]
+    assert threading.get_ident() not in seen
+
+
+def test_rate_limit():
+    # 100 requests/second with no burst: 11 requests need at least 0.1s
+    server = FakeServer(delay=lambda text: 0.0)
+    limiter = RateLimiter()
+    limiter.buckets["requests"] = TokenBucket(6000, capacity=1)
+    run_map(Dispatcher(server, concurrency=11, limiter=limiter), range(11))
+    assert server.started[-1] - server.started[0] >= 0.09
+
+
+def test_token_bucket_caps_large_requests():
+    # More than the capacity is granted once the bucket is full
+    bucket = TokenBucket(60000, capacity=10)
+    start = time.monotonic()
+    asyncio.run(bucket.acquire(50))
+    assert time.monotonic() - start < 0.05
+    assert bucket.tokens == 0
+
+
+def test_retries_transient_errors():
+    failures = {
+        "3": [ConnectionResetError(), asyncio.TimeoutError()],
+        "7": [RateLimitError()],
+    }
+    server = FakeServer(failures=failures)
+    dispatcher = Dispatcher(server, concurrency=4, retry=no_wait())
+    answers = run_map(dispatcher, range(10))
+    assert answers == [(i, str(i)) for i in range(10)]
+    assert server.calls["3"] == 3 and server.calls["7"] == 2
+    assert dispatcher.stats == {"requests": 13, "retries": 3}
+
+
+def test_gives_up_after_max_retries():
+    server = FakeServer(failures={"0": [ConnectionError()] * 5})
+    retry = Retry(max_retries=2, base_delay=0.0)
+    dispatcher = Dispatcher(server, retry=retry)
+    with pytest.raises(ConnectionError):
+        run_map(dispatcher, range(1))
+    assert server.calls["0"] == 3
+    assert dispatcher.stats["failures"] == 1
+
+
+def test_programming_errors_are_not_retried():
+    server = FakeServer(failures={"0": [TypeError("bad client")]})
+    dispatcher = Dispatcher(server, retry=no_wait())
+    with pytest.raises(TypeError):
+        run_map(dispatcher, range(1))
+    assert server.calls["0"] == 1
+    assert dispatcher.stats["retries"] == 0
+
+
+def test_cache_hits_skip_the_client(tmp_path):
+    server = FakeServer()
+    with ResponseCache(str(tmp_path / "cache.sqlite"), "fake") as cache:
+        run_map(Dispatcher(server, cache=cache), range(5))
+        answers = run_map(Dispatcher(server, cache=cache), range(10))
+        assert answers == [(i, str(i)) for i in range(10)]
+        assert sum(server.calls.values()) == 10
+        assert cache.stats == {"misses": 10, "writes": 10, "hits": 5}
+
+
+def test_aevaluate_on_a_running_loop():
+    async def client(messages):
+        return "box"
+
+    story = "1. The ball is in the box."
+    questions = [
+        Question(g, "reality", None, story, "Where is the ball really?", answer)
+        for g, answer in enumerate(["box", "basket"] * 3)
+    ]
+    evaluator = Evaluator(Dispatcher(client, concurrency=2))
+
+    async def main():
+        return await evaluator.aevaluate(questions, limit=5)
+
+    accuracy = asyncio.run(main())
+    assert accuracy.total[("reality", None)] == 5
+    assert accuracy.correct[("reality", None)] == 3
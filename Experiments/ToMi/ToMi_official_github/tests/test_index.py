@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+# Copyright (c) 2019-present, Facebook, Inc.
+# All rights reserved.
+#
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+
+
+import os
+import numpy as np
+import pytest
+from tomi.index import StoryIndex
+
+
+@pytest.fixture(scope="module")
+def split(generate):
+    # A generated split, its stories and its trace lines
+    out_dir = generate("data", "-n", 60, "-s", 5)
+    path = os.path.join(out_dir, "test.txt")
+    with open(path, "r") as f:
+        stories, story = [], []
+        for line in f.read().splitlines():
+            if line.startswith("1 ") and story:
+                stories.append(story)
+                story = []
+            story.append(line)
+        stories.append(story)
+    with open(os.path.join(out_dir, "test.trace"), "r") as f:
+        traces = [line.rstrip("\n").split(",") for line in f]
+    return path, stories, traces
+
+
+def expected_ids(traces, story_type=None, question=None, agent_order=None):
+    ids = []
+    for i, trace in enumerate(traces):
+        label = trace[-2]
+        if story_type is not None and trace[-1] != story_type:
+            continue
+        if question is not None and not label.startswith(question):
+            continue
+        if agent_order is not None:
+            parts = label.split("_")
+            if "order" not in label or int(parts[2]) != agent_order:
+                continue
+        ids.append(i)
+    return ids
+
+
+def test_random_access(split):
+    path, stories, traces = split
+    with StoryIndex(path) as index:
+        assert len(index) == len(stories) == len(traces) == 360
+        assert index.num_groups == 60
+        for i in [0, 1, 5, 6, 180, 359]:
+            assert index.story(i) == stories[i]
+            assert index.trace(i) == traces[i]
+        assert index.group(2) == list(range(12, 18))
+
+
+@pytest.mark.parametrize(
+    "filters",
+    [
+        {},
+        {"story_type": "second_order_false_belief"},
+        {"question": "second_order"},
+        {"question": "first_order_0_tom"},
+        {"agent_order": 1},
+        {"story_type": "false_belief", "question": "first_order", "agent_order": 0},
+        {"story_type": "no_such_type"},
+    ],
+)
+def test_select(split, filters):
+    path, _, traces = split
+    with StoryIndex(path) as index:
+        ids = index.select(**filters)
+    assert ids.tolist() == expected_ids(traces, **filters)
+
+
+def test_stratified_sample(split):
+    path, _, traces = split
+    with StoryIndex(path) as index:
+        sample = index.stratified_sample(
+            4, np.random.default_rng(0), question="second_order"
+        )
+        again = index.stratified_sample(
+            4, np.random.default_rng(0), question="second_order"
+        )
+    assert sample.keys() == again.keys()
+    for label, ids in sample.items():
+        assert label.startswith("second_order")
+        assert ids.tolist() == again[label].tolist()
+        pool = [i for i, trace in enumerate(traces) if trace[-2] == label]
+        assert len(ids) == min(4, len(pool)) and set(ids.tolist()) <= set(pool)
+
+
+def test_stale_sidecar_is_rebuilt(split, tmp_path):
+    # Swapping two stories of different lengths keeps the file size, and the
+    # mtime is restored, but the index must still be rebuilt
+    source, stories, _ = split
+    j = next(j for j, story in enumerate(stories) if len(story) != len(stories[0]))
+    stories = [stories[j]] + stories[1:j] + [stories[0]] + stories[j + 1 :]
+    path = str(tmp_path / "test.txt")
+    for name in ["test.txt", "test.trace"]:
+        with open(os.path.join(os.path.dirname(source), name), "rb") as fin:
+            with open(tmp_path / name, "wb") as fout:
+                fout.write(fin.read())
+    StoryIndex(path).close()
+    stat = os.stat(path)
+    with open(path, "w") as f:
+        f.write("".join(line + "\n" for story in stories for line in story))
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    assert os.path.getsize(path) == stat.st_size
+    with StoryIndex(path) as index:
+        assert index.story(0) == stories[0]
+        assert index.story(j) == stories[j]
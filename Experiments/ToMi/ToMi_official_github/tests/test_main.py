@@ -0,0 +1,42 @@
+#!/usr/bin/env python3
+# Copyright (c) 2019-present, Facebook, Inc.
+# All rights reserved.
+#
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+
+
+import filecmp
+import os
+import pytest
+
+
+def listing(out_dir):
+    # Every output file, relative to out_dir
+    return sorted(
+        os.path.relpath(os.path.join(root, name), out_dir)
+        for root, _, names in os.walk(out_dir)
+        for name in names
+    )
+
+
+def assert_same_output(first, second):
+    files = listing(first)
+    assert files and files == listing(second)
+    for name in files:
+        path = os.path.join(first, name)
+        assert filecmp.cmp(path, os.path.join(second, name), shallow=False), name
+
+
+@pytest.mark.parametrize("fmt", ["text", "columnar", "csv"])
+def test_parallel_output_is_deterministic(generate, fmt):
+    args = ["-n", 60, "-s", 3, "-w", 3, "-f", fmt]
+    assert_same_output(generate("first", *args), generate("second", *args))
+
+
+def test_seed_changes_parallel_output(generate):
+    first = generate("first", "-n", 60, "-s", 3, "-w", 3)
+    second = generate("second", "-n", 60, "-s", 4, "-w", 3)
+    for name in ["train.txt", "train.trace"]:
+        paths = os.path.join(first, name), os.path.join(second, name)
+        assert not filecmp.cmp(*paths, shallow=False)
@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+# Copyright (c) 2019-present, Facebook, Inc.
+# All rights reserved.
+#
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+
+
+import os
+import numpy as np
+import pytest
+from tomi.actions import render_group
+from tomi.story import BatchStorySampler, StoryBatch, StoryType, generate_story
+from tomi.world import World
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def dense_world():
+    return World(os.path.join(ROOT, "tomi", "world.json"), np.random.default_rng(0))
+
+
+def sparse_world():
+    types = ["agents", "locations", "objects", "containers"]
+    return World.synthetic({t: 200 for t in types}, np.random.default_rng(0))
+
+
+@pytest.mark.parametrize("make_world", [dense_world, sparse_world])
+@pytest.mark.parametrize("story_type", [None, StoryType.second_order_false_belief])
+def test_batch_matches_acted_out_stories(make_world, story_type):
+    # StoryBatch computes from the sampler's arrays what generate_story acts
+    # out through an Oracle for the same draws
+    world = make_world()
+    sampler = BatchStorySampler(world, 2000, np.random.default_rng(1), story_type)
+    batch = StoryBatch(sampler)
+    assert len(batch) == 2000
+    for i in range(len(batch)):
+        row_type = sampler.story_types[i]
+        stories, traces, typ = generate_story(world, row_type, sampler.row(i))
+        batch_stories, batch_traces, batch_type = batch[i]
+        assert render_group(batch_stories) == render_group(stories)
+        assert batch_traces == traces
+        assert batch_type == typ
+        assert [s[-1].tom for s in batch_stories if hasattr(s[-1], "tom")] == [
+            s[-1].tom for s in stories if hasattr(s[-1], "tom")
+        ]
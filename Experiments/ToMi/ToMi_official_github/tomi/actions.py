@@ -7,33 +7,112 @@
 
 
 import numpy as np
-from .oracle import Oracle
+from .oracle import Oracle, OracleSnapshot
+from .world import World
 from typing import List, Tuple
 
 
 class Action(object):
-    def __init__(self, templates):
-        self.templates = templates
+    # Templates are filled with entity names at render time.  Each subclass
+    # lists its templates once in TEMPLATES; `fixed` pins the one an instance
+    # renders with, and single-template actions never touch the rng.
+    # Actions are slotted (every subclass declares __slots__) since corpora
+    # kept in memory hold millions of them: an instance only stores the
+    # entity ids in `args`, which `world` resolves to names.  Their entity
+    # types come from the class-level TYPES, one tuple per template or a
+    # single tuple shared by all templates.
+    __slots__ = ("world", "args", "fixed")
+    TEMPLATES = ()
+    TYPES = ((),)
+
+    def __init__(self, world: World = None, args=(), fixed: int = None):
+        self.world = world
+        self.args = args
+        self.fixed = fixed
+
+    @classmethod
+    def of(cls, world: World, args, fixed: int = None) -> "Action":
+        # An instance that renders `args` without running the subclass's
+        # __init__, i.e. without touching any oracle.  Used by generators
+        # that track state themselves (see tomi.long_story).
+        action = cls.__new__(cls)
+        Action.__init__(action, world, args, fixed)
+        return action
+
+    @property
+    def templates(self):
+        return self.TEMPLATES
+
+    @property
+    def types(self) -> Tuple[str, ...]:
+        if len(self.TYPES) == 1:
+            return self.TYPES[0]
+        return self.TYPES[self.fixed]
+
+    @property
+    def fill(self) -> Tuple[Tuple[str, int], ...]:
+        # (entity type, entity id) pairs, in template order
+        return tuple(zip(self.types, self.args))
+
+    def names(self):
+        name = self.world.name
+        return tuple([name(typ, idx) for typ, idx in zip(self.types, self.args)])
+
+    def template(self, rng: np.random.Generator = None) -> str:
+        # The unfilled template this action renders with
+        if self.fixed is not None:
+            return self.templates[self.fixed]
+        if len(self.templates) == 1:
+            return self.templates[0]
+        if rng is None:
+            rng = self.world.rng
+        return self.templates[rng.integers(0, len(self.templates))]
 
-    def render(self):
+    def render(self, rng: np.random.Generator = None):
         raise NotImplementedError
 
 
 class DeclarativeAction(Action):
-    def render(self):
-        if hasattr(self, "fixed"):
-            return self.templates[self.fixed]
-        return np.random.choice(self.templates)
+    __slots__ = ()
+
+    def render(self, rng: np.random.Generator = None):
+        return self.template(rng) % self.names()
 
 
 class InterrogativeAction(Action):
-    def render(self):
-        if hasattr(self, "fixed"):
-            return self.templates[self.fixed]
-        return np.random.choice(self.templates)
+    __slots__ = ()
+
+    def render(self, rng: np.random.Generator = None):
+        return self.template(rng) % self.names()
+
+
+def render_story(
+    story: List[Action], rng: np.random.Generator = None, sep: str = " ", start: int = 1
+) -> List[str]:
+    # Numbered lines of a story ("1 Mary entered the kitchen.") rendered into
+    # one list, ready for a single "\n".join
+    return [
+        f"{i}{sep}{action.render(rng)}" for i, action in enumerate(story, start)
+    ]
+
+
+def render_group(
+    stories: List[List[Action]], rng: np.random.Generator = None, sep: str = " "
+) -> List[str]:
+    # Text of each question variant of a story group.  The variants share
+    # their chapter, which is rendered once and reused, so all six stories
+    # read the same even for actions with several templates.
+    chapter = render_story(stories[0][:-1], rng, sep)
+    n = len(chapter) + 1
+    body = "\n".join(chapter)
+    if body:
+        body += "\n"
+    return [f"{body}{n}{sep}{story[-1].render(rng)}" for story in stories]
 
 
 class ExitAction(DeclarativeAction):
+    __slots__ = ()
+
     def __init__(self):
         super.__init__(
             ["%s exited the %s.", "%s left the %s.", "%s went out of the %s.",]
@@ -41,65 +120,77 @@ class ExitAction(DeclarativeAction):
 
 
 class SearchedAction(InterrogativeAction):
-    def __init__(self, oracle: Oracle, agent: str, obj: str):
+    __slots__ = ("tom",)
+    TEMPLATES = ("Where will %s look for the %s?\t%s\t1",)
+    TYPES = (("agents", "objects", "containers"),)
+
+    def __init__(self, oracle: Oracle, agent: int, obj: int):
         ans = oracle.get_direct_belief(agent, obj)
         # Label whether or not this question requires theory of mind
         self.tom = ans != oracle.get_object_container(obj)
-        fill = (agent, obj, ans)
-        super().__init__(
-            ["Where will %s look for the %s?\t%s\t1" % fill,]
-        )
+        super().__init__(world=oracle.world, args=(agent, obj, ans))
 
 
 class BeliefSearchAction(InterrogativeAction):
-    def __init__(self, oracle: Oracle, a1: str, a2: str, obj: str):
+    __slots__ = ("tom",)
+    TEMPLATES = ("Where does %s think that %s searches for the %s?\t%s\t1",)
+    TYPES = (("agents", "agents", "objects", "containers"),)
+
+    def __init__(self, oracle: Oracle, a1: int, a2: int, obj: int):
         ans = oracle.get_indirect_belief(a1, a2, obj)
         # Does this question require theory of mind?
         self.tom = ans != oracle.get_object_container(obj)
-        fill = (a1, a2, obj, ans)
-        super().__init__(
-            ["Where does %s think that %s searches for the %s?\t%s\t1" % fill,]
-        )
+        super().__init__(world=oracle.world, args=(a1, a2, obj, ans))
 
 
 class RealityAction(InterrogativeAction):
-    def __init__(self, oracle: Oracle, obj: str):
-        fill = (obj, oracle.get_object_container(obj))
-        super().__init__(
-            ["Where is the %s really?\t%s\t1" % fill,]
-        )
+    __slots__ = ()
+    TEMPLATES = ("Where is the %s really?\t%s\t1",)
+    TYPES = (("objects", "containers"),)
+
+    def __init__(self, oracle: Oracle, obj: int):
+        args = (obj, oracle.get_object_container(obj))
+        super().__init__(world=oracle.world, args=args)
 
 
 class MemoryAction(InterrogativeAction):
-    def __init__(self, oracle_start_state: Oracle, obj: str):
-        fill = (obj, oracle_start_state.locations.obj_containers[obj])
-        super().__init__(
-            ["Where was the %s at the beginning?\t%s\t1" % fill,]
-        )
+    __slots__ = ()
+    TEMPLATES = ("Where was the %s at the beginning?\t%s\t1",)
+    TYPES = (("objects", "containers"),)
+
+    def __init__(self, oracle_start_state: OracleSnapshot, obj: int):
+        args = (obj, oracle_start_state.get_object_container(obj))
+        super().__init__(world=oracle_start_state.oracle.world, args=args)
 
 
 class LocationAction(DeclarativeAction):
-    def __init__(self, oracle: Oracle, args: str):
+    __slots__ = ()
+    TEMPLATES = ("%s is in the %s.", "%s and %s are in the %s.")
+    TYPES = (("agents", "locations"), ("agents", "agents", "locations"))
+
+    def __init__(self, oracle: Oracle, args: Tuple[int, ...]):
         if len(args) == 2:
-            statement = "%s is in the %s." % args
+            fixed = 0
             a1, loc = args
             # may be redundant
             oracle.set_location(a1, loc)
         else:  # 2 people
-            statement = "%s and %s are in the %s." % args
+            fixed = 1
             a1, a2, loc = args
             # may be redundant
             oracle.set_location(a1, loc)
             oracle.set_location(a2, loc)
-        super().__init__([statement])
+        super().__init__(world=oracle.world, args=tuple(args), fixed=fixed)
 
 
 class ObjectLocAction(DeclarativeAction):
-    def __init__(self, oracle: Oracle, obj: str, observers: List[str]):
+    __slots__ = ()
+    TEMPLATES = ("The %s is in the %s.",)
+    TYPES = (("objects", "containers"),)
+
+    def __init__(self, oracle: Oracle, obj: int, observers: List[int]):
         container = oracle.get_object_container(obj)
-        super().__init__(
-            ["The %s is in the %s." % (obj, container),]
-        )
+        super().__init__(world=oracle.world, args=(obj, container))
 
         # set direct beliefs
         for observer in observers:
@@ -113,24 +204,28 @@ class ObjectLocAction(DeclarativeAction):
 
 
 class ExitedAction(DeclarativeAction):
-    def __init__(self, oracle: Oracle, agent: str):
-        fill = (agent, oracle.get_location(agent))
+    __slots__ = ()
+    TEMPLATES = ("%s exited the %s.",)
+    TYPES = (("agents", "locations"),)
 
-        super().__init__(
-            ["%s exited the %s." % fill,]
-        )
+    def __init__(self, oracle: Oracle, agent: int):
+        args = (agent, oracle.get_location(agent))
+
+        super().__init__(world=oracle.world, args=args)
         oracle.set_location(agent, None)
 
 
 class MoveAction(DeclarativeAction):
+    __slots__ = ()
+    TEMPLATES = ("%s moved the %s to the %s.",)
+    TYPES = (("agents", "objects", "containers"),)
+
     def __init__(
-        self, oracle: Oracle, args: Tuple[str, str, str], observers: List[str] = None
+        self, oracle: Oracle, args: Tuple[int, int, int], observers: List[int] = None
     ):
-        super().__init__(
-            ["%s moved the %s to the %s." % args,]
-        )
-
         agent, obj, container = args
+        super().__init__(world=oracle.world, args=(agent, obj, container))
+
         oracle.set_object_container(obj, container)
 
         if not observers:
@@ -148,12 +243,14 @@ class MoveAction(DeclarativeAction):
 
 
 class PeekAction(DeclarativeAction):
-    def __init__(self, oracle, args: Tuple[str, str], observers: List[str] = None):
-        super().__init__(
-            ["%s looked in the %s." % args,]
-        )
+    __slots__ = ()
+    TEMPLATES = ("%s looked in the %s.",)
+    TYPES = (("agents", "containers"),)
 
+    def __init__(self, oracle, args: Tuple[int, int], observers: List[int] = None):
         agent, container = args
+        super().__init__(world=oracle.world, args=(agent, container))
+
         contents = oracle.get_container_obj(container)
 
         if not observers:
@@ -174,10 +271,12 @@ class PeekAction(DeclarativeAction):
 
 
 class TellAction(DeclarativeAction):
-    def __init__(self, oracle: Oracle, a1: str, a2: str, obj: str):
-        super().__init__(
-            ["%s told %s where the %s is." % (a1, a2, obj),]
-        )
+    __slots__ = ()
+    TEMPLATES = ("%s told %s where the %s is.",)
+    TYPES = (("agents", "agents", "objects"),)
+
+    def __init__(self, oracle: Oracle, a1: int, a2: int, obj: int):
+        super().__init__(world=oracle.world, args=(a1, a2, obj))
 
         container = oracle.get_object_container(obj)
         oracle.set_direct_belief(a2, obj, container)
@@ -185,18 +284,20 @@ class TellAction(DeclarativeAction):
 
 
 class EnterAction(DeclarativeAction):
+    __slots__ = ()
+    TEMPLATES = ("%s entered the %s.",)
+    TYPES = (("agents", "locations"),)
+
     def __init__(
         self,
         oracle: Oracle,
-        args: Tuple[str, str],
-        observers: List[str] = None,
+        args: Tuple[int, int],
+        observers: List[int] = None,
         no_world_adjust: bool = False,
     ):
-        super().__init__(
-            ["%s entered the %s." % args,]
-        )
-
         agent, location = args
+        super().__init__(world=oracle.world, args=(agent, location))
+
         oracle.set_location(agent, location)
         # assume all containers are not enclosed
         # agent knows location of everything
@@ -218,13 +319,25 @@ class EnterAction(DeclarativeAction):
 
 
 class NoiseAction(DeclarativeAction):
-    def __init__(self, oracle: Oracle, person: str, thing: str):
-        super().__init__(
-            [
-                f"{person} likes the {thing}",
-                f"{person} dislikes the {thing}",
-                f"{person} loves the {thing}",
-                f"{person} hates the {thing}",
-            ]
-        )
-        self.fixed = np.random.randint(0, len(self.templates))
+    __slots__ = ()
+    TEMPLATES = (
+        "%s likes the %s",
+        "%s dislikes the %s",
+        "%s loves the %s",
+        "%s hates the %s",
+    )
+    TYPES = (("agents", "objects"),)
+
+    def __init__(
+        self,
+        oracle: Oracle,
+        person: int,
+        thing: int,
+        fixed: int = None,
+        rng: np.random.Generator = None,
+    ):
+        if fixed is None:
+            if rng is None:
+                rng = oracle.world.rng
+            fixed = rng.integers(0, len(self.TEMPLATES))
+        super().__init__(world=oracle.world, args=(person, thing), fixed=fixed)
@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+# Copyright (c) 2019-present, Facebook, Inc.
+# All rights reserved.
+#
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+
+
+import hashlib
+import json
+import os
+import re
+from .evaluate import Accuracy, Prompt, Question, normalize
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+# Offline evaluation through provider batch endpoints.  build_shards writes
+# one request per question as batch-request JSONL, split into shards under
+# the provider's per-file limit.  ingest joins the returned result files back
+# to the same questions and scores them like tomi.evaluate.  Requests are
+# matched to questions by custom id "<name>-<group>-<slot>": the story group
+# and the question's position in it, so ids are stable across rebuilds of
+# the same dataset.
+#
+# Request and result lines follow the OpenAI Batch API ("openai") or the
+# Anthropic Message Batches API ("anthropic"); ingest reads either.
+
+PROVIDERS = ["openai", "anthropic"]
+
+# Model a batch is built for when none is given, per provider
+DEFAULT_MODELS = {"openai": "gpt-4o-mini", "anthropic": "claude-3-5-haiku-latest"}
+
+# Requests per shard; both providers accept up to 50,000 per batch
+SHARD_SIZE = 50000
+
+# Answers are a single word; Anthropic requests must set a token limit
+MAX_TOKENS = 16
+
+# Longest name kept in a custom id, leaving room for "-<group>-<slot>"
+MAX_NAME = 40
+
+
+def custom_id(name: str, group: int, slot: int) -> str:
+    # Anthropic ids are limited to [a-zA-Z0-9_-]{1,64}.  A name that has to
+    # be cut or have characters replaced ends in a hash of the full name, so
+    # two such names do not share ids.
+    safe = re.sub(r"[^a-zA-Z0-9_-]", "_", name)
+    if safe != name or len(safe) > MAX_NAME:
+        digest = hashlib.sha1(name.encode()).hexdigest()[:8]
+        safe = f"{safe[: MAX_NAME - 9]}_{digest}"
+    return f"{safe}-{group}-{slot}"
+
+
+def with_slots(questions: Iterable[Question]) -> Iterator[Tuple[int, Question]]:
+    # (position in its story group, question)
+    group, slot = None, 0
+    for question in questions:
+        slot = slot + 1 if question.group == group else 0
+        group = question.group
+        yield slot, question
+
+
+def request_line(
+    provider: str,
+    request_id: str,
+    messages: List[Tuple[str, str]],
+    model: str,
+    params: Dict = None,
+) -> Dict:
+    params = params or {}
+    if provider == "openai":
+        roles = {"system": "system", "human": "user"}
+        body = {
+            "model": model,
+            "messages": [
+                {"role": roles[role], "content": content} for role, content in messages
+            ],
+        }
+        body.update(params)
+        return {
+            "custom_id": request_id,
+            "method": "POST",
+            "url": "/v1/chat/completions",
+            "body": body,
+        }
+    if provider == "anthropic":
+        system = "\n".join(content for role, content in messages if role == "system")
+        body = {
+            "model": model,
+            "max_tokens": MAX_TOKENS,
+            "system": system,
+            "messages": [
+                {"role": "user", "content": content}
+                for role, content in messages
+                if role != "system"
+            ],
+        }
+        body.update(params)
+        return {"custom_id": request_id, "params": body}
+    raise ValueError(f"Unknown provider: {provider}")
+
+
+def build_shards(
+    questions: Iterable[Question],
+    out_dir: str,
+    name: str,
+    model: str,
+    prompt: Prompt = None,
+    provider: str = "openai",
+    params: Dict = None,
+    shard_size: int = SHARD_SIZE,
+) -> List[str]:
+    # Write <out_dir>/<name>.batch-00000.jsonl, ...; returns their paths
+    if prompt is None:
+        prompt = Prompt()
+    os.makedirs(out_dir, exist_ok=True)
+    paths, fout, count = [], None, 0
+    try:
+        for slot, question in with_slots(questions):
+            if count % shard_size == 0:
+                if fout is not None:
+                    fout.close()
+                shard = f"{name}.batch-{len(paths):05d}.jsonl"
+                paths.append(os.path.join(out_dir, shard))
+                fout = open(paths[-1], "w")
+            messages = prompt.messages(question.story, question.question)
+            request_id = custom_id(name, question.group, slot)
+            line = request_line(provider, request_id, messages, model, params)
+            fout.write(json.dumps(line, ensure_ascii=False) + "\n")
+            count += 1
+    finally:
+        if fout is not None:
+            fout.close()
+    return paths
+
+
+def parse_result(result: Dict) -> Tuple[str, Optional[str]]:
+    # (custom id, answer text), the text None for failed requests
+    request_id = result["custom_id"]
+    if "response" in result:
+        # OpenAI: {"response": {"status_code": 200, "body": {"choices": ...}}}
+        response = result.get("response") or {}
+        if result.get("error") or response.get("status_code") != 200:
+            return request_id, None
+        choices = response["body"]["choices"]
+        return request_id, choices[0]["message"]["content"]
+    # Anthropic: {"result": {"type": "succeeded", "message": {"content": ...}}}
+    outcome = result.get("result") or {}
+    if outcome.get("type") != "succeeded":
+        return request_id, None
+    blocks = outcome["message"]["content"]
+    return request_id, "".join(b["text"] for b in blocks if b["type"] == "text")
+
+
+def read_results(paths: Iterable[str]) -> Dict[str, Optional[str]]:
+    # A custom id seen twice (e.g. the same result file passed twice, or
+    # shards of two builds mixed) cannot be joined back unambiguously
+    results = {}
+    for path in paths:
+        with open(path, "r") as f:
+            for number, line in enumerate(f, 1):
+                if line.strip():
+                    request_id, text = parse_result(json.loads(line))
+                    if request_id in results:
+                        raise ValueError(
+                            f"Duplicate custom id {request_id!r} at {path}:{number}"
+                        )
+                    results[request_id] = text
+    return results
+
+
+def ingest(
+    questions: Iterable[Question],
+    results: Dict[str, Optional[str]],
+    name: str,
+    normalize: Callable[[str], str] = normalize,
+    callback: Callable[[Question, str, bool], None] = None,
+) -> Tuple[Accuracy, Dict[str, int]]:
+    # Score every question that has an answer in `results`.  Also returns
+    # how many were answered, failed, or had no result line at all.
+    accuracy = Accuracy()
+    counts = {"answered": 0, "failed": 0, "missing": 0}
+    for slot, question in with_slots(questions):
+        request_id = custom_id(name, question.group, slot)
+        if request_id not in results:
+            counts["missing"] += 1
+            continue
+        prediction = results[request_id]
+        if prediction is None:
+            counts["failed"] += 1
+            continue
+        counts["answered"] += 1
+        correct = normalize(prediction) == normalize(question.answer)
+        accuracy.add(question.category, correct)
+        if callback is not None:
+            callback(question, prediction, correct)
+    return accuracy, counts
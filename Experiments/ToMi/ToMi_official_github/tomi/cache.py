@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+# Copyright (c) 2019-present, Facebook, Inc.
+# All rights reserved.
+#
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+
+
+import collections
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+# On-disk cache of model answers, so re-running an evaluation (e.g. with a
+# different answer normalization) does not pay for the same requests again.
+# Entries live in one SQLite table keyed by a hash of (model, decoding
+# params, messages); the messages hold the system prompt, story and question.
+# The database is in WAL mode, so several processes can read and write it at
+# once.  With max_bytes set, the least recently used answers are evicted once
+# the stored size goes over it; hits only record their time in memory, and
+# the times are written out when eviction runs, so a hit costs no write.  A
+# read-only cache replays stored answers and raises CacheMiss for anything
+# else, which guarantees no API calls are made.
+
+Messages = List[Tuple[str, str]]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    key TEXT PRIMARY KEY,
+    response TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    last_used REAL NOT NULL
+)
+"""
+
+# Check the size limit after this many writes
+EVICT_EVERY = 100
+
+
+class CacheMiss(KeyError):
+    pass
+
+
+class ResponseCache(object):
+    def __init__(
+        self,
+        path: str,
+        model: str,
+        params: Dict[str, Any] = None,
+        max_bytes: int = None,
+        read_only: bool = False,
+    ):
+        self.path = path
+        self.model = model
+        self.params = params or {}
+        self.max_bytes = max_bytes
+        self.read_only = read_only
+        self.stats = collections.Counter()
+        # {key: last hit time} not yet written to the database
+        self.touched = {}
+        # One connection shared by the dispatcher's threads
+        self.lock = threading.Lock()
+        if read_only:
+            self.db = sqlite3.connect(
+                f"file:{path}?mode=ro", uri=True, check_same_thread=False
+            )
+        else:
+            self.db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+            self.db.execute("PRAGMA journal_mode=WAL")
+            self.db.execute(SCHEMA)
+            self.db.commit()
+
+    def key(self, messages: Messages) -> str:
+        request = [self.model, self.params, [list(m) for m in messages]]
+        blob = json.dumps(request, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(blob.encode()).hexdigest()
+
+    def get(self, messages: Messages) -> Optional[str]:
+        key = self.key(messages)
+        with self.lock:
+            row = self.db.execute(
+                "SELECT response FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                self.stats["misses"] += 1
+                return None
+            self.stats["hits"] += 1
+            # last_used only matters for eviction
+            if self.max_bytes is not None and not self.read_only:
+                self.touched[key] = time.time()
+        return row[0]
+
+    def put(self, messages: Messages, response: str):
+        if self.read_only:
+            raise PermissionError(f"{self.path} is opened read-only")
+        key = self.key(messages)
+        size = len(key) + len(response.encode())
+        with self.lock:
+            self.touched.pop(key, None)
+            self.db.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?)",
+                (key, response, size, time.time()),
+            )
+            self.db.commit()
+            self.stats["writes"] += 1
+            if self.max_bytes is not None and self.stats["writes"] % EVICT_EVERY == 0:
+                self._evict()
+
+    def _flush_touched(self):
+        self.db.executemany(
+            "UPDATE responses SET last_used = ? WHERE key = ?",
+            [(used, key) for key, used in self.touched.items()],
+        )
+        self.touched.clear()
+
+    def _evict(self):
+        # Drop least recently used entries until the total fits max_bytes
+        self._flush_touched()
+        (total,) = self.db.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM responses"
+        ).fetchone()
+        if total <= self.max_bytes:
+            self.db.commit()
+            return
+        rows = self.db.execute("SELECT key, size FROM responses ORDER BY last_used")
+        evict = []
+        for key, size in rows:
+            if total <= self.max_bytes:
+                break
+            evict.append((key,))
+            total -= size
+        self.db.executemany("DELETE FROM responses WHERE key = ?", evict)
+        self.db.commit()
+        self.stats["evictions"] += len(evict)
+
+    def evict(self):
+        with self.lock:
+            if self.max_bytes is not None:
+                self._evict()
+
+    def __len__(self):
+        with self.lock:
+            return self.db.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+
+    def lookup(self, messages: Messages) -> Optional[str]:
+        # get(), but a miss on a read-only cache is an error
+        response = self.get(messages)
+        if response is None and self.read_only:
+            raise CacheMiss(self.key(messages))
+        return response
+
+    def close(self):
+        if self.max_bytes is not None and not self.read_only:
+            self.evict()
+        self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def cached_client(client: Callable, cache: ResponseCache) -> Callable:
+    # Blocking client that answers from `cache` when it can.  For async
+    # clients, pass the cache to tomi.dispatch.Dispatcher instead.
+    def ask(messages: Messages) -> str:
+        response = cache.lookup(messages)
+        if response is None:
+            response = client(messages)
+            cache.put(messages, response)
+        return response
+
+    return ask
@@ -0,0 +1,305 @@
+#!/usr/bin/env python3
+# Copyright (c) 2019-present, Facebook, Inc.
+# All rights reserved.
+#
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+
+
+import json
+import os
+import shutil
+from array import array
+import numpy as np
+from .story import StoryType
+from .world import World
+from typing import Dict, List
+
+# A columnar dataset is a directory of .npy files plus a meta.json holding the
+# dictionaries the integer columns are encoded against.  There is one row per
+# story group (the six question variants of a story), in the same order as the
+# .txt/.trace files, so row i joins with trace lines 6 * i ... 6 * i + 5.
+#
+#   story_type       (n,)        code into meta["story_types"]
+#   step_offsets     (n + 1,)    row i owns steps step_offsets[i]:step_offsets[i + 1]
+#   step_templates   (steps,)    code into meta["templates"]
+#   step_args        (steps, 4)  entity ids filling the template, -1 padded
+#   trace_offsets    (n + 1,)    row i owns trace events trace_offsets[i]:...
+#   trace_events     (events,)   code into meta["trace_events"]
+#   question_templates (n, 6)    code into meta["templates"]
+#   question_args    (n, 6, 4)   entity ids filling the question, -1 padded
+#   question_traces  (n, 6)      code into meta["question_traces"]
+#
+# Entity ids index meta["entities"][type], where the type of each template
+# argument is listed in meta["templates"][code]["types"].  Only the entities
+# the split uses are stored, numbered in order of first use;
+# meta["entity_ids"][type][id] is the entity's id in the World, so meta.json
+# stays small even for a World.synthetic vocabulary of millions of names.
+
+NUM_QUESTIONS = 6
+MAX_ARGS = 4
+COLUMNS = [
+    "story_type",
+    "step_offsets",
+    "step_templates",
+    "step_args",
+    "trace_offsets",
+    "trace_events",
+    "question_templates",
+    "question_args",
+    "question_traces",
+]
+
+
+class ColumnarWriter(object):
+    # Accumulates story groups into compact typed arrays and saves them as
+    # one .npy file per column on close().
+    def __init__(self, path: str, world: World):
+        self.path = path
+        self.world = world
+        self.story_types = {t.value: i for i, t in enumerate(StoryType)}
+        self.templates = {}
+        self.trace_events = {}
+        self.question_traces = {}
+        # {type: {world id: stored id}}
+        self.entity_ids = {}
+
+        self.story_type = array("B")
+        self.step_offsets = array("q", [0])
+        self.step_templates = array("H")
+        self.step_args = array("i")
+        self.trace_offsets = array("q", [0])
+        self.trace_event_codes = array("H")
+        self.question_templates = array("H")
+        self.question_args = array("i")
+        self.question_trace_codes = array("H")
+
+    def _code(self, table: Dict, key) -> int:
+        if key not in table:
+            table[key] = len(table)
+        return table[key]
+
+    def _encode(self, action, templates: array, args: array):
+        template = action.template()
+        templates.append(self._code(self.templates, (template, action.types)))
+        ids = []
+        for typ, idx in action.fill:
+            entity_ids = self.entity_ids.setdefault(typ, {})
+            ids.append(-1 if idx is None else self._code(entity_ids, int(idx)))
+        args.extend(ids + [-1] * (MAX_ARGS - len(ids)))
+
+    def write(
+        self, stories: List[list], traces: List[List[str]], story_type: StoryType
+    ):
+        # All six variants share the chapter and trace prefix
+        chapter, trace = stories[0][:-1], traces[0][:-1]
+        self.story_type.append(self.story_types[story_type.value])
+        for action in chapter:
+            self._encode(action, self.step_templates, self.step_args)
+        self.step_offsets.append(self.step_offsets[-1] + len(chapter))
+        for event in trace:
+            self.trace_event_codes.append(self._code(self.trace_events, event))
+        self.trace_offsets.append(self.trace_offsets[-1] + len(trace))
+        for story, story_trace in zip(stories, traces):
+            self._encode(story[-1], self.question_templates, self.question_args)
+            self.question_trace_codes.append(
+                self._code(self.question_traces, story_trace[-1])
+            )
+
+    def close(self):
+        n = len(self.story_type)
+        columns = {
+            "story_type": np.frombuffer(self.story_type, dtype=np.uint8),
+            "step_offsets": np.frombuffer(self.step_offsets, dtype=np.int64),
+            "step_templates": np.frombuffer(self.step_templates, dtype=np.uint16),
+            "step_args": np.frombuffer(self.step_args, dtype=np.int32).reshape(
+                -1, MAX_ARGS
+            ),
+            "trace_offsets": np.frombuffer(self.trace_offsets, dtype=np.int64),
+            "trace_events": np.frombuffer(self.trace_event_codes, dtype=np.uint16),
+            "question_templates": np.frombuffer(
+                self.question_templates, dtype=np.uint16
+            ).reshape(n, NUM_QUESTIONS),
+            "question_args": np.frombuffer(self.question_args, dtype=np.int32).reshape(
+                n, NUM_QUESTIONS, MAX_ARGS
+            ),
+            "question_traces": np.frombuffer(
+                self.question_trace_codes, dtype=np.uint16
+            ).reshape(n, NUM_QUESTIONS),
+        }
+        meta = {
+            "num_rows": n,
+            "entities": {
+                typ: [self.world.name(typ, idx) for idx in ids]
+                for typ, ids in self.entity_ids.items()
+            },
+            "entity_ids": {typ: list(ids) for typ, ids in self.entity_ids.items()},
+            "story_types": list(self.story_types),
+            "templates": [
+                {"template": template, "types": list(types)}
+                for template, types in self.templates
+            ],
+            "trace_events": list(self.trace_events),
+            "question_traces": list(self.question_traces),
+        }
+        save_columns(self.path, columns, meta)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def save_columns(path: str, columns: Dict[str, np.ndarray], meta: Dict):
+    os.makedirs(path, exist_ok=True)
+    for name in COLUMNS:
+        np.save(os.path.join(path, f"{name}.npy"), columns[name])
+    with open(os.path.join(path, "meta.json"), "w") as f:
+        json.dump(meta, f)
+
+
+class Columns(object):
+    # Read side of a columnar dataset.  Columns are memory-mapped by default,
+    # so opening a dataset costs a few page faults rather than a full parse.
+    def __init__(self, path: str, mmap: bool = True):
+        with open(os.path.join(path, "meta.json"), "r") as f:
+            self.meta = json.load(f)
+        mmap_mode = "r" if mmap else None
+        self.columns = {
+            name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode=mmap_mode)
+            for name in COLUMNS
+        }
+
+    def __len__(self):
+        return self.meta["num_rows"]
+
+    def __getitem__(self, name: str) -> np.ndarray:
+        return self.columns[name]
+
+    def _render(self, template_code: int, args: np.ndarray) -> str:
+        template = self.meta["templates"][template_code]
+        entities = self.meta["entities"]
+        names = tuple(
+            None if idx < 0 else entities[typ][idx]
+            for typ, idx in zip(template["types"], args)
+        )
+        return template["template"] % names
+
+    def story_type(self, i: int) -> str:
+        return self.meta["story_types"][self["story_type"][i]]
+
+    def story(self, i: int) -> List[str]:
+        # Rendered chapter lines of row i, without step numbers
+        start, end = self["step_offsets"][i], self["step_offsets"][i + 1]
+        return [
+            self._render(code, args)
+            for code, args in zip(
+                self["step_templates"][start:end], self["step_args"][start:end]
+            )
+        ]
+
+    def question(self, i: int, j: int) -> str:
+        # Rendered question j of row i, as "question\tanswer\t1"
+        return self._render(
+            self["question_templates"][i, j], self["question_args"][i, j]
+        )
+
+    def trace(self, i: int, j: int) -> List[str]:
+        # The .trace line of variant j of row i, as a list of fields
+        start, end = self["trace_offsets"][i], self["trace_offsets"][i + 1]
+        codes = self["trace_events"][start:end]
+        events = [self.meta["trace_events"][c] for c in codes]
+        question = self.meta["question_traces"][self["question_traces"][i, j]]
+        return events + [question, self.story_type(i)]
+
+
+def merge_columns(paths: List[str], out_path: str):
+    # Concatenate columnar datasets in order, re-encoding every dictionary
+    # code against the merged dictionaries.
+    parts = [Columns(path) for path in paths]
+    meta = {
+        "num_rows": sum(len(part) for part in parts),
+        "story_types": [t.value for t in StoryType],
+    }
+    merged = {}
+    # Entities are keyed by World id; {type: {world id: merged id}}
+    entity_ids = {}
+    for part in parts:
+        for typ, ids in part.meta["entity_ids"].items():
+            merged_ids = entity_ids.setdefault(typ, {})
+            for idx, name in zip(ids, part.meta["entities"][typ]):
+                if idx not in merged_ids:
+                    merged_ids[idx] = (len(merged_ids), name)
+    meta["entities"] = {
+        typ: [name for _, name in ids.values()] for typ, ids in entity_ids.items()
+    }
+    meta["entity_ids"] = {typ: list(ids) for typ, ids in entity_ids.items()}
+    for key in ["templates", "trace_events", "question_traces"]:
+        values = []
+        for part in parts:
+            for value in part.meta[key]:
+                if value not in values:
+                    values.append(value)
+        meta[key] = values
+
+    def recode(part, key, column):
+        lookup = np.array(
+            [meta[key].index(value) for value in part.meta[key]], dtype=column.dtype
+        )
+        return lookup[column] if len(lookup) else column
+
+    def recode_args(part, templates, args):
+        # Each argument is an id of the type its template lists for it
+        lookups = {
+            typ: np.array([entity_ids[typ][idx][0] for idx in ids], dtype=args.dtype)
+            for typ, ids in part.meta["entity_ids"].items()
+        }
+        recoded = np.array(args)
+        for code, template in enumerate(part.meta["templates"]):
+            rows = templates == code
+            for position, typ in enumerate(template["types"]):
+                ids = args[rows, position]
+                if len(lookups[typ]):
+                    recoded[rows, position] = np.where(
+                        ids < 0, ids, lookups[typ][np.maximum(ids, 0)]
+                    )
+        return recoded
+
+    columns = {name: [] for name in COLUMNS}
+    step_base, trace_base = 0, 0
+    for part in parts:
+        story_types = np.array(
+            [meta["story_types"].index(t) for t in part.meta["story_types"]],
+            dtype=np.uint8,
+        )
+        columns["story_type"].append(story_types[part["story_type"]])
+        columns["step_offsets"].append(part["step_offsets"][:-1] + step_base)
+        columns["trace_offsets"].append(part["trace_offsets"][:-1] + trace_base)
+        step_base += part["step_offsets"][-1]
+        trace_base += part["trace_offsets"][-1]
+        columns["step_templates"].append(
+            recode(part, "templates", part["step_templates"])
+        )
+        columns["step_args"].append(
+            recode_args(part, part["step_templates"], part["step_args"])
+        )
+        columns["trace_events"].append(
+            recode(part, "trace_events", part["trace_events"])
+        )
+        columns["question_templates"].append(
+            recode(part, "templates", part["question_templates"])
+        )
+        columns["question_args"].append(
+            recode_args(part, part["question_templates"], part["question_args"])
+        )
+        columns["question_traces"].append(
+            recode(part, "question_traces", part["question_traces"])
+        )
+    columns["step_offsets"].append(np.array([step_base], dtype=np.int64))
+    columns["trace_offsets"].append(np.array([trace_base], dtype=np.int64))
+    for name in COLUMNS:
+        merged[name] = np.concatenate(columns[name])
+    save_columns(out_path, merged, meta)
+    for path in paths:
+        shutil.rmtree(path)
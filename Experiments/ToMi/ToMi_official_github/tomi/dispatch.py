@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+# Copyright (c) 2019-present, Facebook, Inc.
+# All rights reserved.
+#
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+
+
+import asyncio
+import collections
+import inspect
+import time
+import numpy as np
+from .cache import ResponseCache
+from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncIterator, Callable, Iterable, List, Tuple, TypeVar
+
+# Concurrent dispatch of chat requests.  A Dispatcher wraps a client (see
+# tomi.evaluate) and is itself an async client: every call waits for a free
+# slot under the concurrency limit and for the rate limiter, and is retried
+# with jittered exponential backoff if the client raises a transient error.
+# map() runs many requests at once and hands the answers back in input
+# order.  With a ResponseCache (tomi.cache), cached answers skip all of the
+# above; the cache is only touched from worker threads, never on the event
+# loop.
+
+Messages = List[Tuple[str, str]]
+T = TypeVar("T")
+
+
+def estimate_tokens(messages: Messages, max_output: int = 16) -> int:
+    # Rough prompt size (about 4 characters per token) plus the answer budget
+    return sum(len(content) for _, content in messages) // 4 + max_output
+
+
+class TokenBucket(object):
+    # Holds up to `capacity` tokens (a minute's worth by default), refilled
+    # continuously at `per_minute`.  acquire(n) waits until n tokens are
+    # available and takes them; waiters are served in arrival order.
+    def __init__(self, per_minute: float, capacity: float = None):
+        self.rate = per_minute / 60.0
+        self.capacity = per_minute if capacity is None else capacity
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = None
+
+    def _refill(self):
+        now = time.monotonic()
+        refill = (now - self.updated) * self.rate
+        self.tokens = min(self.capacity, self.tokens + refill)
+        self.updated = now
+
+    async def acquire(self, amount: float = 1):
+        # More than the capacity could never be granted; take it all instead
+        amount = min(amount, self.capacity)
+        if self.lock is None:
+            self.lock = asyncio.Lock()
+        async with self.lock:
+            self._refill()
+            while self.tokens < amount:
+                await asyncio.sleep((amount - self.tokens) / self.rate)
+                self._refill()
+            self.tokens -= amount
+
+
+class RateLimiter(object):
+    # Requests per minute and (estimated) tokens per minute; either may be None
+    def __init__(
+        self, requests_per_minute: float = None, tokens_per_minute: float = None
+    ):
+        self.buckets = {}
+        if requests_per_minute:
+            self.buckets["requests"] = TokenBucket(requests_per_minute)
+        if tokens_per_minute:
+            self.buckets["tokens"] = TokenBucket(tokens_per_minute)
+
+    async def acquire(self, tokens: int):
+        if "requests" in self.buckets:
+            await self.buckets["requests"].acquire(1)
+        if "tokens" in self.buckets:
+            await self.buckets["tokens"].acquire(tokens)
+
+    def reset(self):
+        # Locks belong to the event loop that created them
+        for bucket in self.buckets.values():
+            bucket.lock = None
+
+
+# Errors worth retrying: the network failed, the request timed out, or the
+# provider is rate limiting or overloaded.  Anything else (a bad request, a
+# bug in the client) fails the same way again.  The provider SDKs (openai,
+# anthropic) and httpx are optional, so their errors are recognized by class
+# name, or by the HTTP status the SDKs attach to their errors.
+TRANSIENT_ERRORS = (ConnectionError, TimeoutError, asyncio.TimeoutError)
+TRANSIENT_NAMES = {
+    "APIConnectionError",
+    "APITimeoutError",
+    "RateLimitError",
+    "InternalServerError",
+    "OverloadedError",
+    "TransportError",
+}
+TRANSIENT_STATUS = {408, 429, 500, 502, 503, 504, 529}
+
+
+class Retry(object):
+    # Retries a call that fails with a transient error up to max_retries
+    # times.  Attempt k waits a uniform random delay in
+    # [0, min(max_delay, base_delay * 2**k)], so clients that hit a rate limit
+    # together do not retry together.
+    def __init__(
+        self,
+        max_retries: int = 6,
+        base_delay: float = 1.0,
+        max_delay: float = 60.0,
+        retry_on: Tuple[type, ...] = TRANSIENT_ERRORS,
+        rng: np.random.Generator = None,
+    ):
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.retry_on = retry_on
+        self.rng = rng if rng is not None else np.random.default_rng()
+
+    def delay(self, attempt: int) -> float:
+        bound = min(self.max_delay, self.base_delay * 2 ** attempt)
+        return self.rng.uniform(0, bound)
+
+    def retryable(self, error: BaseException) -> bool:
+        if isinstance(error, self.retry_on):
+            return True
+        if any(cls.__name__ in TRANSIENT_NAMES for cls in type(error).__mro__):
+            return True
+        return getattr(error, "status_code", None) in TRANSIENT_STATUS
+
+
+class Dispatcher(object):
+    # `client` is an async callable, or a blocking one that is then run on a
+    # pool of `concurrency` threads.  `stats` counts requests, retries and
+    # failures (calls that gave up); cache hits are counted by the cache.
+    def __init__(
+        self,
+        client: Callable,
+        concurrency: int = 16,
+        limiter: RateLimiter = None,
+        retry: Retry = None,
+        estimate_tokens: Callable[[Messages], int] = estimate_tokens,
+        cache: ResponseCache = None,
+    ):
+        self.client = client
+        self.cache = cache
+        self.concurrency = concurrency
+        self.limiter = limiter
+        self.retry = retry if retry is not None else Retry()
+        self.estimate_tokens = estimate_tokens
+        self.blocking = not (
+            inspect.iscoroutinefunction(client)
+            or inspect.iscoroutinefunction(getattr(client, "__call__", None))
+        )
+        self.stats = collections.Counter()
+        self.semaphore = None
+        self.executor = None
+
+    async def _attempt(self, messages: Messages) -> str:
+        if self.limiter is not None:
+            await self.limiter.acquire(self.estimate_tokens(messages))
+        self.stats["requests"] += 1
+        if self.blocking:
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(self.concurrency)
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self.executor, self.client, messages)
+        return await self.client(messages)
+
+    async def __call__(self, messages: Messages) -> str:
+        # Cache reads and writes are blocking SQLite calls, so they run on
+        # the loop's default executor rather than on the event loop
+        if self.cache is not None:
+            loop = asyncio.get_running_loop()
+            response = await loop.run_in_executor(None, self.cache.lookup, messages)
+            if response is not None:
+                return response
+        response = await self.request(messages)
+        if self.cache is not None:
+            await loop.run_in_executor(None, self.cache.put, messages, response)
+        return response
+
+    async def request(self, messages: Messages) -> str:
+        if self.semaphore is None:
+            self.semaphore = asyncio.Semaphore(self.concurrency)
+        retry = self.retry
+        async with self.semaphore:
+            for attempt in range(retry.max_retries + 1):
+                try:
+                    return await self._attempt(messages)
+                except Exception as error:
+                    if attempt == retry.max_retries or not retry.retryable(error):
+                        self.stats["failures"] += 1
+                        raise
+                    self.stats["retries"] += 1
+                    await asyncio.sleep(retry.delay(attempt))
+
+    async def map(
+        self, items: Iterable[T], to_messages: Callable[[T], Messages]
+    ) -> AsyncIterator[Tuple[T, str]]:
+        # (item, answer) for every item, in input order.  Items are read
+        # lazily; at most 2 * concurrency requests are queued at a time.
+        pending = collections.deque()
+        try:
+            for item in items:
+                task = asyncio.ensure_future(self(to_messages(item)))
+                pending.append((item, task))
+                if len(pending) >= 2 * self.concurrency:
+                    item, task = pending.popleft()
+                    yield item, await task
+            while pending:
+                item, task = pending.popleft()
+                yield item, await task
+        finally:
+            for _, task in pending:
+                task.cancel()
+            self.close()
+
+    def close(self):
+        # Drop per-event-loop state, so the dispatcher can be reused by a
+        # later asyncio.run
+        if self.executor is not None:
+            self.executor.shutdown(wait=False)
+            self.executor = None
+        self.semaphore = None
+        if self.limiter is not None:
+            self.limiter.reset()
@@ -0,0 +1,489 @@
+#!/usr/bin/env python3
+# Copyright (c) 2019-present, Facebook, Inc.
+# All rights reserved.
+#
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+
+
+import asyncio
+import collections
+import csv
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+from .dispatch import Dispatcher
+from .index import StoryIndex, default_trace_path
+from .writer import QUESTION_COLUMNS
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+# Scores a model on a ToMi split, one question (story variant) at a time.
+# Questions come from the generator's .txt/.trace pair or from a per-group
+# CSV (create_tomi_csv.py, main.py --format csv), and are sent to a client:
+# any callable taking chat messages, as a list of (role, content) pairs, and
+# returning the answer text.  Accuracy is kept per question kind, and first
+# and second order questions are split by whether they need theory of mind
+# (the tom / no_tom suffix of their trace label).
+
+Messages = List[Tuple[str, str]]
+Client = Callable[[Messages], str]
+
+# Display name of each question kind, in report order
+KINDS = {
+    "reality": "Reality",
+    "memory": "Memory",
+    "first_order": "First order",
+    "second_order": "Second order",
+}
+
+# The system prompts and human template of the experiment notebooks, copied
+# verbatim (stray leading "Y" line and trailing spaces included) so scores
+# are comparable with theirs
+PROMPTS = {
+    "original": (
+        "Y\n"
+        "You are a logical reasoning assistant.  \n"
+        "You will be shown a short story as a list of sentences and then a "
+        "question.  \n"
+        "Your task is to answer using exactly one English word naming a location "
+        "(e.g., “desk”, “bookshelf”).  \n"
+        "Do not add any extra words, punctuation, or explanation—just the single "
+        "location word."
+    ),
+    "playing_house": (
+        "Y\n"
+        "You are playing with your friends and toys.\n"
+        "You will be shown a short story about a pretend play you are doing as a "
+        "list of sentences and then a question.  \n"
+        "Your task is to answer using exactly one English word naming a location "
+        "(e.g., “desk”, “bookshelf”).  \n"
+        "Do not add any extra words, punctuation, or explanation—just the single "
+        "location word."
+    ),
+}
+
+HUMAN_TEMPLATE = "\n[Story]\n{Story}\n\n[Question]\n{Question}\n\n"
+
+# Decoding parameters of the notebooks' client; part of every cache key and
+# batch request
+PARAMS = {"temperature": 0}
+
+# Several questions in one request: stories and questions are numbered, and
+# the answers come back one per line as "Q<question number>. <answer>"
+BATCH_STORY_TEMPLATE = "[Story {Number}]\n{Story}\n\n[Questions about story {Number}]"
+BATCH_INSTRUCTIONS = (
+    "Answer every question above. Write one line per question, in order, as "
+    'the question label and the single location word, e.g. "Q1. desk".'
+)
+
+# "Q3. kitchen", "q3: kitchen", "3) kitchen", ...
+ANSWER_LINE = re.compile(r"^\s*Q?(\d+)\s*[.):]\s*(.*?)\s*$", re.IGNORECASE)
+
+
+class Prompt(object):
+    def __init__(self, system: str = PROMPTS["original"], human: str = HUMAN_TEMPLATE):
+        self.system = system
+        self.human = human
+
+    def messages(self, story: str, question: str) -> Messages:
+        return [
+            ("system", self.system),
+            ("human", self.human.format(Story=story, Question=question)),
+        ]
+
+    def batch_messages(self, stories: List[Tuple[str, List[str]]]) -> Messages:
+        # One request for the questions of several stories, labelled
+        # Q1, Q2, ... across all of them
+        parts, n = [], 0
+        for number, (story, questions) in enumerate(stories, 1):
+            parts.append(BATCH_STORY_TEMPLATE.format(Number=number, Story=story))
+            parts.extend(f"Q{n + i}. {q}" for i, q in enumerate(questions, 1))
+            parts.append("")
+            n += len(questions)
+        parts.append(BATCH_INSTRUCTIONS)
+        return [("system", self.system), ("human", "\n".join(parts))]
+
+
+def parse_batch(text: str, n: int) -> List[Optional[str]]:
+    # Answers to questions 1..n of a batch reply; None where a question has
+    # no answer line, several of them, or an empty one
+    found = collections.defaultdict(list)
+    for line in text.splitlines():
+        match = ANSWER_LINE.match(line)
+        if match:
+            found[int(match.group(1))].append(match.group(2))
+    answers = []
+    for i in range(1, n + 1):
+        lines = found.get(i, [])
+        answers.append(lines[0] if len(lines) == 1 and lines[0] else None)
+    return answers
+
+
+class Question(object):
+    __slots__ = ("group", "kind", "tom", "story", "question", "answer")
+
+    def __init__(
+        self,
+        group: int,
+        kind: str,
+        tom: Optional[bool],
+        story: str,
+        question: str,
+        answer: str,
+    ):
+        self.group = group
+        self.kind = kind
+        # None for reality/memory questions, or when no .trace is available
+        self.tom = tom
+        self.story = story
+        self.question = question
+        self.answer = answer
+
+    @property
+    def category(self) -> Tuple[str, Optional[bool]]:
+        return self.kind, self.tom
+
+
+def question_label(label: str) -> Tuple[str, Optional[bool]]:
+    # "first_order_1_no_tom" -> ("first_order", False), "memory" -> ("memory", None)
+    kind = next(k for k in KINDS if label.startswith(k))
+    if kind in ("first_order", "second_order"):
+        return kind, not label.endswith("no_tom")
+    return kind, None
+
+
+def normalize(answer: str) -> str:
+    return answer.strip().lower()
+
+
+def iter_text_questions(
+    stories_path: str, trace_path: str = None
+) -> Iterator[Question]:
+    # Questions of a plain-text split, in file order.  Stories are renumbered
+    # "1. ..." like the CSV, so both sources give the model the same text.
+    with StoryIndex(stories_path, trace_path) as index:
+        for i in range(len(index)):
+            lines = [line.split(" ", 1) for line in index.story(i)]
+            story = "\n".join(f"{step}. {text}" for step, text in lines[:-1])
+            question, answer = lines[-1][1].split("\t")[:2]
+            kind, tom = question_label(index.trace(i)[-2])
+            yield Question(i // 6, kind, tom, story, question, answer)
+
+
+def _csv_labels(trace_paths: List[str]) -> Iterator[Dict[str, Optional[bool]]]:
+    # Per story group, the tom flag of each CSV column prefix, reading the
+    # trace files one after another.  As in tomi.writer.story_row, the first
+    # question of a kind is the A column.
+    group = []
+    for trace_path in trace_paths:
+        with open(trace_path, "r") as f:
+            for line in f:
+                group.append(question_label(line.rstrip("\n").split(",")[-2]))
+                if len(group) < 6:
+                    continue
+                seen = collections.Counter()
+                toms = {}
+                for kind, tom in group:
+                    toms[QUESTION_COLUMNS[kind][min(seen[kind], 1)]] = tom
+                    seen[kind] += 1
+                yield toms
+                group = []
+
+
+def _count_lines(path: str) -> int:
+    with open(path, "rb") as f:
+        return sum(1 for _ in f)
+
+
+def _count_rows(csv_path: str) -> int:
+    with open(csv_path, "r", newline="") as f:
+        return sum(1 for _ in csv.DictReader(f))
+
+
+def iter_csv_questions(
+    csv_path: str, trace_path: Union[str, List[str]] = None
+) -> Iterator[Question]:
+    # Questions of a per-group CSV.  The CSV has no trace labels, so tom is
+    # None unless trace files are given; row i is then trace lines
+    # 6 * i ... 6 * i + 5 of the traces read in order.  A CSV converted from
+    # several splits (create_tomi_csv.py writes train, val, test) needs all
+    # of their traces, in that order.  The number of rows must match.
+    trace_paths = [trace_path] if isinstance(trace_path, str) else trace_path
+    labels = None
+    if trace_paths:
+        num_groups = sum(_count_lines(path) for path in trace_paths) // 6
+        num_rows = _count_rows(csv_path)
+        if num_groups != num_rows:
+            raise ValueError(
+                f"{csv_path} has {num_rows} story groups but the trace files "
+                f"{', '.join(trace_paths)} have {num_groups}; pass the traces "
+                f"of every split the CSV was converted from, in order"
+            )
+        labels = _csv_labels(trace_paths)
+    with open(csv_path, "r", newline="") as f:
+        for group, row in enumerate(csv.DictReader(f)):
+            toms = next(labels) if labels else {}
+            for kind, prefixes in QUESTION_COLUMNS.items():
+                for prefix in prefixes:
+                    tom = toms.get(prefix)
+                    question = row[f"{prefix} Question"]
+                    answer = row[f"{prefix} Answer"]
+                    yield Question(group, kind, tom, row["Story"], question, answer)
+
+
+def iter_questions(
+    path: str, trace_path: Union[str, List[str]] = None
+) -> Iterator[Question]:
+    # trace_path may list several traces for a CSV (see iter_csv_questions)
+    if path.endswith(".csv"):
+        return iter_csv_questions(path, trace_path)
+    if isinstance(trace_path, list):
+        if len(trace_path) != 1:
+            raise ValueError(f"{path} is one split and takes one trace file")
+        trace_path = trace_path[0]
+    if trace_path is None:
+        trace_path = default_trace_path(path)
+    if not os.path.exists(trace_path):
+        raise FileNotFoundError(f"{path} needs its trace file {trace_path}")
+    return iter_text_questions(path, trace_path)
+
+
+class Accuracy(object):
+    def __init__(self):
+        self.correct = collections.Counter()
+        self.total = collections.Counter()
+
+    def add(self, category: Tuple[str, Optional[bool]], correct: bool):
+        self.total[category] += 1
+        self.correct[category] += int(correct)
+
+    @staticmethod
+    def label(category: Tuple[str, Optional[bool]]) -> str:
+        kind, tom = category
+        if tom is None:
+            return KINDS[kind]
+        return f'{KINDS[kind]} ({"tom" if tom else "no_tom"})'
+
+    def categories(self) -> List[Tuple[str, Optional[bool]]]:
+        order = list(KINDS)
+        return sorted(self.total, key=lambda c: (order.index(c[0]), str(c[1])))
+
+    def by_kind(self) -> Dict[str, Tuple[int, int]]:
+        # (correct, total) per question kind, tom and no_tom together
+        counts = {}
+        for (kind, tom), total in self.total.items():
+            correct, seen = counts.get(kind, (0, 0))
+            counts[kind] = (correct + self.correct[kind, tom], seen + total)
+        return {kind: counts[kind] for kind in KINDS if kind in counts}
+
+    def as_dict(self) -> Dict[str, Dict[str, float]]:
+        rows = {}
+        for category in self.categories():
+            correct, total = self.correct[category], self.total[category]
+            rows[self.label(category)] = {
+                "correct": correct,
+                "total": total,
+                "accuracy": correct / total,
+            }
+        return rows
+
+    def summary(self) -> str:
+        lines = []
+        for name, stats in self.as_dict().items():
+            lines.append(
+                f"{name:<26}{stats['correct']:>7}/{stats['total']:<7}"
+                f"{100 * stats['accuracy']:6.2f}%"
+            )
+        split = collections.Counter(kind for kind, _ in self.total)
+        for kind, (correct, total) in self.by_kind().items():
+            if split[kind] < 2:
+                continue
+            lines.append(
+                f"{KINDS[kind] + ' (all)':<26}{correct:>7}/{total:<7}"
+                f"{100 * correct / total:6.2f}%"
+            )
+        return "\n".join(lines)
+
+
+class Evaluator(object):
+    # Asks `client` every question and scores the answers.  Clients are
+    # usually blocking network calls, so with workers > 1 up to `workers`
+    # requests are in flight at once on a thread pool.  A Dispatcher client
+    # (tomi.dispatch) runs on asyncio instead, with its own concurrency
+    # limit, rate limits and retries.  Questions are read lazily and results
+    # are scored in order either way.
+    #
+    # With batch = k > 0, all questions of k story groups go out in one
+    # request (Prompt.batch_messages) and the reply is split back into
+    # answers by parse_batch.  Questions the reply does not answer cleanly
+    # are asked again one by one.  `stats` counts requests (as built, so
+    # including cache hits) and fallbacks.
+    def __init__(
+        self,
+        client: Client,
+        prompt: Prompt = None,
+        workers: int = 1,
+        normalize: Callable[[str], str] = normalize,
+        batch: int = 0,
+    ):
+        self.client = client
+        self.prompt = prompt if prompt is not None else Prompt()
+        self.workers = workers
+        self.normalize = normalize
+        self.batch = batch
+        self.stats = collections.Counter()
+
+    def messages(self, question: Question) -> Messages:
+        self.stats["requests"] += 1
+        return self.prompt.messages(question.story, question.question)
+
+    def batch_messages(self, batch: List[Question]) -> Messages:
+        self.stats["requests"] += 1
+        stories = collections.OrderedDict()
+        for question in batch:
+            stories.setdefault(question.group, (question.story, []))
+            stories[question.group][1].append(question.question)
+        return self.prompt.batch_messages(list(stories.values()))
+
+    def batches(self, questions: Iterable[Question]) -> Iterator[List[Question]]:
+        # Consecutive questions, cut into lists of `batch` story groups
+        batch, groups = [], set()
+        for question in questions:
+            if question.group not in groups and len(groups) == self.batch:
+                yield batch
+                batch, groups = [], set()
+            groups.add(question.group)
+            batch.append(question)
+        if batch:
+            yield batch
+
+    def ask(self, question: Question) -> str:
+        return self.client(self.messages(question))
+
+    def ask_batch(self, batch: List[Question]) -> str:
+        return self.client(self.batch_messages(batch))
+
+    def _map(self, items: Iterable, ask: Callable) -> Iterator[Tuple[object, str]]:
+        # (item, ask(item)) in order, up to `workers` at a time
+        if self.workers <= 1:
+            for item in items:
+                yield item, ask(item)
+            return
+        with ThreadPoolExecutor(self.workers) as pool:
+            pending = collections.deque()
+            for item in items:
+                pending.append((item, pool.submit(ask, item)))
+                if len(pending) >= 2 * self.workers:
+                    item, future = pending.popleft()
+                    yield item, future.result()
+            while pending:
+                item, future = pending.popleft()
+                yield item, future.result()
+
+    def answers(self, questions: Iterable[Question]) -> Iterator[Tuple[Question, str]]:
+        if not self.batch:
+            yield from self._map(questions, self.ask)
+            return
+        for batch, reply in self._map(self.batches(questions), self.ask_batch):
+            for question, answer in zip(batch, parse_batch(reply, len(batch))):
+                if answer is None:
+                    self.stats["fallbacks"] += 1
+                    answer = self.ask(question)
+                yield question, answer
+
+    def evaluate(
+        self,
+        questions: Iterable[Question],
+        limit: int = None,
+        callback: Callable[[Question, str, bool], None] = None,
+    ) -> Accuracy:
+        # Score the questions of the first `limit` story groups (all if
+        # None).  callback(question, prediction, correct) sees every answer.
+        # A Dispatcher client runs aevaluate on a new event loop; where one
+        # is already running (e.g. in Jupyter), await aevaluate instead.
+        if isinstance(self.client, Dispatcher):
+            return asyncio.run(self.aevaluate(questions, limit, callback))
+        if limit is not None:
+            questions = take_groups(questions, limit)
+        accuracy = Accuracy()
+        for question, prediction in self.answers(questions):
+            self.score(accuracy, question, prediction, callback)
+        return accuracy
+
+    async def aevaluate(
+        self,
+        questions: Iterable[Question],
+        limit: int = None,
+        callback: Callable[[Question, str, bool], None] = None,
+    ) -> Accuracy:
+        # evaluate() on the running event loop, for callers that already
+        # have one.  A client that is not a Dispatcher is wrapped in one with
+        # `workers` concurrent requests.
+        dispatcher = self.client
+        if not isinstance(dispatcher, Dispatcher):
+            dispatcher = Dispatcher(self.client, self.workers)
+        if limit is not None:
+            questions = take_groups(questions, limit)
+        accuracy = Accuracy()
+        if not self.batch:
+            async for question, prediction in dispatcher.map(questions, self.messages):
+                self.score(accuracy, question, prediction, callback)
+            return accuracy
+        replies = dispatcher.map(self.batches(questions), self.batch_messages)
+        async for batch, reply in replies:
+            for question, answer in zip(batch, parse_batch(reply, len(batch))):
+                if answer is None:
+                    self.stats["fallbacks"] += 1
+                    answer = await dispatcher(self.messages(question))
+                self.score(accuracy, question, answer, callback)
+        return accuracy
+
+    def score(
+        self,
+        accuracy: Accuracy,
+        question: Question,
+        prediction: str,
+        callback: Callable[[Question, str, bool], None] = None,
+    ):
+        correct = self.normalize(prediction) == self.normalize(question.answer)
+        accuracy.add(question.category, correct)
+        if callback is not None:
+            callback(question, prediction, correct)
+
+
+def side_by_side(results: Dict[str, Accuracy]) -> str:
+    # Accuracy tables of several runs on the same questions, one column each
+    names = list(results)
+    rows = collections.OrderedDict()
+    for name, accuracy in results.items():
+        for label, stats in accuracy.as_dict().items():
+            rows.setdefault(label, {})[name] = stats["accuracy"]
+    width = max(12, *(len(name) + 2 for name in names))
+    lines = [f"{'':<26}" + "".join(f"{name:>{width}}" for name in names)]
+    for label, row in rows.items():
+        cells = [
+            f"{100 * row[name]:>{width - 1}.2f}%" if name in row else " " * width
+            for name in names
+        ]
+        lines.append(f"{label:<26}" + "".join(cells))
+    return "\n".join(lines)
+
+
+def take_groups(questions: Iterable[Question], limit: int) -> Iterator[Question]:
+    for question in questions:
+        if question.group >= limit:
+            return
+        yield question
+
+
+def langchain_client(llm) -> Client:
+    # Client for a LangChain chat model, e.g. ChatOpenAI(model="gpt-4o-mini")
+    return lambda messages: llm.invoke(messages).content
+
+
+def langchain_async_client(llm) -> Callable:
+    # Async client for a LangChain chat model, for use with a Dispatcher
+    async def client(messages: Messages) -> str:
+        return (await llm.ainvoke(messages)).content
+
+    return client
@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+# Copyright (c) 2019-present, Facebook, Inc.
+# All rights reserved.
+#
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+
+
+import hashlib
+import mmap
+import os
+import numpy as np
+from typing import Dict, List, Optional
+
+# A story index is a sidecar "<split>.txt.idx.npz" next to a plain-text split.
+# It holds one entry per story (question variant), in file order, so story i
+# belongs to story group i // 6 and to line i of the .trace file.
+#
+#   story_offsets   (n + 1,)  story i is bytes story_offsets[i]:story_offsets[i + 1]
+#   trace_offsets   (n + 1,)  same for its line of the .trace file
+#   story_type      (n,)      code into story_types
+#   question_trace  (n,)      code into question_traces
+#   agent_order     (n,)      0/1 for first/second order questions, -1 otherwise
+#   fingerprints    (2, 3)    fingerprint of the .txt/.trace files when indexed
+#
+# The dictionaries are stored as plain string arrays, so loading the sidecar
+# never needs pickle.  A file's fingerprint is its size, its mtime and a hash
+# of its first and last FINGERPRINT_BYTES, so an edit that keeps the size (or
+# a copy that keeps the mtime) still makes the sidecar stale.
+
+INDEX_SUFFIX = ".idx.npz"
+
+FINGERPRINT_BYTES = 1 << 16
+
+
+def index_path(stories_path: str) -> str:
+    return f"{stories_path}{INDEX_SUFFIX}"
+
+
+def default_trace_path(stories_path: str) -> str:
+    return os.path.splitext(stories_path)[0] + ".trace"
+
+
+def _line_starts(buf) -> np.ndarray:
+    # Byte offset of every line in buf, plus the end of the buffer
+    data = np.frombuffer(buf, dtype=np.uint8)
+    ends = np.flatnonzero(data == ord("\n")) + 1
+    starts = np.concatenate([[0], ends])
+    if len(data) and data[-1] == ord("\n"):
+        return starts
+    return np.concatenate([starts, [len(data)]])
+
+
+def _story_starts(buf) -> np.ndarray:
+    # Byte offsets of every line starting with step "1 ", plus the end
+    data = np.frombuffer(buf, dtype=np.uint8)
+    starts = _line_starts(buf)[:-1]
+    starts = starts[starts + 1 < len(data)]
+    first = (data[starts] == ord("1")) & (data[starts + 1] == ord(" "))
+    return np.concatenate([starts[first], [len(data)]])
+
+
+def fingerprint(path: str) -> List[int]:
+    # [size, mtime in ns, signed 64-bit hash of the head and tail bytes]
+    with open(path, "rb") as f:
+        stat = os.fstat(f.fileno())
+        digest = hashlib.blake2b(f.read(FINGERPRINT_BYTES), digest_size=8)
+        if stat.st_size > FINGERPRINT_BYTES:
+            f.seek(max(FINGERPRINT_BYTES, stat.st_size - FINGERPRINT_BYTES))
+            digest.update(f.read())
+    head_tail = int.from_bytes(digest.digest(), "little", signed=True)
+    return [stat.st_size, stat.st_mtime_ns, head_tail]
+
+
+def _read_map(path: str):
+    # Read-only mmap of path, or b"" for an empty file (which mmap rejects)
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return b""
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def _agent_order(question_trace: str) -> int:
+    # "first_order_1_no_tom" -> 1; memory and reality questions have none
+    parts = question_trace.split("_")
+    if len(parts) > 2 and parts[1] == "order":
+        return int(parts[2])
+    return -1
+
+
+def build_index(stories_path: str, trace_path: str = None) -> str:
+    # Scan a .txt/.trace pair once and save the sidecar; returns its path
+    if trace_path is None:
+        trace_path = default_trace_path(stories_path)
+    # Taken first, so a file that changes while it is scanned reads as stale
+    fingerprints = [fingerprint(stories_path), fingerprint(trace_path)]
+    stories_map = _read_map(stories_path)
+    trace_map = _read_map(trace_path)
+    story_offsets = _story_starts(stories_map)
+    trace_offsets = _line_starts(trace_map)
+    n = len(story_offsets) - 1
+    if len(trace_offsets) - 1 != n:
+        raise ValueError(
+            f"{stories_path} has {n} stories but {trace_path} has "
+            f"{len(trace_offsets) - 1} trace lines"
+        )
+
+    story_types: Dict[str, int] = {}
+    question_traces: Dict[str, int] = {}
+    story_type = np.empty(n, dtype=np.uint8)
+    question_trace = np.empty(n, dtype=np.uint16)
+    agent_order = np.empty(n, dtype=np.int8)
+    for i in range(n):
+        line = trace_map[trace_offsets[i] : trace_offsets[i + 1]]
+        fields = line.decode().rstrip("\n").split(",")
+        story_type[i] = story_types.setdefault(fields[-1], len(story_types))
+        question_trace[i] = question_traces.setdefault(
+            fields[-2], len(question_traces)
+        )
+        agent_order[i] = _agent_order(fields[-2])
+
+    path = index_path(stories_path)
+    with open(path, "wb") as f:
+        np.savez(
+            f,
+            story_offsets=story_offsets.astype(np.int64),
+            trace_offsets=trace_offsets.astype(np.int64),
+            story_type=story_type,
+            question_trace=question_trace,
+            agent_order=agent_order,
+            fingerprints=np.array(fingerprints, dtype=np.int64),
+            story_types=np.array(list(story_types), dtype=str),
+            question_traces=np.array(list(question_traces), dtype=str),
+        )
+    for buf in (stories_map, trace_map):
+        if isinstance(buf, mmap.mmap):
+            buf.close()
+    return path
+
+
+class StoryIndex(object):
+    # Random access into a plain-text split.  The .txt/.trace files are
+    # memory-mapped and only the requested byte ranges are decoded.  The
+    # sidecar is (re)built on open if it is missing or out of date.
+    def __init__(self, stories_path: str, trace_path: str = None):
+        if trace_path is None:
+            trace_path = default_trace_path(stories_path)
+        self.stories_path = stories_path
+        self.trace_path = trace_path
+        fingerprints = [fingerprint(stories_path), fingerprint(trace_path)]
+        path = index_path(stories_path)
+        if not os.path.exists(path) or self._indexed(path) != fingerprints:
+            build_index(stories_path, trace_path)
+        with np.load(path) as index:
+            self.story_offsets = index["story_offsets"]
+            self.trace_offsets = index["trace_offsets"]
+            self.story_type = index["story_type"]
+            self.question_trace = index["question_trace"]
+            self.agent_order = index["agent_order"]
+            self.story_types = index["story_types"].tolist()
+            self.question_traces = index["question_traces"].tolist()
+        self.stories_map = _read_map(stories_path)
+        self.trace_map = _read_map(trace_path)
+
+    @staticmethod
+    def _indexed(path: str) -> Optional[List[List[int]]]:
+        # Fingerprints the sidecar was built from; None for sidecars written
+        # before they were stored
+        with np.load(path) as index:
+            if "fingerprints" not in index:
+                return None
+            return index["fingerprints"].tolist()
+
+    def __len__(self):
+        return len(self.story_type)
+
+    @property
+    def num_groups(self) -> int:
+        return len(self) // 6
+
+    def story(self, i: int) -> List[str]:
+        # Lines of story i, step numbers included, as in the .txt file
+        start, end = self.story_offsets[i], self.story_offsets[i + 1]
+        return self.stories_map[start:end].decode().splitlines()
+
+    def trace(self, i: int) -> List[str]:
+        # Fields of line i of the .trace file
+        start, end = self.trace_offsets[i], self.trace_offsets[i + 1]
+        return self.trace_map[start:end].decode().rstrip("\n").split(",")
+
+    def group(self, g: int) -> List[int]:
+        # Story ids of the six question variants of story group g
+        return list(range(6 * g, 6 * g + 6))
+
+    def select(
+        self,
+        story_type: str = None,
+        question: str = None,
+        agent_order: Optional[int] = None,
+    ) -> np.ndarray:
+        # Ids of the stories matching every given label.  `question` is a
+        # question trace prefix, so "second_order" matches all four variants.
+        mask = np.ones(len(self), dtype=bool)
+        if story_type is not None:
+            if story_type not in self.story_types:
+                return np.empty(0, dtype=np.int64)
+            mask &= self.story_type == self.story_types.index(story_type)
+        if question is not None:
+            codes = [
+                code
+                for code, label in enumerate(self.question_traces)
+                if label.startswith(question)
+            ]
+            mask &= np.isin(self.question_trace, codes)
+        if agent_order is not None:
+            mask &= self.agent_order == agent_order
+        return np.flatnonzero(mask)
+
+    def stratified_sample(
+        self, n: int, rng: np.random.Generator, by: str = "question_trace", **filters
+    ) -> Dict[str, np.ndarray]:
+        # Up to n story ids per label of `by` ("question_trace" or
+        # "story_type"), drawn without replacement among the stories that
+        # match `filters` (see select).
+        ids = self.select(**filters)
+        codes = getattr(self, by)[ids]
+        labels = self.question_traces if by == "question_trace" else self.story_types
+        sample = {}
+        for code in np.unique(codes):
+            pool = ids[codes == code]
+            sample[labels[code]] = np.sort(
+                rng.choice(pool, min(n, len(pool)), replace=False)
+            )
+        return sample
+
+    def close(self):
+        for buf in (self.stories_map, self.trace_map):
+            if isinstance(buf, mmap.mmap):
+                buf.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
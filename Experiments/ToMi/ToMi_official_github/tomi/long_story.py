@@ -0,0 +1,369 @@
+#!/usr/bin/env python3
+# Copyright (c) 2019-present, Facebook, Inc.
+# All rights reserved.
+#
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+
+
+import sys
+import numpy as np
+from . import actions
+from .profiling import NULL_TIMER, PhaseTimer
+from .story import Story, StoryType
+from .world import World
+from typing import Dict, List, Optional, Tuple
+
+# Long-horizon stories: many agents, rooms, objects and steps, with Tell and
+# Peek actions.  State lives in a BeliefState of small integer arrays indexed
+# by story-local ids (agent i is the i-th agent drawn for the story), and an
+# event updates the beliefs of everyone in the room with one masked array
+# assignment instead of the per-observer loops of tomi.actions.  Stories are
+# returned in the same (stories, traces, story_type) form as generate_story,
+# so every writer accepts them.
+#
+# Containers are closed: entering a room does not show what is in them.
+# Agents learn where an object is by seeing it moved, by looking into its
+# container (Peek) or by being told, so an agent who was out while an object
+# moved keeps its old belief until one of those happens.
+
+NONE = -1
+
+# A story whose events leave no object with enough believers to ask about
+# (likely with few steps) is drawn again, up to this many times
+MAX_ATTEMPTS = 100
+
+ACTION_TYPES = ["enter", "exit", "move", "peek", "tell", "noise"]
+
+
+class LongStoryConfig(object):
+    def __init__(
+        self,
+        num_agents: int = 6,
+        num_rooms: int = 3,
+        num_objects: int = 4,
+        containers_per_room: int = 3,
+        num_steps: int = 100,
+        weights: Dict[str, float] = None,
+    ):
+        self.num_agents = num_agents
+        self.num_rooms = num_rooms
+        self.num_objects = num_objects
+        self.containers_per_room = containers_per_room
+        self.num_steps = num_steps
+        # Relative frequency of each action type among the feasible ones
+        self.weights = {
+            "enter": 0.2,
+            "exit": 0.15,
+            "move": 0.3,
+            "peek": 0.1,
+            "tell": 0.1,
+            "noise": 0.15,
+        }
+        if weights is not None:
+            self.weights.update(weights)
+
+    @property
+    def num_containers(self) -> int:
+        return self.num_rooms * self.containers_per_room
+
+
+class BeliefState(object):
+    # World state and beliefs of one story.  All ids are story-local.
+    #
+    #   agent_room      (agents,)                room of each agent, -1 outside
+    #   container_room  (containers,)            room of each container
+    #   obj_container   (objects,)               container holding each object
+    #   direct          (agents, objects)        where agent a thinks o is
+    #   indirect        (agents, agents, objects) where a1 thinks a2 thinks o is
+    #
+    # Unknown beliefs are -1.
+    def __init__(
+        self, container_room: np.ndarray, obj_container: np.ndarray, n: int
+    ):
+        num_objects = len(obj_container)
+        self.agent_room = np.full(n, NONE)
+        self.container_room = container_room
+        self.obj_container = obj_container
+        self.start_container = obj_container.copy()
+        self.direct = np.full((n, num_objects), NONE)
+        self.indirect = np.full((n, n, num_objects), NONE)
+
+    def present(self, room: int) -> np.ndarray:
+        # Boolean mask of the agents in `room`
+        return self.agent_room == room
+
+    def objects_in_room(self, room: int) -> np.ndarray:
+        return np.flatnonzero(self.container_room[self.obj_container] == room)
+
+    def observe(self, observers: np.ndarray, objs, containers):
+        # Everyone in `observers` sees objs in containers, and sees each
+        # other see it
+        self.direct[np.ix_(observers, np.atleast_1d(objs))] = containers
+        pairs = np.ix_(observers, observers, np.atleast_1d(objs))
+        self.indirect[pairs] = containers
+
+    def enter(self, agent: int, room: int):
+        self.agent_room[agent] = room
+
+    def exit(self, agent: int):
+        self.agent_room[agent] = NONE
+
+    def move(self, agent: int, obj: int, container: int):
+        self.obj_container[obj] = container
+        self.observe(self.present(self.agent_room[agent]), obj, container)
+
+    def peek(self, agent: int, container: int):
+        # Only the agent looking in learns what is inside, which may have
+        # been moved there while it was out
+        objs = np.flatnonzero(self.obj_container == container)
+        self.direct[agent, objs] = container
+
+    def tell(self, a1: int, a2: int, obj: int):
+        # a1 tells a2 where a1 believes obj is; both know the other knows
+        belief = self.direct[a1, obj]
+        self.direct[a2, obj] = belief
+        self.indirect[a2, a1, obj] = belief
+        self.indirect[a1, a2, obj] = belief
+
+
+class LongStorySampler(object):
+    # Picks the next feasible action and its arguments from `rng`
+    def __init__(
+        self, state: BeliefState, config: LongStoryConfig, rng: np.random.Generator
+    ):
+        self.state = state
+        self.config = config
+        self.rng = rng
+
+    def choice(self, ids) -> int:
+        return int(ids[self.rng.integers(0, len(ids))])
+
+    def step(self) -> Tuple[str, tuple]:
+        state, config = self.state, self.config
+        inside = np.flatnonzero(state.agent_room != NONE)
+        outside = np.flatnonzero(state.agent_room == NONE)
+        # Rooms with at least two agents, for tell
+        rooms, counts = np.unique(state.agent_room[inside], return_counts=True)
+        crowded = rooms[counts > 1]
+        feasible = {
+            "enter": len(outside) > 0,
+            "exit": len(inside) > 0,
+            "move": len(inside) > 0 and config.containers_per_room > 1,
+            "peek": len(inside) > 0,
+            "tell": len(crowded) > 0,
+            "noise": True,
+        }
+        kinds = [k for k in ACTION_TYPES if feasible[k]]
+        weights = np.array([config.weights[k] for k in kinds], dtype=float)
+        kind = kinds[self.rng.choice(len(kinds), p=weights / weights.sum())]
+
+        if kind == "enter":
+            return kind, (self.choice(outside), self.choice(range(config.num_rooms)))
+        if kind == "exit":
+            return kind, (self.choice(inside),)
+        if kind == "noise":
+            return kind, (
+                self.choice(range(config.num_agents)),
+                self.choice(range(config.num_objects)),
+                self.choice(range(len(actions.NoiseAction.TEMPLATES))),
+            )
+        if kind == "tell":
+            room = self.choice(crowded)
+            a1, a2 = self.rng.choice(np.flatnonzero(state.present(room)), 2, False)
+            known = np.flatnonzero(state.direct[a1] != NONE)
+            if len(known) == 0:
+                return self.noise_instead()
+            return kind, (int(a1), int(a2), self.choice(known))
+        agent = self.choice(inside)
+        room = state.agent_room[agent]
+        containers = np.flatnonzero(state.container_room == room)
+        if kind == "peek":
+            return kind, (agent, self.choice(containers))
+        objs = state.objects_in_room(room)
+        if len(objs) == 0:
+            return self.noise_instead()
+        obj = self.choice(objs)
+        others = containers[containers != state.obj_container[obj]]
+        return kind, (agent, obj, self.choice(others))
+
+    def noise_instead(self) -> Tuple[str, tuple]:
+        return "noise", (
+            self.choice(range(self.config.num_agents)),
+            self.choice(range(self.config.num_objects)),
+            self.choice(range(len(actions.NoiseAction.TEMPLATES))),
+        )
+
+
+def _draw(world: World, typ: str, n: int) -> List[int]:
+    if n > world.size(typ):
+        raise ValueError(f"Story needs {n} {typ} but the world has {world.size(typ)}")
+    return [world.draw(typ) for _ in range(n)]
+
+
+def _questions(
+    state: BeliefState, obj: int, rng: np.random.Generator
+) -> Optional[List[Tuple[str, tuple]]]:
+    # memory, reality, two first order and two second order questions about
+    # obj, or None if fewer than two agents / agent pairs hold a belief on it
+    believers = np.flatnonzero(state.direct[:, obj] != NONE)
+    pairs = np.argwhere(state.indirect[:, :, obj] != NONE)
+    pairs = pairs[pairs[:, 0] != pairs[:, 1]]
+    if len(believers) < 2 or len(pairs) < 2:
+        return None
+    first = rng.choice(believers, 2, replace=False)
+    second = pairs[rng.choice(len(pairs), 2, replace=False)]
+    return (
+        [("memory", 0, ()), ("reality", 0, ())]
+        + [("first_order", i, (int(a),)) for i, a in enumerate(first)]
+        + [
+            ("second_order", i, (int(a1), int(a2)))
+            for i, (a1, a2) in enumerate(second)
+        ]
+    )
+
+
+def generate_long_story(
+    world: World,
+    config: LongStoryConfig = None,
+    rng: np.random.Generator = None,
+    timer: PhaseTimer = None,
+) -> Tuple[List[Story], List[List[str]], StoryType]:
+    # One long-horizon story group with six questions about one object, laid
+    # out like generate_story's (the i in first_order_{i} is the question's
+    # position, as there).  The story type is the strongest kind of false
+    # belief any of its questions needs.  Trace events name agents and
+    # objects by story-local index.  Call world.reset() between stories.
+    if config is None:
+        config = LongStoryConfig()
+    if config.num_agents < 2:
+        raise ValueError("Long stories need at least two agents")
+    if rng is None:
+        rng = world.rng
+    if timer is None:
+        timer = NULL_TIMER
+    for _ in range(MAX_ATTEMPTS):
+        story = _sample_long_story(world, config, rng, timer)
+        if story is not None:
+            return story
+        # Release this attempt's entities and draw everything afresh
+        world.reset()
+    raise RuntimeError(
+        f"No story in {MAX_ATTEMPTS} attempts had an object that two agents "
+        f"hold beliefs about; use more steps or agents"
+    )
+
+
+def _sample_long_story(
+    world: World, config: LongStoryConfig, rng: np.random.Generator, timer
+) -> Optional[Tuple[List[Story], List[List[str]], StoryType]]:
+    # One attempt at generate_long_story, or None if no object can be asked
+    # about
+    timer.start()
+    agents = _draw(world, "agents", config.num_agents)
+    rooms = _draw(world, "locations", config.num_rooms)
+    objects = _draw(world, "objects", config.num_objects)
+    containers = _draw(world, "containers", config.num_containers)
+    container_room = np.repeat(np.arange(config.num_rooms), config.containers_per_room)
+    obj_container = rng.integers(0, config.num_containers, config.num_objects)
+    state = BeliefState(container_room, obj_container, config.num_agents)
+    sampler = LongStorySampler(state, config, rng)
+    timer.lap("setup")
+
+    chapter, trace = [], []
+    for o in range(config.num_objects):
+        args = (objects[o], containers[obj_container[o]])
+        chapter.append(actions.ObjectLocAction.of(world, args))
+    for _ in range(config.num_steps):
+        kind, args = sampler.step()
+        if kind == "enter":
+            agent, room = args
+            state.enter(agent, room)
+            chapter.append(actions.EnterAction.of(world, (agents[agent], rooms[room])))
+            trace.append(f"agent_{agent}_enters_room_{room}")
+        elif kind == "exit":
+            (agent,) = args
+            room = state.agent_room[agent]
+            state.exit(agent)
+            chapter.append(
+                actions.ExitedAction.of(world, (agents[agent], rooms[room]))
+            )
+            trace.append(f"agent_{agent}_exits")
+        elif kind == "move":
+            agent, obj, container = args
+            state.move(agent, obj, container)
+            chapter.append(
+                actions.MoveAction.of(
+                    world, (agents[agent], objects[obj], containers[container])
+                )
+            )
+            trace.append(f"agent_{agent}_moves_obj_{obj}")
+        elif kind == "peek":
+            agent, container = args
+            state.peek(agent, container)
+            chapter.append(
+                actions.PeekAction.of(world, (agents[agent], containers[container]))
+            )
+            trace.append(f"agent_{agent}_peeks")
+        elif kind == "tell":
+            a1, a2, obj = args
+            state.tell(a1, a2, obj)
+            chapter.append(
+                actions.TellAction.of(world, (agents[a1], agents[a2], objects[obj]))
+            )
+            trace.append(f"agent_{a1}_tells_agent_{a2}")
+        else:
+            agent, obj, fixed = args
+            chapter.append(
+                actions.NoiseAction.of(world, (agents[agent], objects[obj]), fixed)
+            )
+    timer.lap("actions")
+
+    # Ask about the objects that moved most, falling back to the others
+    moves = np.zeros(config.num_objects)
+    for event in trace:
+        if "_moves_obj_" in event:
+            moves[int(event.rsplit("_", 1)[1])] += 1
+    questions = None
+    for obj in np.argsort(-moves - rng.random(config.num_objects)):
+        questions = _questions(state, obj, rng)
+        if questions is not None:
+            break
+    if questions is None:
+        timer.lap("questions")
+        return None
+
+    obj = int(obj)
+    truth = state.obj_container[obj]
+    stories, traces = [], []
+    chapter = tuple(chapter)
+    story_type = StoryType.true_belief
+    for kind, order, who in questions:
+        if kind == "memory":
+            args = (objects[obj], containers[state.start_container[obj]])
+            question, label = actions.MemoryAction.of(world, args), "memory"
+        elif kind == "reality":
+            args = (objects[obj], containers[truth])
+            question, label = actions.RealityAction.of(world, args), "reality"
+        elif kind == "first_order":
+            (a,) = who
+            ans = state.direct[a, obj]
+            args = (agents[a], objects[obj], containers[ans])
+            question = actions.SearchedAction.of(world, args)
+            question.tom = ans != truth
+            label = f'first_order_{order}_{"" if question.tom else "no_"}tom'
+            if question.tom and story_type == StoryType.true_belief:
+                story_type = StoryType.false_belief
+        else:
+            a1, a2 = who
+            ans = state.indirect[a1, a2, obj]
+            args = (agents[a1], agents[a2], objects[obj], containers[ans])
+            question = actions.BeliefSearchAction.of(world, args)
+            question.tom = ans != truth
+            label = f'second_order_{order}_{"" if question.tom else "no_"}tom'
+            if question.tom:
+                story_type = StoryType.second_order_false_belief
+        stories.append(Story(chapter, question))
+        traces.append(trace + [sys.intern(label)])
+    timer.lap("questions")
+    return stories, traces, story_type
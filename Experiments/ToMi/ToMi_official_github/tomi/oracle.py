@@ -6,139 +6,335 @@
 # LICENSE file in the root directory of this source tree.
 
 
-import copy
 from .world import World
-from typing import List
+from typing import Dict, List, Optional
 import numpy as np
-from numpy.random import randint
+
+
+# Sentinel for "nowhere" in the integer-id tables below
+NONE = -1
+
+
+def _to_id(value: Optional[int]) -> int:
+    return NONE if value is None else value
+
+
+def _from_id(value) -> Optional[int]:
+    return None if value == NONE else int(value)
 
 
 class LocationMap(object):
+    # Array-backed state tables indexed by entity id (see World).  The
+    # ordered id lists decide which entity each random draw lands on.
     def __init__(
         self,
-        agents: List[str],
-        locations: List[str],
-        objects: List[str],
-        containers: List[str],
+        agents: List[int],
+        locations: List[int],
+        objects: List[int],
+        containers: List[int],
+        rng: np.random.Generator,
     ):
+        locations = np.asarray(locations)
+        containers = np.asarray(containers)
+
         # Maps agents to their locations.
-        self.locations = {
-            agent: locations[randint(0, len(locations))] for agent in agents
-        }
-        self.container_locations = {}
-        self.containers = {l: [] for l in locations}
-        for container in containers:
-            loc = locations[randint(0, len(locations))]
-            self.container_locations[container] = loc
-            self.containers[loc].append(container)
+        self.locations = np.full(len(agents), NONE)
+        self.locations[agents] = locations[rng.integers(0, len(locations), len(agents))]
+
+        # Maps containers to their locations.
+        self.container_locations = np.full(len(containers), NONE)
+        self.container_locations[containers] = locations[
+            rng.integers(0, len(locations), len(containers))
+        ]
+
+        # Maps objects to the container holding them.
+        self.obj_containers = np.full(len(objects), NONE)
+        self.obj_containers[objects] = containers[
+            rng.integers(0, len(containers), len(objects))
+        ]
+
+        # Containers listed at a location, once that differs from the table
+        # above (see set_container_location).
+        self.container_lists = {}
+
+    @classmethod
+    def from_arrays(
+        cls,
+        locations: np.ndarray,
+        container_locations: np.ndarray,
+        obj_containers: np.ndarray,
+    ) -> "LocationMap":
+        # Build a map from pre-drawn id tables without consuming any randomness
+        location_map = cls.__new__(cls)
+        location_map.locations = locations
+        location_map.container_locations = container_locations
+        location_map.obj_containers = obj_containers
+        location_map.container_lists = {}
+        return location_map
+
+    def get_location(self, agent: int) -> int:
+        return _from_id(self.locations[agent])
+
+    def set_location(self, agent: int, location: int):
+        self.locations[agent] = _to_id(location)
 
-        self.container_objs = {container: [] for container in containers}
+    def get_container_location(self, container: int) -> int:
+        return _from_id(self.container_locations[container])
+
+    def set_container_location(self, container: int, location: int):
+        # Moving a container does not unlist it from where it was; only
+        # set_containers_at changes what a location lists
+        prev = self.get_container_location(container)
+        if prev is not None and prev not in self.container_lists:
+            self.container_lists[prev] = self.containers_at(prev)
+        self.container_locations[container] = _to_id(location)
+
+    def set_containers_at(self, location: int, containers: List[int]):
+        self.container_lists[location] = list(containers)
+
+    def get_object_container(self, obj: int) -> int:
+        return _from_id(self.obj_containers[obj])
+
+    def set_object_container(self, obj: int, container: int):
+        self.obj_containers[obj] = _to_id(container)
+
+    def containers_at(self, location: int) -> List[int]:
+        if location in self.container_lists:
+            return list(self.container_lists[location])
+        return np.flatnonzero(self.container_locations == location).tolist()
+
+    def objects_in(self, containers: List[int]) -> List[int]:
+        return np.flatnonzero(np.isin(self.obj_containers, containers)).tolist()
+
+    def container_objects(self, container: int) -> List[int]:
+        return np.flatnonzero(self.obj_containers == container).tolist()
+
+
+class SparseLocationMap(object):
+    # Dict-backed counterpart of LocationMap for worlds with large
+    # vocabularies (World sampling="index").  Only entities a story touches
+    # are stored: an agent is placed at a uniformly random location the first
+    # time it is looked up, as LocationMap places every agent up front, while
+    # containers and objects the story never placed are nowhere.
+    def __init__(
+        self,
+        num_locations: int,
+        rng: np.random.Generator,
+        locations: Dict[int, int] = None,
+    ):
+        self.num_locations = num_locations
+        self.rng = rng
+        self.locations = {} if locations is None else dict(locations)
+        self.container_locations = {}
+        self.container_lists = {}
         self.obj_containers = {}
-        for obj in objects:
-            container = containers[randint(0, len(containers))]
-            self.container_objs[container].append(obj)
-            self.obj_containers[obj] = container
 
+    def get_location(self, agent: int) -> int:
+        if agent not in self.locations:
+            self.locations[agent] = int(self.rng.integers(0, self.num_locations))
+        return self.locations[agent]
 
-class MemoryMap(object):
-    def __init__(self, agents: List[str], objects: List[str]):
+    def set_location(self, agent: int, location: int):
+        self.locations[agent] = location
+
+    def get_container_location(self, container: int) -> int:
+        return self.container_locations.get(container)
 
-        obj_dict = {obj: None for obj in objects}
-        mem_dict = {agent: copy.deepcopy(obj_dict) for agent in agents}
+    def set_container_location(self, container: int, location: int):
+        # As in LocationMap
+        prev = self.container_locations.get(container)
+        if prev is not None and prev not in self.container_lists:
+            self.container_lists[prev] = self.containers_at(prev)
+        self.container_locations[container] = location
 
-        # Dictionary of dictionaries mapping
-        # agents to objects to containers. Represents
-        # agents' belief about location of containers.
-        self.direct_beliefs = copy.deepcopy(mem_dict)
+    def set_containers_at(self, location: int, containers: List[int]):
+        self.container_lists[location] = list(containers)
 
-        # Dictionary of dictionaries of dictionaries
-        # mapping agents to direct belief dictionaries.
+    def get_object_container(self, obj: int) -> int:
+        return self.obj_containers.get(obj)
+
+    def set_object_container(self, obj: int, container: int):
+        self.obj_containers[obj] = container
+
+    def containers_at(self, location: int) -> List[int]:
+        if location in self.container_lists:
+            return list(self.container_lists[location])
+        return sorted(
+            c for c, loc in self.container_locations.items() if loc == location
+        )
+
+    def objects_in(self, containers: List[int]) -> List[int]:
+        containers = set(containers)
+        return sorted(o for o, c in self.obj_containers.items() if c in containers)
+
+    def container_objects(self, container: int) -> List[int]:
+        return self.objects_in([container])
+
+
+class MemoryMap(object):
+    def __init__(self):
+        # Sparse map from (agent, object) to container. Represents
+        # agents' belief about location of containers. Cells are
+        # only allocated once set; unset beliefs read as None.
+        self.direct_beliefs = {}
+
+        # Sparse map from (agent, agent, object) to container.
         # Represents agents' belief about other agents'
         # beliefs about location of containers.
-        self.indirect_beliefs = {agent: copy.deepcopy(mem_dict) for agent in agents}
+        self.indirect_beliefs = {}
+
+    def get_direct_belief(self, agent: int, obj: int) -> int:
+        return self.direct_beliefs.get((agent, obj))
+
+    def set_direct_belief(self, agent: int, obj: int, container: int):
+        self.direct_beliefs[(agent, obj)] = container
+
+    def get_indirect_belief(self, a1: int, a2: int, obj: int) -> int:
+        return self.indirect_beliefs.get((a1, a2, obj))
+
+    def set_indirect_belief(self, a1: int, a2: int, obj: int, container: int):
+        self.indirect_beliefs[(a1, a2, obj)] = container
+
+
+class OracleSnapshot(object):
+    # Read-only view of an oracle as it was at a given step of its event log.
+    # Lookups replay only the changes made since that step.
+    def __init__(self, oracle: "Oracle", step: int):
+        self.oracle = oracle
+        self.step = step
+
+    def get_direct_belief(self, agent: int, obj: int) -> int:
+        return self.oracle._get_at("direct_belief", (agent, obj), self.step)
+
+    def get_indirect_belief(self, a1: int, a2: int, obj: int) -> int:
+        return self.oracle._get_at("indirect_belief", (a1, a2, obj), self.step)
+
+    def get_location(self, agent: int) -> int:
+        return self.oracle._get_at("location", agent, self.step)
+
+    def get_container_location(self, container: int) -> int:
+        return self.oracle._get_at("container_location", container, self.step)
+
+    def get_object_container(self, obj: int) -> int:
+        return self.oracle._get_at("object_container", obj, self.step)
 
 
 class Oracle(object):
-    def __init__(self, world: World):
-        self.world = World
-        agents = world.get_all("agents")
-        locations = world.get_all("locations")
-        objects = world.get_all("objects")
-        containers = world.get_all("containers")
-        self.memory_map = MemoryMap(agents, objects)
-        self.locations = LocationMap(agents, locations, objects, containers)
+    def __init__(
+        self,
+        world: World,
+        location_map: LocationMap = None,
+        rng: np.random.Generator = None,
+    ):
+        self.world = world
+        if rng is None:
+            rng = world.rng
+        if location_map is None and world.sampling == "index":
+            location_map = SparseLocationMap(world.size("locations"), rng)
+        elif location_map is None:
+            location_map = LocationMap(
+                world.get_all("agents"),
+                world.get_all("locations"),
+                world.get_all("objects"),
+                world.get_all("containers"),
+                rng,
+            )
+        self.memory_map = MemoryMap()
+        self.locations = location_map
+        # Undo log of (kind, key, previous value), one entry per state change
+        self.events = []
+
+    #########################################
+    ############### Snapshots ###############
+    #########################################
+
+    def checkpoint(self) -> OracleSnapshot:
+        # Cheap alternative to copy.deepcopy(oracle): answers "state at step k"
+        # in O(changes since k) instead of copying the whole world.
+        return OracleSnapshot(self, len(self.events))
+
+    def _log(self, kind: str, key, prev):
+        self.events.append((kind, key, prev))
+
+    def _get_at(self, kind: str, key, step: int):
+        # The first change to `key` after `step` recorded the value it had then
+        for event_kind, event_key, prev in self.events[step:]:
+            if event_kind == kind and event_key == key:
+                return prev
+        if kind == "direct_belief":
+            return self.get_direct_belief(*key)
+        elif kind == "indirect_belief":
+            return self.get_indirect_belief(*key)
+        elif kind == "location":
+            return self.get_location(key)
+        elif kind == "container_location":
+            return self.get_container_location(key)
+        elif kind == "object_container":
+            return self.get_object_container(key)
+        raise ValueError(f"Unknown event kind: {kind}")
 
     #########################################
     ################ Beliefs ################
     #########################################
 
-    def get_direct_belief(self, agent: str, obj: str) -> str:
-        beliefs = self.memory_map.direct_beliefs
-        return beliefs[agent][obj]
+    def get_direct_belief(self, agent: int, obj: int) -> int:
+        return self.memory_map.get_direct_belief(agent, obj)
 
-    def set_direct_belief(self, agent: str, obj: str, container: str):
-        beliefs = self.memory_map.direct_beliefs
-        beliefs[agent][obj] = container
+    def set_direct_belief(self, agent: int, obj: int, container: int):
+        self._log("direct_belief", (agent, obj), self.get_direct_belief(agent, obj))
+        self.memory_map.set_direct_belief(agent, obj, container)
 
-    def get_indirect_belief(self, a1: str, a2: str, obj: str) -> str:
-        indirect_beliefs = self.memory_map.indirect_beliefs
-        return indirect_beliefs[a1][a2][obj]
+    def get_indirect_belief(self, a1: int, a2: int, obj: int) -> int:
+        return self.memory_map.get_indirect_belief(a1, a2, obj)
 
-    def set_indirect_belief(self, a1: str, a2: str, obj: str, container: str):
-        indirect_beliefs = self.memory_map.indirect_beliefs
-        indirect_beliefs[a1][a2][obj] = container
+    def set_indirect_belief(self, a1: int, a2: int, obj: int, container: int):
+        self._log(
+            "indirect_belief", (a1, a2, obj), self.get_indirect_belief(a1, a2, obj)
+        )
+        self.memory_map.set_indirect_belief(a1, a2, obj, container)
 
     #########################################
     ############### Locations ###############
     #########################################
 
-    def get_location(self, agent: str) -> str:
-        return self.locations.locations[agent]
+    def get_location(self, agent: int) -> int:
+        return self.locations.get_location(agent)
 
-    def set_location(self, agent: str, location: str):
-        self.locations.locations[agent] = location
+    def set_location(self, agent: int, location: int):
+        self._log("location", agent, self.get_location(agent))
+        self.locations.set_location(agent, location)
 
-    def get_containers(self, location: str) -> List[str]:
+    def get_containers(self, location: int) -> List[int]:
         # Returns a list of containers at location
-        return self.locations.containers[location]
+        return self.locations.containers_at(location)
 
-    def set_containers(self, location: str, containers: List[str]):
+    def set_containers(self, location: int, containers: List[int]):
         # May need to change to move containers bt locs
         # Containers is a list of containers at location
         for container in containers:
             self._set_container_location(container, location)
-        self.locations.containers[location] = containers
+        self.locations.set_containers_at(location, containers)
 
-    def get_objects_at_location(self, location: str) -> List[str]:
-        objects = []
-        for container in self.get_containers(location):
-            objects.extend(self.get_container_obj(container))
-        return objects
+    def get_objects_at_location(self, location: int) -> List[int]:
+        return self.locations.objects_in(self.get_containers(location))
 
-    def get_container_location(self, container: str) -> str:
-        return self.locations.container_locations[container]
+    def get_container_location(self, container: int) -> int:
+        return self.locations.get_container_location(container)
 
-    def _set_container_location(self, container: str, location: str):
-        self.locations.container_locations[container] = location
+    def _set_container_location(self, container: int, location: int):
+        prev = self.get_container_location(container)
+        self._log("container_location", container, prev)
+        self.locations.set_container_location(container, location)
 
-    def get_container_obj(self, container: str) -> str:
+    def get_container_obj(self, container: int) -> List[int]:
         # get list of objects in container
-        return self.locations.container_objs[container]
-
-    def _add_container_obj(self, container: str, obj: str):
-        self.locations.container_objs[container].append(obj)
-
-    def _remove_container_obj(self, container: str, obj: str):
-        self.locations.container_objs[container].remove(obj)
+        return self.locations.container_objects(container)
 
-    def get_object_container(self, obj: str) -> str:
+    def get_object_container(self, obj: int) -> int:
         # get container that holds object
-        return self.locations.obj_containers[obj]
+        return self.locations.get_object_container(obj)
 
-    def set_object_container(self, obj: str, container: str):
+    def set_object_container(self, obj: int, container: int):
         # set container that holds object
-        prev_container = self.get_object_container(obj)
-        if prev_container:
-            self._remove_container_obj(prev_container, obj)
-        self._add_container_obj(container, obj)
-        self.locations.obj_containers[obj] = container
+        self._log("object_container", obj, self.get_object_container(obj))
+        self.locations.set_object_container(obj, container)
@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+# Copyright (c) 2019-present, Facebook, Inc.
+# All rights reserved.
+#
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+
+
+import time
+from typing import Dict
+
+
+class PhaseTimer(object):
+    # Accumulates wall time and call counts per named phase.  Code is timed
+    # as a sequence of laps: start() sets the clock, and every lap(phase)
+    # charges the time since the previous start/lap to `phase`.
+    def __init__(self):
+        self.seconds: Dict[str, float] = {}
+        self.calls: Dict[str, int] = {}
+        self.last = None
+
+    def start(self):
+        self.last = time.perf_counter()
+
+    def lap(self, phase: str):
+        now = time.perf_counter()
+        self.add(phase, now - self.last)
+        self.last = now
+
+    def add(self, phase: str, seconds: float, calls: int = 1):
+        self.seconds[phase] = self.seconds.get(phase, 0.0) + seconds
+        self.calls[phase] = self.calls.get(phase, 0) + calls
+
+    def as_dict(self) -> Dict[str, Dict[str, float]]:
+        return {
+            phase: {"seconds": self.seconds[phase], "calls": self.calls[phase]}
+            for phase in self.seconds
+        }
+
+    def merge(self, phases: Dict[str, Dict[str, float]]):
+        # Fold in another timer's as_dict(), e.g. one returned by a worker
+        for phase, stats in phases.items():
+            self.add(phase, stats["seconds"], stats["calls"])
+
+    def summary(self) -> str:
+        total = sum(self.seconds.values()) or 1.0
+        header = f"{'phase':<16}{'seconds':>10}{'share':>8}{'calls':>10}{'us/call':>10}"
+        lines = [header]
+        for phase in sorted(self.seconds, key=self.seconds.get, reverse=True):
+            seconds, calls = self.seconds[phase], self.calls[phase]
+            lines.append(
+                f"{phase:<16}{seconds:>10.3f}{seconds / total:>8.1%}{calls:>10}"
+                f"{1e6 * seconds / max(calls, 1):>10.1f}"
+            )
+        return "\n".join(lines)
+
+
+class NullTimer(object):
+    # Stand-in used when instrumentation is off; every hook is a no-op
+    def start(self):
+        pass
+
+    def lap(self, phase: str):
+        pass
+
+    def add(self, phase: str, seconds: float, calls: int = 1):
+        pass
+
+
+NULL_TIMER = NullTimer()
@@ -6,11 +6,12 @@
 # LICENSE file in the root directory of this source tree.
 
 from . import actions
-import copy
+import sys
 from enum import Enum
 from .world import World
-from .oracle import Oracle
-from typing import List, Tuple
+from .oracle import LocationMap, Oracle, SparseLocationMap
+from .profiling import NULL_TIMER, PhaseTimer
+from typing import List, Sequence, Tuple
 from . import actions
 import numpy as np
 
@@ -26,9 +27,11 @@ def sample_question(
     elif question == "belief":
         action = actions.BeliefSearchAction(oracle, agent1, agent2, obj)
         trace = f'second_order_{agent_order}_{"" if action.tom else "no_"}tom'
+        trace = sys.intern(trace)
     elif question == "search":
         action = actions.SearchedAction(oracle, agent1, obj)
         trace = f'first_order_{agent_order}_{"" if action.tom else "no_"}tom'
+        trace = sys.intern(trace)
     return action, trace
 
 
@@ -38,30 +41,322 @@ class StoryType(Enum):
     second_order_false_belief = "second_order_false_belief"
 
 
-def enter(oracle: Oracle, agent: str, observers: List[int], location: str):
+# The (act_types, agent_0 exits before the last re-enter) branches that produce
+# each story type, weighted by their probability under undirected sampling so
+# that directed generation draws from the same per-type story distribution.
+STORY_PLANS = {
+    StoryType.true_belief: [
+        (["move", "loc_change"], False, 1 / 2),
+        (["move", "loc_change", "loc_change"], False, 1 / 6),
+        (["loc_change", "loc_change", "move"], False, 1 / 3),
+    ],
+    StoryType.false_belief: [
+        (["loc_change", "move"], False, 3 / 4),
+        (["loc_change", "move", "loc_change"], False, 1 / 4),
+    ],
+    StoryType.second_order_false_belief: [
+        (["move", "loc_change", "loc_change"], True, 1 / 2),
+        (["loc_change", "move", "loc_change"], True, 1 / 2),
+    ],
+}
+
+
+def sample_plan(
+    rng: np.random.Generator, story_type: StoryType = None
+) -> Tuple[List[str], bool]:
+    if story_type is None:
+        # Allow up to 2 location changes and 1 move.  Randomize the order...
+        act_types = ["move"] + ["loc_change"] * rng.integers(1, 3)
+        rng.shuffle(act_types)
+        return act_types, None
+    plans = STORY_PLANS[story_type]
+    idx = rng.choice(len(plans), p=[p for _, _, p in plans])
+    act_types, exit_last, _ = plans[idx]
+    return list(act_types), exit_last
+
+
+def sample_distinct(rng: np.random.Generator, n: int, size: int, k: int) -> np.ndarray:
+    # Draw k distinct ids out of range(size) for each of n rows without
+    # materializing a permutation of the whole range.
+    out = np.empty((n, k), dtype=np.int64)
+    for j in range(k):
+        r = rng.integers(0, size - j, n)
+        # Shift r past every id already taken in its row, smallest first
+        for taken in np.sort(out[:, :j], axis=1).T:
+            r += r >= taken
+        out[:, j] = r
+    return out
+
+
+class StorySampler(object):
+    # Random decisions for a single story, drawn one at a time from `rng`
+    # (the world's generator by default) as generate_story needs them.
+    def __init__(self, world: World, rng: np.random.Generator = None):
+        self.world = world
+        self.rng = rng if rng is not None else world.rng
+
+    def oracle(self) -> Oracle:
+        return Oracle(self.world, rng=self.rng)
+
+    def agents(self) -> Tuple[int, int, int]:
+        return tuple(self.world.get_agent() for _ in range(3))
+
+    def locations(self) -> Tuple[int, int]:
+        return self.world.get_location(), self.world.get_location()
+
+    def object(self) -> int:
+        return self.world.get_object()
+
+    def containers(self) -> Tuple[int, int]:
+        return self.world.get_container(), self.world.get_container()
+
+    def shuffle_agents(self, agents: List[Tuple[int, int]]):
+        self.rng.shuffle(agents)
+
+    def plan(self, story_type: StoryType) -> Tuple[List[str], bool]:
+        return sample_plan(self.rng, story_type)
+
+    def exit_coin(self) -> bool:
+        return self.rng.integers(0, 2) == 0
+
+    def reenter_coin(self) -> bool:
+        return self.rng.integers(0, 2) == 0
+
+    def third_agent_indices(self, num_slots: int) -> np.ndarray:
+        return self.rng.choice(num_slots, replace=False, size=self.rng.integers(0, 3))
+
+    def third_agent_coin(self) -> bool:
+        return self.rng.integers(0, 2) == 0
+
+    def noise_indices(self, num_slots: int) -> np.ndarray:
+        return self.rng.choice(num_slots, replace=False, size=self.rng.integers(0, 3))
+
+    def noise(self, people: List[int]) -> Tuple[int, int, int]:
+        person = people[self.rng.integers(0, len(people))]
+        pos = self.rng.integers(0, self.world.size("objects"))
+        thing = self.world.entity_at("objects", pos)
+        fixed = self.rng.integers(0, len(actions.NoiseAction.TEMPLATES))
+        return person, thing, fixed
+
+
+# Probability of each story type under undirected sampling (see STORY_PLANS)
+STORY_TYPE_PROBS = {
+    StoryType.true_belief: 1 / 2,
+    StoryType.false_belief: 1 / 3,
+    StoryType.second_order_false_belief: 1 / 6,
+}
+
+
+class BatchStorySampler(object):
+    # Draws every random decision for n stories up front as arrays.  row(i)
+    # exposes story i through the StorySampler interface, so the stories
+    # follow the same distribution as sampling them one at a time.
+    def __init__(
+        self, world: World, n: int, rng: np.random.Generator, story_type=None,
+    ):
+        self.world = world
+        num_agents = world.size("agents")
+        num_locations = world.size("locations")
+        num_objects = world.size("objects")
+        num_containers = world.size("containers")
+
+        if story_type is None:
+            types = list(STORY_TYPE_PROBS.keys())
+            drawn = rng.choice(len(types), size=n, p=list(STORY_TYPE_PROBS.values()))
+            self.story_types = [types[t] for t in drawn]
+        elif isinstance(story_type, StoryType):
+            self.story_types = [story_type] * n
+        else:
+            self.story_types = list(story_type)
+        self.plans = np.empty(n, dtype=np.int64)
+        types = np.array([t.value for t in self.story_types])
+        for typ, plans in STORY_PLANS.items():
+            rows = np.flatnonzero(types == typ.value)
+            self.plans[rows] = rng.choice(
+                len(plans), size=len(rows), p=[p for _, _, p in plans]
+            )
+
+        # Initial world state, as drawn by LocationMap.  With index sampling
+        # only the story agents are placed (see SparseLocationMap), so no
+        # array here grows with the vocabulary.
+        self.sparse = world.sampling == "index"
+        if self.sparse:
+            self.agent_locations = rng.integers(0, num_locations, (n, 3))
+        else:
+            self.agent_locations = rng.integers(0, num_locations, (n, num_agents))
+            self.container_locations = rng.integers(
+                0, num_locations, (n, num_containers)
+            )
+            self.obj_containers = rng.integers(0, num_containers, (n, num_objects))
+
+        # Story entities, distinct within a story
+        self.agents = sample_distinct(rng, n, num_agents, 3)
+        self.locations = sample_distinct(rng, n, num_locations, 2)
+        self.objects = sample_distinct(rng, n, num_objects, 1)
+        self.containers = sample_distinct(rng, n, num_containers, 2)
+
+        self.swap_agents = rng.integers(0, 2, n) == 1
+        self.reenter_coins = rng.integers(0, 2, n) == 0
+        self.third_agent_counts = rng.integers(0, 3, n)
+        self.third_agent_slots = rng.random((n, 2))
+        self.third_agent_coins = rng.integers(0, 2, n) == 0
+        self.noise_counts = rng.integers(0, 3, n)
+        self.noise_slots = rng.random((n, 2))
+        self.noise_people = rng.integers(0, 3, (n, 2))
+        self.noise_things = rng.integers(0, num_objects, (n, 2))
+        self.noise_fixed = rng.integers(0, len(actions.NoiseAction.TEMPLATES), (n, 2))
+
+    def __len__(self):
+        return len(self.story_types)
+
+    def row(self, i: int) -> "BatchStorySamplerRow":
+        return BatchStorySamplerRow(self, i)
+
+
+def _distinct_slots(uniforms: np.ndarray, count: int, num_slots: int) -> List[int]:
+    # Map two uniforms to an ordered pair of distinct slots, like
+    # np.random.choice(num_slots, size=count, replace=False)
+    first = int(uniforms[0] * num_slots)
+    second = int(uniforms[1] * (num_slots - 1))
+    second += second >= first
+    return [first, second][:count]
+
+
+class BatchStorySamplerRow(object):
+    def __init__(self, batch: BatchStorySampler, i: int):
+        self.batch = batch
+        self.i = i
+        self.num_noise = 0
+
+    def oracle(self) -> Oracle:
+        b, i = self.batch, self.i
+        if b.sparse:
+            locations = zip(self.agents(), b.agent_locations[i].tolist())
+            location_map = SparseLocationMap(b.world.size("locations"), None, locations)
+        else:
+            location_map = LocationMap.from_arrays(
+                b.agent_locations[i], b.container_locations[i], b.obj_containers[i]
+            )
+        return Oracle(b.world, location_map)
+
+    def agents(self) -> Tuple[int, int, int]:
+        return tuple(int(a) for a in self.batch.agents[self.i])
+
+    def locations(self) -> Tuple[int, int]:
+        return tuple(int(l) for l in self.batch.locations[self.i])
+
+    def object(self) -> int:
+        return int(self.batch.objects[self.i, 0])
+
+    def containers(self) -> Tuple[int, int]:
+        return tuple(int(c) for c in self.batch.containers[self.i])
+
+    def shuffle_agents(self, agents: List[Tuple[int, int]]):
+        if self.batch.swap_agents[self.i]:
+            agents.reverse()
+
+    def plan(self, story_type: StoryType) -> Tuple[List[str], bool]:
+        plans = STORY_PLANS[self.batch.story_types[self.i]]
+        act_types, exit_last, _ = plans[self.batch.plans[self.i]]
+        return list(act_types), exit_last
+
+    def exit_coin(self) -> bool:
+        raise RuntimeError("Batch plans always fix whether agent_0 exits")
+
+    def reenter_coin(self) -> bool:
+        return self.batch.reenter_coins[self.i]
+
+    def third_agent_indices(self, num_slots: int) -> List[int]:
+        b, i = self.batch, self.i
+        return _distinct_slots(
+            b.third_agent_slots[i], b.third_agent_counts[i], num_slots
+        )
+
+    def third_agent_coin(self) -> bool:
+        return self.batch.third_agent_coins[self.i]
+
+    def noise_indices(self, num_slots: int) -> List[int]:
+        b, i = self.batch, self.i
+        return _distinct_slots(b.noise_slots[i], b.noise_counts[i], num_slots)
+
+    def noise(self, people: List[int]) -> Tuple[int, int, int]:
+        b, i, j = self.batch, self.i, self.num_noise
+        self.num_noise += 1
+        return (
+            people[b.noise_people[i, j]],
+            int(b.noise_things[i, j]),
+            int(b.noise_fixed[i, j]),
+        )
+
+
+def enter(oracle: Oracle, agent: int, observers: List[int], location: int):
     if oracle.get_location(agent) == location:  # already in location
         return actions.LocationAction(oracle, (agent, location))
     else:  # somewhere else, move this person into location
         return actions.EnterAction(oracle, (agent, location), observers)
 
 
+class Story(Sequence):
+    # One question variant of a story group: the chapter, a tuple shared by
+    # all six variants, followed by the variant's own question.  Reads like
+    # the list `chapter + [question]` without copying the chapter.
+    __slots__ = ("chapter", "question")
+
+    def __init__(self, chapter: Tuple[actions.Action, ...], question: actions.Action):
+        self.chapter = chapter
+        self.question = question
+
+    def __len__(self):
+        return len(self.chapter) + 1
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            if idx == slice(None, -1):
+                return self.chapter
+            return (*self.chapter, self.question)[idx]
+        n = len(self.chapter)
+        if idx < 0:
+            idx += n + 1
+        if idx == n:
+            return self.question
+        if not 0 <= idx < n:
+            raise IndexError("story index out of range")
+        return self.chapter[idx]
+
+    def __iter__(self):
+        yield from self.chapter
+        yield self.question
+
+
 def generate_story(
     world: World,
-) -> Tuple[List[List[actions.Action]], List[List[str]], StoryType]:
-    oracle = Oracle(world)
+    story_type: StoryType = None,
+    sampler=None,
+    rng: np.random.Generator = None,
+    timer: PhaseTimer = None,
+) -> Tuple[List[Story], List[List[str]], StoryType]:
+    # If `story_type` is given, only the branches producing it are sampled.
+    # Randomness comes from `sampler`, else from `rng`, else from world.rng.
+    # Pass a PhaseTimer to accumulate the wall time of each phase below.
+    if timer is None:
+        timer = NULL_TIMER
+    timer.start()
+    if sampler is None:
+        sampler = StorySampler(world, rng)
+    oracle = sampler.oracle()
+    timer.lap("oracle")
 
-    a1, a2, a3 = (world.get_agent() for _ in range(3))
-    story_type = StoryType.true_belief
+    a1, a2, a3 = sampler.agents()
+    target_type, story_type = story_type, StoryType.true_belief
 
-    location = world.get_location()
-    alternative_loc = world.get_location()
+    location, alternative_loc = sampler.locations()
 
     # Get an initial object and container in the room
-    obj = world.get_object()
-    container_1 = world.get_container()
-    container_2 = world.get_container()
+    obj = sampler.object()
+    container_1, container_2 = sampler.containers()
     oracle.set_containers(location, [container_1, container_2])
     oracle.set_object_container(obj, container_1)
+    timer.lap("setup")
 
     trace = []
     chapter = []
@@ -70,20 +365,20 @@ def generate_story(
     first_agent = None
     agents = [(a1, 0), (a2, 1)]
     enter_observers = []
-    np.random.shuffle(agents)
+    sampler.shuffle_agents(agents)
     agent_1, agent_2 = (x for _, x in agents)
     for agent, order in agents:
         chapter.append(enter(oracle, agent, enter_observers, location))
         enter_observers.append(agent)
-        trace.append(f"enter_agent_{order}")
+        trace.append(sys.intern(f"enter_agent_{order}"))
 
     # announce location of object
     chapter.append(actions.ObjectLocAction(oracle, obj, [a for a, _ in agents]))
-    start_state = copy.deepcopy(oracle)
+    timer.lap("enter")
+    start_state = oracle.checkpoint()
+    timer.lap("snapshot")
 
-    # Allow up to 2 location changes and 1 move.  Randomize the order...
-    act_types = ["move"] + ["loc_change"] * np.random.randint(1, 3)
-    np.random.shuffle(act_types)
+    act_types, exit_last = sampler.plan(target_type)
 
     # If we move in the middle, this story moves into the false belief scenario.
     story_type = StoryType.false_belief if act_types[1] == "move" else story_type
@@ -104,7 +399,11 @@ def generate_story(
         else:
             enter_observers = [a1]
             # Assuming this is the last action, then with 50% chance exit the moving actor
-            if np.random.randint(0, 2) == 0 and i == len(act_types) - 1:
+            if exit_last is None:
+                exit_actor = sampler.exit_coin()
+            else:
+                exit_actor = exit_last
+            if exit_actor and i == len(act_types) - 1:
                 story_type = (
                     StoryType.second_order_false_belief
                 )  # this now is a second order falst belief
@@ -115,7 +414,7 @@ def generate_story(
                 enter_observers = []
                 trace.append(f"agent_0_exits")
 
-            enter_loc = location if np.random.randint(0, 2) == 0 else alternative_loc
+            enter_loc = location if sampler.reenter_coin() else alternative_loc
             # a2 already exited, re-enter same room, or a different one
             chapter.append(
                 actions.EnterAction(oracle, (a2, enter_loc), enter_observers)
@@ -126,10 +425,10 @@ def generate_story(
                 f"agent_1_reenters_" + ("alt_loc" if enter_loc != location else "loc")
             )
 
+    timer.lap("actions")
+
     # generate indices for which person 3 should enter/exit
-    indices = np.random.choice(
-        np.arange(len(chapter) + 1), replace=False, size=np.random.randint(0, 3)
-    )
+    indices = sampler.third_agent_indices(len(chapter) + 1)
     indices.sort()
     for idx, action in zip(indices, ["enter", "exit"]):
         if action == "exit":
@@ -137,30 +436,327 @@ def generate_story(
             enter_observers.pop()  # remove person 3 from observers
             trace.insert(idx, f"agent_2_exits")
         else:
-            enter_loc = location if np.random.randint(0, 2) == 0 else alternative_loc
+            enter_loc = location if sampler.third_agent_coin() else alternative_loc
             chapter.insert(
                 idx, actions.EnterAction(oracle, (a3, enter_loc), enter_observers)
             )
             enter_observers.append(a3)
             trace.insert(idx, f"agent_2_enters")
+    timer.lap("third_agent")
 
     # Add noise:
-    indices = np.random.choice(
-        np.arange(len(chapter) + 1), replace=False, size=np.random.randint(0, 3)
-    )
+    indices = sampler.noise_indices(len(chapter) + 1)
     for idx in indices:
-        person = np.random.choice([a1, a2, a3], 1)[0]
-        things = world.get_all("objects")
-        thing = np.random.choice(things, 1)[0]
-        chapter.insert(idx, actions.NoiseAction(oracle, person, thing))
+        person, thing, fixed = sampler.noise([a1, a2, a3])
+        chapter.insert(idx, actions.NoiseAction(oracle, person, thing, fixed))
+    timer.lap("noise")
 
     stories, traces = [], []
+    chapter = tuple(chapter)
     for q in ["memory", "search", "belief", "reality"]:
         qtext, qtrace = sample_question(start_state, oracle, a1, a2, obj, q, agent_1)
-        stories.append(chapter + [qtext])
+        stories.append(Story(chapter, qtext))
         traces.append(trace + [qtrace])
     for q in ["search", "belief"]:
         qtext, qtrace = sample_question(start_state, oracle, a2, a1, obj, q, agent_2)
-        stories.append(chapter + [qtext])
+        stories.append(Story(chapter, qtext))
         traces.append(trace + [qtrace])
+    timer.lap("questions")
     return stories, traces, story_type
+
+
+# STORY_PLANS flattened, and what generate_story does for each act of a
+# plan: "move", "exit_a2" (a2 is in the room), "exit_a1" followed by
+# "reenter" (agent_0 leaves before a2's last re-enter), or "reenter".
+BATCH_PLANS = [
+    (story_type, act_types, exit_last)
+    for story_type, plans in STORY_PLANS.items()
+    for act_types, exit_last, _ in plans
+]
+
+
+def plan_events(act_types: List[str], exit_last: bool) -> List[str]:
+    events, a2_out = [], False
+    for i, act_type in enumerate(act_types):
+        if act_type == "move":
+            events.append("move")
+        elif not a2_out:
+            events.append("exit_a2")
+            a2_out = True
+        elif a2_out is None:
+            # Where a2 re-entered is only known per story
+            raise ValueError(f"Unsupported plan: {act_types}")
+        else:
+            if exit_last and i == len(act_types) - 1:
+                events.append("exit_a1")
+            events.append("reenter")
+            a2_out = None
+    return events
+
+
+def plan_story_type(act_types: List[str], exit_last: bool) -> StoryType:
+    # As generate_story decides it while acting the plan out
+    if "exit_a1" in plan_events(act_types, exit_last):
+        return StoryType.second_order_false_belief
+    if act_types[1] == "move":
+        return StoryType.false_belief
+    return StoryType.true_belief
+
+
+def _distinct_slot_arrays(uniforms: np.ndarray, num_slots: np.ndarray):
+    # _distinct_slots for every row at once
+    first = (uniforms[:, 0] * num_slots).astype(np.int64)
+    second = (uniforms[:, 1] * (num_slots - 1)).astype(np.int64)
+    second += second >= first
+    return first, second
+
+
+class StoryBatch(Sequence):
+    # The stories of a BatchStorySampler.  Traces, story types and question
+    # answers are computed for all rows at once straight from its arrays;
+    # batch[i] builds the Action objects of story group i only when asked,
+    # as (stories, traces, story_type) like generate_story returns.  The
+    # stories are the ones generate_story(world, type, batch.row(i)) would
+    # act out through an Oracle.
+    def __init__(self, batch: BatchStorySampler):
+        self.batch = b = batch
+        self.world = batch.world
+        n = len(batch)
+        rows = np.arange(n)
+        a1, a2 = b.agents[:, 0], b.agents[:, 1]
+        location, alternative_loc = b.locations[:, 0], b.locations[:, 1]
+        c1, c2 = b.containers[:, 0], b.containers[:, 1]
+
+        type_offsets = np.cumsum([0] + [len(p) for p in STORY_PLANS.values()])
+        type_codes = {t: j for j, t in enumerate(STORY_PLANS)}
+        codes = np.array([type_codes[t] for t in b.story_types], dtype=np.int64)
+        self.plan = type_offsets[codes] + b.plans
+        self.events = events = [
+            plan_events(act_types, exit_last) for _, act_types, exit_last in BATCH_PLANS
+        ]
+        self.story_types = [
+            plan_story_type(act_types, exit_last)
+            for _, act_types, exit_last in BATCH_PLANS
+        ]
+
+        # An agent already in the room is "in the location", not entering it
+        if b.sparse:
+            start = b.agent_locations[:, :2]
+        else:
+            start = b.agent_locations[rows[:, None], b.agents[:, :2]]
+        self.at_location = start == location[:, None]
+
+        # Containers entering agents see into in the alternative location,
+        # as listed by the initial LocationMap (the sparse map lists none)
+        def seen_at_alt(container):
+            if b.sparse:
+                return np.zeros(n, dtype=bool)
+            return b.container_locations[rows, container] == alternative_loc
+
+        # Beliefs about the object of a1 and a2 (direct) and of each about
+        # the other (indirect).  ObjectLocAction sets all four to c1.
+        direct_1, direct_2 = c1.copy(), c1.copy()
+        indirect_12, indirect_21 = c1.copy(), c1.copy()
+        current = c1.copy()
+        a1_exits = np.zeros(n, dtype=bool)
+        for g, steps in enumerate(events):
+            idx = np.flatnonzero(self.plan == g)
+            a2_in = np.ones(len(idx), dtype=bool)
+            a1_in = True
+            for event in steps:
+                if event == "move":
+                    # a1 and everyone still watching see the move
+                    current[idx] = c2[idx]
+                    direct_1[idx] = c2[idx]
+                    both = idx[a2_in]
+                    direct_2[both] = indirect_12[both] = indirect_21[both] = c2[both]
+                elif event == "exit_a2":
+                    a2_in[:] = False
+                elif event == "exit_a1":
+                    a1_in = False
+                    a1_exits[idx] = True
+                else:
+                    at_loc = b.reenter_coins[idx]
+                    seen = at_loc | seen_at_alt(current)[idx]
+                    seen_idx = idx[seen]
+                    direct_2[seen_idx] = current[seen_idx]
+                    if a1_in:
+                        indirect_12[seen_idx] = current[seen_idx]
+                        indirect_21[seen_idx] = current[seen_idx]
+                    a2_in = at_loc
+
+        # The third agent acts last.  Entering with a1 and a2 still listed
+        # as observers, and seeing the object, it updates their indirect
+        # beliefs too (generate_story keeps observers who left listed).
+        enters = b.third_agent_counts >= 1
+        seen = b.third_agent_coins | seen_at_alt(c2)
+        third = enters & seen & ~a1_exits
+        indirect_12[third] = indirect_21[third] = c2[third]
+
+        self.answers = np.stack([direct_1, indirect_12, direct_2, indirect_21], 1)
+        self.tom = self.answers != c2[:, None]
+
+        # Insertion slots of the third agent's actions and the noise
+        plan_lengths = np.array([len(e) for e in events])[self.plan]
+        third_slots = 3 + plan_lengths + 1
+        first, second = _distinct_slot_arrays(b.third_agent_slots, third_slots)
+        self.third_slots = np.stack([first, second], 1)
+        # Sorted, so the agent enters before it exits
+        both = b.third_agent_counts == 2
+        self.third_slots[both] = np.sort(self.third_slots[both], axis=1)
+        noise_slots = third_slots + b.third_agent_counts
+        first, second = _distinct_slot_arrays(b.noise_slots, noise_slots)
+        self.noise_slots = np.stack([first, second], 1)
+
+        # Rows alike in plan, agent order, re-enter coin, third-agent slots
+        # and question labels have the same traces, which are built once
+        counts = b.third_agent_counts
+        slots = np.where(np.arange(2) < counts[:, None], self.third_slots, 0)
+        key = self.plan
+        for column, size in [
+            (b.swap_agents, 2),
+            (b.reenter_coins, 2),
+            (counts, 3),
+            (slots[:, 0], 16),
+            (slots[:, 1], 16),
+            (self.tom @ (1 << np.arange(4)), 16),
+        ]:
+            key = key * size + column
+        _, first_rows, self.trace_ids = np.unique(
+            key, return_index=True, return_inverse=True
+        )
+        self.trace_table = [self._build_traces(i) for i in first_rows]
+
+    def _build_traces(self, i: int) -> List[List[str]]:
+        b = self.batch
+        g = int(self.plan[i])
+        swap = bool(b.swap_agents[i])
+        order_1, order_2 = (1, 0) if swap else (0, 1)
+        trace = [f"enter_agent_{order_1}", f"enter_agent_{order_2}"]
+        for event in self.events[g]:
+            if event == "move":
+                trace.append("agent_0_moves_obj")
+            elif event == "exit_a2":
+                trace.append("agent_1_exits")
+            elif event == "exit_a1":
+                trace.append("agent_0_exits")
+            else:
+                where = "loc" if b.reenter_coins[i] else "alt_loc"
+                trace.append(f"agent_1_reenters_{where}")
+        count = b.third_agent_counts[i]
+        for idx, event in zip(self.third_slots[i, :count], ["enters", "exits"]):
+            trace.insert(idx, f"agent_2_{event}")
+        tom = ["" if t else "no_" for t in self.tom[i]]
+        questions = [
+            "memory",
+            f"first_order_{order_1}_{tom[0]}tom",
+            f"second_order_{order_1}_{tom[1]}tom",
+            "reality",
+            f"first_order_{order_2}_{tom[2]}tom",
+            f"second_order_{order_2}_{tom[3]}tom",
+        ]
+        return [trace + [sys.intern(q)] for q in questions]
+
+    def __len__(self):
+        return len(self.trace_ids)
+
+    def traces(self, i: int) -> List[List[str]]:
+        return [list(trace) for trace in self.trace_table[self.trace_ids[i]]]
+
+    def story_type(self, i: int) -> StoryType:
+        return self.story_types[self.plan[i]]
+
+    def chapter(self, i: int) -> Tuple[actions.Action, ...]:
+        b, world = self.batch, self.world
+        a1, a2, a3 = (int(a) for a in b.agents[i])
+        location, alternative_loc = (int(l) for l in b.locations[i])
+        obj = int(b.objects[i, 0])
+        c1, c2 = (int(c) for c in b.containers[i])
+
+        chapter = []
+        agents = [(a2, 1), (a1, 0)] if b.swap_agents[i] else [(a1, 0), (a2, 1)]
+        for agent, order in agents:
+            if self.at_location[i, order]:
+                action = actions.LocationAction.of(world, (agent, location), 0)
+            else:
+                action = actions.EnterAction.of(world, (agent, location))
+            chapter.append(action)
+        chapter.append(actions.ObjectLocAction.of(world, (obj, c1)))
+        for event in self.events[self.plan[i]]:
+            if event == "move":
+                action = actions.MoveAction.of(world, (a1, obj, c2))
+            elif event == "exit_a2":
+                action = actions.ExitedAction.of(world, (a2, location))
+            elif event == "exit_a1":
+                action = actions.ExitedAction.of(world, (a1, location))
+            else:
+                enter_loc = location if b.reenter_coins[i] else alternative_loc
+                action = actions.EnterAction.of(world, (a2, enter_loc))
+            chapter.append(action)
+
+        enter_loc = location if b.third_agent_coins[i] else alternative_loc
+        third = [
+            actions.EnterAction.of(world, (a3, enter_loc)),
+            actions.ExitedAction.of(world, (a3, enter_loc)),
+        ]
+        count = b.third_agent_counts[i]
+        for idx, action in zip(self.third_slots[i, :count], third):
+            chapter.insert(idx, action)
+
+        people = (a1, a2, a3)
+        for j, idx in enumerate(self.noise_slots[i, : b.noise_counts[i]]):
+            person = people[b.noise_people[i, j]]
+            args = (person, int(b.noise_things[i, j]))
+            fixed = int(b.noise_fixed[i, j])
+            chapter.insert(idx, actions.NoiseAction.of(world, args, fixed))
+        return tuple(chapter)
+
+    def questions(self, i: int) -> List[actions.Action]:
+        b, world = self.batch, self.world
+        a1, a2 = (int(a) for a in b.agents[i, :2])
+        obj = int(b.objects[i, 0])
+        c1, c2 = (int(c) for c in b.containers[i])
+        ans = [int(c) for c in self.answers[i]]
+        questions = [
+            actions.MemoryAction.of(world, (obj, c1)),
+            actions.SearchedAction.of(world, (a1, obj, ans[0])),
+            actions.BeliefSearchAction.of(world, (a1, a2, obj, ans[1])),
+            actions.RealityAction.of(world, (obj, c2)),
+            actions.SearchedAction.of(world, (a2, obj, ans[2])),
+            actions.BeliefSearchAction.of(world, (a2, a1, obj, ans[3])),
+        ]
+        for question, tom in zip(questions[1:3] + questions[4:], self.tom[i]):
+            question.tom = bool(tom)
+        return questions
+
+    def __getitem__(self, i: int) -> Tuple[List[Story], List[List[str]], StoryType]:
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        chapter = self.chapter(i)
+        stories = [Story(chapter, question) for question in self.questions(i)]
+        return stories, self.traces(i), self.story_type(i)
+
+
+def generate_stories(
+    world: World,
+    n: int,
+    rng: np.random.Generator = None,
+    story_type=None,
+    timer: PhaseTimer = None,
+) -> StoryBatch:
+    # Batch counterpart of generate_story: all random decisions for the n
+    # stories are drawn in bulk and their traces and answers computed as
+    # arrays (see StoryBatch).  `story_type` may be None (undirected), a
+    # StoryType, or one StoryType per story.
+    if rng is None:
+        rng = world.rng
+    if timer is None:
+        timer = NULL_TIMER
+    timer.start()
+    batch = BatchStorySampler(world, n, rng, story_type)
+    timer.lap("batch_sample")
+    stories = StoryBatch(batch)
+    timer.lap("batch_assemble")
+    return stories
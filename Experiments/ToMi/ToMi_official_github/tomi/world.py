@@ -7,8 +7,10 @@
 
 
 import json
-import random
+import mmap
 import os
+import numpy as np
+from typing import Dict, Sequence
 
 
 class Entity:
@@ -17,34 +19,186 @@ class Entity:
         self.name = name
 
 
+class SyntheticNames(Sequence):
+    # Names "<prefix><i>" for i in range(size), generated on demand
+    def __init__(self, prefix: str, size: int):
+        self.prefix = prefix
+        self.size = size
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return [self[i] for i in range(*idx.indices(self.size))]
+        if idx < 0:
+            idx += self.size
+        if not 0 <= idx < self.size:
+            raise IndexError("entity index out of range")
+        return f"{self.prefix}{idx}"
+
+
+class NameFile(Sequence):
+    # Names read from a file with one name per line.  The file is memory-
+    # mapped and only its line offsets are kept, computed on first access.
+    def __init__(self, path: str):
+        self.path = path
+        self.buf = None
+        self.offsets = None
+
+    def _load(self):
+        with open(self.path, "rb") as f:
+            self.buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        data = np.frombuffer(self.buf, dtype=np.uint8)
+        ends = np.flatnonzero(data == ord("\n"))
+        if len(data) and data[-1] != ord("\n"):
+            ends = np.append(ends, len(data))
+        self.offsets = np.concatenate([[0], ends + 1])
+
+    def __len__(self):
+        if self.offsets is None:
+            self._load()
+        return len(self.offsets) - 1
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return [self[i] for i in range(*idx.indices(len(self)))]
+        if idx < 0:
+            idx += len(self)
+        if not 0 <= idx < len(self):
+            raise IndexError("entity index out of range")
+        start, end = self.offsets[idx], self.offsets[idx + 1] - 1
+        return self.buf[start:end].decode().rstrip("\r")
+
+    def __getstate__(self):
+        # mmaps cannot be pickled; workers reopen the file on first access
+        return {"path": self.path, "buf": None, "offsets": None}
+
+
 class World:
-    def __init__(self, world_file=None):
-        if world_file is None:
-            world_file = os.path.join(os.path.dirname(__file__), "world.json")
-        with open(world_file, "r") as fin:
-            self.entities = json.load(fin)
-        self.ptrs = {k: -1 for k in self.entities.keys()}
+    # Entities are interned: each type's names keep their file order and an
+    # entity is referred to by its index into that list.  Names are only
+    # looked up when actions are rendered.  All randomness in a story is
+    # drawn from `rng`, so worlds with their own generators are independent.
+    #
+    # With sampling="shuffle" (the default) every reset() shuffles each
+    # type's draw order and get_* walk it, which costs O(vocabulary) per
+    # story.  sampling="index" instead draws ids without replacement by
+    # rejection sampling, and the oracle only tracks entities a story uses,
+    # so per-story cost does not depend on vocabulary size.  This is meant
+    # for large vocabularies such as World.synthetic(...) or
+    # World.from_name_files(...); the two modes draw different stories for
+    # the same seed.
+    def __init__(
+        self,
+        world_file=None,
+        rng: np.random.Generator = None,
+        entities: Dict[str, Sequence] = None,
+        sampling: str = "shuffle",
+    ):
+        if entities is None:
+            if world_file is None:
+                world_file = os.path.join(os.path.dirname(__file__), "world.json")
+            with open(world_file, "r") as fin:
+                entities = json.load(fin)
+        if sampling not in ("shuffle", "index"):
+            raise ValueError(f"Unknown sampling mode: {sampling}")
+        self.entities = entities
+        self.sampling = sampling
+        self.ids = None
+        if sampling == "shuffle":
+            # Per-story draw order of entity ids, reshuffled on every reset
+            self.order = {k: list(range(len(v))) for k, v in entities.items()}
+            self.ptrs = {k: -1 for k in entities.keys()}
+        else:
+            # Ids drawn so far in the current story
+            self.drawn = {k: set() for k in entities.keys()}
+        self.rng = rng if rng is not None else np.random.default_rng()
+
+    @classmethod
+    def synthetic(
+        cls, sizes: Dict[str, int], rng: np.random.Generator = None
+    ) -> "World":
+        # A world of generated names ("Agent17", "location_3", ...) with
+        # sizes[typ] entities of each type, drawn with sampling="index"
+        prefixes = {
+            "agents": "Agent",
+            "locations": "location_",
+            "objects": "object_",
+            "containers": "container_",
+        }
+        entities = {
+            typ: SyntheticNames(prefixes.get(typ, f"{typ}_"), size)
+            for typ, size in sizes.items()
+        }
+        return cls(rng=rng, entities=entities, sampling="index")
+
+    @classmethod
+    def from_name_files(
+        cls, paths: Dict[str, str], rng: np.random.Generator = None
+    ) -> "World":
+        # A world whose names are read lazily from one file per entity type
+        entities = {typ: NameFile(path) for typ, path in paths.items()}
+        return cls(rng=rng, entities=entities, sampling="index")
 
     def reset(self):
-        for k, v in self.entities.items():
+        if self.sampling == "index":
+            for drawn in self.drawn.values():
+                drawn.clear()
+            return
+        for k, v in self.order.items():
             self.ptrs[k] = -1
-            random.shuffle(v)
+            self.rng.shuffle(v)
+
+    def size(self, typ):
+        return len(self.entities[typ])
+
+    def name(self, typ, idx):
+        if idx is None:
+            return None
+        return self.entities[typ][idx]
+
+    def get_id(self, typ, name):
+        if self.ids is None:
+            self.ids = {
+                k: {name: i for i, name in enumerate(v)}
+                for k, v in self.entities.items()
+            }
+        return self.ids[typ][name]
 
     def get_all(self, typ):
-        return self.entities[typ]
+        if self.sampling == "index":
+            raise ValueError("get_all needs sampling='shuffle'")
+        return self.order[typ]
+
+    def entity_at(self, typ, pos):
+        # The entity at position `pos` of this story's draw order
+        if self.sampling == "index":
+            return pos
+        return self.order[typ][pos]
+
+    def draw(self, typ):
+        # Next entity of `typ` not yet drawn in this story
+        if self.sampling == "shuffle":
+            self.ptrs[typ] += 1
+            return self.order[typ][self.ptrs[typ]]
+        drawn, size = self.drawn[typ], self.size(typ)
+        if len(drawn) >= size:
+            raise IndexError(f"All {size} {typ} are already in this story")
+        idx = int(self.rng.integers(0, size))
+        while idx in drawn:
+            idx = int(self.rng.integers(0, size))
+        drawn.add(idx)
+        return idx
 
     def get_agent(self):
-        self.ptrs["agents"] += 1
-        return self.entities["agents"][self.ptrs["agents"]]
+        return self.draw("agents")
 
     def get_location(self):
-        self.ptrs["locations"] += 1
-        return self.entities["locations"][self.ptrs["locations"]]
+        return self.draw("locations")
 
     def get_object(self):
-        self.ptrs["objects"] += 1
-        return self.entities["objects"][self.ptrs["objects"]]
+        return self.draw("objects")
 
     def get_container(self):
-        self.ptrs["containers"] += 1
-        return self.entities["containers"][self.ptrs["containers"]]
+        return self.draw("containers")
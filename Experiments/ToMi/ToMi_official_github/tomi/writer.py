@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+# Copyright (c) 2019-present, Facebook, Inc.
+# All rights reserved.
+#
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+
+
+import csv
+import gzip
+from .actions import render_group, render_story
+from .story import StoryType
+from typing import Dict, List
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+# Flush buffered output once this many characters have accumulated
+BUFFER_SIZE = 1 << 20
+
+# File suffix appended to the .txt/.trace paths for each compression mode
+COMPRESSION_SUFFIXES = {None: "", "gzip": ".gz", "zstd": ".zst"}
+
+# Columns of the per-story-group CSV (see create_tomi_csv.py)
+CSV_COLUMNS = [
+    "Story",
+    "Reality Question",
+    "Reality Answer",
+    "Memory Question",
+    "Memory Answer",
+    "First-Order Belief A Question",
+    "First-Order Belief A Answer",
+    "First-Order Belief B Question",
+    "First-Order Belief B Answer",
+    "Second-Order Belief A Question",
+    "Second-Order Belief A Answer",
+    "Second-Order Belief B Question",
+    "Second-Order Belief B Answer",
+]
+
+# CSV column prefix for each question trace label
+QUESTION_COLUMNS = {
+    "reality": ["Reality"],
+    "memory": ["Memory"],
+    "first_order": ["First-Order Belief A", "First-Order Belief B"],
+    "second_order": ["Second-Order Belief A", "Second-Order Belief B"],
+}
+
+
+def open_output(path: str, compression: str = None):
+    # Binary stream for `path`.  Compressed streams can be concatenated
+    # byte-wise, which is how sharded outputs are merged.
+    if compression is None:
+        return open(path, "wb")
+    elif compression == "gzip":
+        return gzip.open(path, "wb", compresslevel=6)
+    elif compression == "zstd":
+        if zstandard is None:
+            raise ImportError("zstd compression requires the zstandard package")
+        return zstandard.ZstdCompressor().stream_writer(open(path, "wb"))
+    raise ValueError(f"Unknown compression: {compression}")
+
+
+def story_row(
+    stories: List[list], traces: List[List[str]], story_type: StoryType = None
+) -> Dict[str, str]:
+    # The CSV row create_tomi_csv.py would parse out of this story group's
+    # text, built from the generator's own labels.  The question type comes
+    # from the trace, and the first question of a kind is the A column.
+    row = {column: "" for column in CSV_COLUMNS}
+    chapter = stories[0][:-1]
+    row["Story"] = "\n".join(render_story(chapter, sep=". "))
+    seen = {}
+    for story, trace in zip(stories, traces):
+        kind = next(k for k in QUESTION_COLUMNS if trace[-1].startswith(k))
+        prefix = QUESTION_COLUMNS[kind][min(seen.get(kind, 0), 1)]
+        seen[kind] = seen.get(kind, 0) + 1
+        question, answer = story[-1].render().split("\t")[:2]
+        row[f"{prefix} Question"] = question
+        row[f"{prefix} Answer"] = answer
+    return row
+
+
+class StoryWriter(object):
+    # Sink for the .txt/.trace pair.  Story groups are serialized into an
+    # in-memory buffer and written out in large chunks instead of one
+    # print + flush per story variant.
+    def __init__(
+        self,
+        stories_path: str,
+        trace_path: str,
+        compression: str = None,
+        buffer_size: int = BUFFER_SIZE,
+    ):
+        self.stories_f = open_output(stories_path, compression)
+        self.trace_f = open_output(trace_path, compression)
+        self.buffer_size = buffer_size
+        self.stories_buf = []
+        self.trace_buf = []
+        self.buffered = 0
+
+    def write(
+        self, stories: List[list], traces: List[List[str]], story_type: StoryType
+    ):
+        for text, trace in zip(render_group(stories), traces):
+            self.stories_buf.append(text)
+            self.trace_buf.append(",".join(trace + [story_type.value]))
+            self.buffered += len(text)
+        if self.buffered >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        if self.stories_buf:
+            self.stories_f.write(("\n".join(self.stories_buf) + "\n").encode())
+            self.trace_f.write(("\n".join(self.trace_buf) + "\n").encode())
+        self.stories_buf, self.trace_buf = [], []
+        self.buffered = 0
+
+    def close(self):
+        self.flush()
+        self.stories_f.close()
+        self.trace_f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class CsvWriter(object):
+    # Sink writing one CSV row per story group straight from the generator,
+    # skipping the .txt round-trip through create_tomi_csv.py.
+    def __init__(self, path: str, buffer_size: int = BUFFER_SIZE):
+        self.f = open(path, "w", newline="", buffering=buffer_size)
+        self.writer = csv.DictWriter(
+            self.f, fieldnames=CSV_COLUMNS, lineterminator="\n"
+        )
+        self.writer.writeheader()
+
+    def write(
+        self, stories: List[list], traces: List[List[str]], story_type: StoryType
+    ):
+        self.writer.writerow(story_row(stories, traces, story_type))
+
+    def close(self):
+        self.f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()